@@ -41,12 +41,15 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "django.contrib.gis",
+    "django.contrib.postgres",
     "rest_framework",
     "restaurants",
     "rest_framework.authtoken",
 ]
 
 MIDDLEWARE = [
+    "restaurants.instrumentation.ServerTimingMiddleware",
+    "restaurants.routing.ReplicaPinMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -59,7 +62,16 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "restaurants.authentication.CachedTokenAuthentication",
+    ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "restaurants.rendering.OrjsonRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "restaurants.rendering.OrjsonParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
     ],
 }
 
@@ -83,20 +95,59 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "dineQ.wsgi.application"
 
+# Route the async variants of I/O-heavy views; enable when serving
+# dineQ.asgi.application.
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "False").lower() in ("true", "1")
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Each process keeps up to DB_POOL_MAX_SIZE connections per database and
+# lends them to requests (restaurants/db_pool.py); callers wait up to
+# DB_POOL_TIMEOUT seconds when all are busy. Connections are replaced after
+# DB_POOL_MAX_LIFETIME seconds, closed down to DB_POOL_MIN_SIZE after
+# DB_POOL_MAX_IDLE idle seconds, and pinged before reuse once idle for
+# DB_POOL_CHECK_AFTER seconds. DB_POOL_MAX_SIZE=0 turns the pool off in
+# favour of Django's per-thread persistent connections (DB_CONN_MAX_AGE).
+DB_POOL = {
+    "MIN_SIZE": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+    "MAX_SIZE": int(os.getenv("DB_POOL_MAX_SIZE", "20")),
+    "TIMEOUT": float(os.getenv("DB_POOL_TIMEOUT", "5")),
+    "MAX_LIFETIME": int(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+    "MAX_IDLE": int(os.getenv("DB_POOL_MAX_IDLE", "300")),
+    "CHECK_AFTER": int(os.getenv("DB_POOL_CHECK_AFTER", "30")),
+}
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.contrib.gis.db.backends.postgis",
+        "ENGINE": (
+            "restaurants.backends.postgis_pool"
+            if DB_POOL["MAX_SIZE"]
+            else "django.contrib.gis.db.backends.postgis"
+        ),
         "NAME": os.getenv("DB_NAME"),
         "USER": os.getenv("DB_USER"),
         "PASSWORD": os.getenv("DB_PASSWORD"),
         "HOST": os.getenv("DB_HOST"),
         "PORT": os.getenv("DB_PORT"),
+        # Pooled connections go back to the pool at the end of each request.
+        "CONN_MAX_AGE": 0
+        if DB_POOL["MAX_SIZE"]
+        else int(os.getenv("DB_CONN_MAX_AGE", "60")),
+        "CONN_HEALTH_CHECKS": True,
+        "POOL": DB_POOL,
     }
 }
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", "dineq"),
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -115,6 +166,14 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+PASSWORD_HASHERS = [
+    "restaurants.hashers.ConfigurablePBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+]
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", "600000"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
@@ -138,8 +197,168 @@ STATIC_ROOT = BASE_DIR / "build/static"
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
-GDAL_LIBRARY_PATH = "/opt/homebrew/Cellar/gdal/3.6.4_4/lib/libgdal.dylib"
-GEOS_LIBRARY_PATH = "/opt/homebrew/Cellar//geos/3.11.2/lib/libgeos_c.dylib"
+
+
+# GDAL and GEOS are loaded from GDAL_LIBRARY_PATH and GEOS_LIBRARY_PATH when
+# set, else from Homebrew's lib directory on macOS; left as None, Django
+# finds them on the system library path (libgdal.so and libgeos_c.so from
+# the distribution's packages on Linux).
+def homebrew_library(name):
+    for prefix in ("/opt/homebrew", "/usr/local"):
+        path = os.path.join(prefix, "lib", name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+GDAL_LIBRARY_PATH = os.getenv("GDAL_LIBRARY_PATH") or homebrew_library("libgdal.dylib")
+GEOS_LIBRARY_PATH = os.getenv("GEOS_LIBRARY_PATH") or homebrew_library(
+    "libgeos_c.dylib"
+)
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
+GOOGLE_PLACES_BASE_URL = os.getenv(
+    "GOOGLE_PLACES_BASE_URL", "https://maps.googleapis.com/maps/api/place"
+)
 SANDBOX_APPLICATION_ID = os.getenv("SANDBOX_APPLICATION_ID")
 SQUARE_SANDBOX_ACCESS_TOKEN = os.getenv("SQUARE_SANDBOX_ACCESS_TOKEN")
+SQUARE_ENVIRONMENT = os.getenv("SQUARE_ENVIRONMENT", "sandbox")
+SQUARE_ACCESS_TOKEN = os.getenv("SQUARE_ACCESS_TOKEN", SQUARE_SANDBOX_ACCESS_TOKEN)
+# Overrides SQUARE_ENVIRONMENT, e.g. to point at a local fake or a proxy.
+SQUARE_BASE_URL = os.getenv("SQUARE_BASE_URL")
+SQUARE_CONNECT_TIMEOUT = float(os.getenv("SQUARE_CONNECT_TIMEOUT", "3.05"))
+SQUARE_READ_TIMEOUT = float(os.getenv("SQUARE_READ_TIMEOUT", "10"))
+SQUARE_MAX_RETRIES = int(os.getenv("SQUARE_MAX_RETRIES", "2"))
+SQUARE_RETRY_BACKOFF = float(os.getenv("SQUARE_RETRY_BACKOFF", "0.5"))
+SEATING_STRATEGY = os.getenv("SEATING_STRATEGY", "fifo")
+SEATING_WINDOW = int(os.getenv("SEATING_WINDOW", "0")) or None
+SEATING_MAX_WAIT_MINUTES = int(os.getenv("SEATING_MAX_WAIT_MINUTES", "30"))
+EVENT_BROKER_BACKEND = os.getenv(
+    "EVENT_BROKER_BACKEND", "restaurants.events.InProcessBackend"
+)
+EVENT_SUBSCRIBER_BUFFER = int(os.getenv("EVENT_SUBSCRIBER_BUFFER", "32"))
+EVENT_STREAM_HEARTBEAT_SECONDS = int(os.getenv("EVENT_STREAM_HEARTBEAT_SECONDS", "15"))
+EVENT_STREAM_MAX_SECONDS = int(os.getenv("EVENT_STREAM_MAX_SECONDS", "300"))
+EVENT_STREAM_RETRY_MS = int(os.getenv("EVENT_STREAM_RETRY_MS", "3000"))
+# Lets users/events/ identify a diner by ?email= instead of ?token=, for
+# clients that predate tokens. Anyone knowing an email can then follow that
+# diner's queue.
+EVENT_STREAM_ALLOW_EMAIL = os.getenv("EVENT_STREAM_ALLOW_EMAIL", "False").lower() in (
+    "true",
+    "1",
+)
+WAIT_ESTIMATE_ALPHA = float(os.getenv("WAIT_ESTIMATE_ALPHA", "0.2"))
+WAIT_ESTIMATE_MIN_SAMPLES = int(os.getenv("WAIT_ESTIMATE_MIN_SAMPLES", "5"))
+WAIT_ESTIMATE_MAX_PARTY_SIZE = int(os.getenv("WAIT_ESTIMATE_MAX_PARTY_SIZE", "8"))
+WAIT_ESTIMATE_DEFAULT_SECONDS_PER_POSITION = int(
+    os.getenv("WAIT_ESTIMATE_DEFAULT_SECONDS_PER_POSITION", "180")
+)
+QUEUE_ENTRY_TIMEOUT_MINUTES = int(os.getenv("QUEUE_ENTRY_TIMEOUT_MINUTES", "120"))
+SEAT_TIMEOUT_MINUTES = int(os.getenv("SEAT_TIMEOUT_MINUTES", "180"))
+SWEEPER_BATCH_SIZE = int(os.getenv("SWEEPER_BATCH_SIZE", "500"))
+# Clients that last synced the menu longer ago than this get the full menu.
+MENU_CHANGE_RETENTION_HOURS = int(os.getenv("MENU_CHANGE_RETENTION_HOURS", "24"))
+AVAILABILITY_CACHE_SECONDS = int(os.getenv("AVAILABILITY_CACHE_SECONDS", "5"))
+AVAILABILITY_MAX_PLACE_IDS = int(os.getenv("AVAILABILITY_MAX_PLACE_IDS", "100"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_SECONDS = int(os.getenv("TOKEN_CACHE_SECONDS", "300"))
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv(
+    "RATE_LIMIT_BACKEND", "restaurants.throttling.LocalBucketBackend"
+)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_CACHE_SECONDS = int(os.getenv("RATE_LIMIT_CACHE_SECONDS", "3600"))
+RATE_LIMIT_TRUST_FORWARDED_FOR = (
+    os.getenv("RATE_LIMIT_TRUST_FORWARDED_FOR", "false").lower() == "true"
+)
+# Token-bucket budgets per endpoint and identity; "10/min" allows bursts of
+# 10 and refills at 10 tokens a minute.
+RATE_LIMITS = {
+    "login": {"ip": "30/min", "user": "10/min"},
+    "register": {"ip": "10/min"},
+    "join-queue": {"ip": "60/min", "user": "10/min", "restaurant": "600/min"},
+    "place-order": {"ip": "60/min", "user": "20/min", "restaurant": "300/min"},
+    "upsert-menu": {"ip": "20/min", "restaurant": "10/min"},
+}
+SQUARE_MAX_CONCURRENCY = int(os.getenv("SQUARE_MAX_CONCURRENCY", "16"))
+SQUARE_POOL_MAXSIZE = int(os.getenv("SQUARE_POOL_MAXSIZE", SQUARE_MAX_CONCURRENCY))
+LOAD_SHED_RETRY_AFTER_SECONDS = int(os.getenv("LOAD_SHED_RETRY_AFTER_SECONDS", "1"))
+SQUARE_BREAKER_WINDOW_SECONDS = int(os.getenv("SQUARE_BREAKER_WINDOW_SECONDS", "30"))
+SQUARE_BREAKER_MIN_CALLS = int(os.getenv("SQUARE_BREAKER_MIN_CALLS", "10"))
+SQUARE_BREAKER_FAILURE_RATE = float(os.getenv("SQUARE_BREAKER_FAILURE_RATE", "0.5"))
+SQUARE_BREAKER_OPEN_SECONDS = int(os.getenv("SQUARE_BREAKER_OPEN_SECONDS", "15"))
+SQUARE_BREAKER_HALF_OPEN_PROBES = int(os.getenv("SQUARE_BREAKER_HALF_OPEN_PROBES", "2"))
+# Concurrent calls allowed into each Square API area.
+SQUARE_BULKHEADS = {
+    "orders": int(os.getenv("SQUARE_BULKHEAD_ORDERS", "8")),
+    "inventory": int(os.getenv("SQUARE_BULKHEAD_INVENTORY", "4")),
+    "invoices": int(os.getenv("SQUARE_BULKHEAD_INVOICES", "4")),
+    "terminal": int(os.getenv("SQUARE_BULKHEAD_TERMINAL", "4")),
+    "catalog": int(os.getenv("SQUARE_BULKHEAD_CATALOG", "2")),
+}
+SQUARE_BULKHEAD_DEFAULT = int(os.getenv("SQUARE_BULKHEAD_DEFAULT", "4"))
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "true").lower() == "true"
+# When set, /metrics/ requires "Authorization: Bearer <METRICS_TOKEN>".
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "restaurants": {
+            "handlers": ["console"],
+            "level": os.getenv("LOG_LEVEL", "INFO"),
+        },
+    },
+}
+# The async views wait on Square without holding a thread, so they are
+# capped separately and far higher than the sync worker pool.
+SQUARE_ASYNC_MAX_CONCURRENCY = int(os.getenv("SQUARE_ASYNC_MAX_CONCURRENCY", "512"))
+SQUARE_ASYNC_BULKHEAD = int(os.getenv("SQUARE_ASYNC_BULKHEAD", "256"))
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "256"))
+ASYNC_HTTP_POOLS = int(os.getenv("ASYNC_HTTP_POOLS", "16"))
+RESTAURANT_PAGE_SIZE = int(os.getenv("RESTAURANT_PAGE_SIZE", "50"))
+RESTAURANT_MAX_PAGE_SIZE = int(os.getenv("RESTAURANT_MAX_PAGE_SIZE", "200"))
+# Menu snapshots are rebuilt on upsert and dropped on inventory changes;
+# the timeout only bounds staleness after edits made outside the API.
+MENU_SNAPSHOT_SECONDS = int(os.getenv("MENU_SNAPSHOT_SECONDS", "3600"))
+MENU_SEARCH_RADIUS_METERS = int(os.getenv("MENU_SEARCH_RADIUS_METERS", "5000"))
+MENU_SEARCH_MAX_RADIUS_METERS = int(os.getenv("MENU_SEARCH_MAX_RADIUS_METERS", "50000"))
+MENU_SEARCH_MAX_RESULTS = int(os.getenv("MENU_SEARCH_MAX_RESULTS", "50"))
+# Square signs webhooks with this key over the exact notification URL it
+# was configured with; set SQUARE_WEBHOOK_URL when a proxy rewrites it.
+SQUARE_WEBHOOK_SIGNATURE_KEY = os.getenv("SQUARE_WEBHOOK_SIGNATURE_KEY")
+SQUARE_WEBHOOK_URL = os.getenv("SQUARE_WEBHOOK_URL")
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "200"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+# Events younger than this wait a little, so one about an order placed a
+# moment ago finds the order's local row.
+WEBHOOK_SETTLE_SECONDS = int(os.getenv("WEBHOOK_SETTLE_SECONDS", "2"))
+# Square side effects run from the task queue; failed tasks back off
+# exponentially up to TASK_BACKOFF_MAX_SECONDS and are dead after
+# TASK_MAX_ATTEMPTS tries. A claimed task is retried if its worker has not
+# finished it within TASK_LEASE_SECONDS.
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "8"))
+TASK_BACKOFF_SECONDS = int(os.getenv("TASK_BACKOFF_SECONDS", "2"))
+TASK_BACKOFF_MAX_SECONDS = int(os.getenv("TASK_BACKOFF_MAX_SECONDS", "600"))
+TASK_LEASE_SECONDS = int(os.getenv("TASK_LEASE_SECONDS", "120"))
+TASK_POLL_SECONDS = float(os.getenv("TASK_POLL_SECONDS", "1"))
+TASK_COUNT_SECONDS = int(os.getenv("TASK_COUNT_SECONDS", "15"))
+TASK_WORKER_CONCURRENCY = int(os.getenv("TASK_WORKER_CONCURRENCY", "16"))
+TASK_RETENTION_HOURS = int(os.getenv("TASK_RETENTION_HOURS", "72"))
+# Read replicas as comma-separated host[:port] entries, sharing the
+# primary's database name and credentials. Pure-read views are served from
+# them; a client that wrote within DATABASE_REPLICA_PIN_SECONDS reads from
+# the primary so it sees its own writes.
+for index, replica in enumerate(
+    filter(None, os.getenv("DATABASE_REPLICA_HOSTS", "").split(",")), start=1
+):
+    host, _, port = replica.strip().partition(":")
+    DATABASES[f"replica_{index}"] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": port or DATABASES["default"]["PORT"],
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+DATABASE_ROUTERS = ["restaurants.routing.ReplicaRouter"]
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv("DATABASE_REPLICA_PIN_SECONDS", "5"))
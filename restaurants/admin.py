@@ -1,12 +1,27 @@
 from django.contrib import admin
 from django.contrib.gis.admin import OSMGeoAdmin
+from django.utils import timezone
 
-from .models import Category, Item, Queue, Restaurant, Variation, User, Order
+from .models import (
+    Category,
+    Item,
+    Order,
+    Queue,
+    Restaurant,
+    SeatingEvent,
+    Task,
+    TurnoverStat,
+    User,
+    Variation,
+    WebhookEvent,
+)
 
 
 @admin.register(Restaurant)
 class RestaurantAdmin(OSMGeoAdmin):
     list_display = ("name", "location", "verified", "total_seats", "available_seats")
+    # Bumped by menu changes; saving the form must not roll it back.
+    readonly_fields = ("menu_version",)
 
 
 @admin.register(Category)
@@ -34,4 +49,32 @@ class UserAdmin(admin.ModelAdmin):
     
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ("user", "unique_order_identifier", "order_id")
\ No newline at end of file
+    list_display = ("user", "unique_order_identifier", "order_id")
+
+
+@admin.register(SeatingEvent)
+class SeatingEventAdmin(admin.ModelAdmin):
+    list_display = ("restaurant", "user", "kind", "party_size", "created_at")
+
+
+@admin.register(TurnoverStat)
+class TurnoverStatAdmin(admin.ModelAdmin):
+    list_display = ("restaurant", "party_size", "wait_per_position", "dining_seconds")
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ("event_type", "event_id", "received_at", "processed_at", "attempts")
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ("name", "status", "attempts", "run_at", "last_error")
+    list_filter = ("status", "name")
+    actions = ["requeue"]
+
+    @admin.action(description="Requeue selected dead tasks")
+    def requeue(self, request, queryset):
+        queryset.filter(status=Task.DEAD).update(
+            status=Task.PENDING, attempts=0, run_at=timezone.now(), finished_at=None
+        )
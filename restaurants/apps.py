@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete
 
 
 class RestaurantsConfig(AppConfig):
-    default_auto_field = 'django.db.models.BigAutoField'
-    name = 'restaurants'
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "restaurants"
+
+    def ready(self):
+        from .instrumentation import install_query_timer
+        from .menu_changes import KINDS, record_deletion
+
+        connection_created.connect(install_query_timer)
+        for model in KINDS:
+            post_delete.connect(record_deletion, sender=model)
@@ -0,0 +1,138 @@
+import asyncio
+import itertools
+import weakref
+
+from django.conf import settings
+
+from .instrumentation import timed
+from .rendering import dumps
+from .resilience import get_guard
+from .square_client import RETRY_STATUSES, get_square_client
+
+# Non-blocking Square and Google Places calls for the async views. Square
+# calls go through the same circuit breakers as the SDK client, share its
+# base URL, token and API version, and retry the same statuses.
+
+# httpcore rescans every connection in a pool whenever a request starts or
+# finishes, so one large pool costs time quadratic in concurrency. Requests
+# are spread round-robin over several small pools instead.
+_pools = weakref.WeakKeyDictionary()
+
+
+def get_http_client():
+    """A pooled httpx client for the running event loop."""
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        connections = max(
+            settings.ASYNC_HTTP_MAX_CONNECTIONS // settings.ASYNC_HTTP_POOLS, 1
+        )
+        # Loading the CA bundle is slow; every pool shares one context.
+        ssl_context = httpx.create_ssl_context()
+        clients = [
+            httpx.AsyncClient(
+                verify=ssl_context,
+                limits=httpx.Limits(
+                    max_connections=connections,
+                    max_keepalive_connections=connections,
+                ),
+                timeout=httpx.Timeout(
+                    settings.SQUARE_READ_TIMEOUT,
+                    connect=settings.SQUARE_CONNECT_TIMEOUT,
+                ),
+            )
+            for _ in range(settings.ASYNC_HTTP_POOLS)
+        ]
+        pool = _pools[loop] = (clients, itertools.cycle(clients))
+    return next(pool[1])
+
+
+async def close_http_clients():
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        for client in pool[0]:
+            await client.aclose()
+
+
+def retry_delay(attempt, response=None):
+    retry_after = response.headers.get("Retry-After") if response else None
+    if retry_after and retry_after.isdigit():
+        return int(retry_after)
+    return settings.SQUARE_RETRY_BACKOFF * 2**attempt
+
+
+class SquareResponse:
+    """The parts of the SDK's ApiResponse the views use."""
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.body = response.json() if response.content else {}
+        self.errors = self.body.get("errors")
+
+    def is_success(self):
+        return 200 <= self.status_code < 300
+
+    def is_error(self):
+        return not self.is_success()
+
+
+async def send(method, path, body=None):
+    import httpx
+
+    config = get_square_client().client.config
+    url = config.get_base_uri() + path
+    headers = {
+        "Authorization": f"Bearer {config.access_token}",
+        "Square-Version": config.square_version,
+        "Content-Type": "application/json",
+    }
+    content = dumps(body) if body is not None else None
+    client = get_http_client()
+    for attempt in range(settings.SQUARE_MAX_RETRIES + 1):
+        last = attempt == settings.SQUARE_MAX_RETRIES
+        try:
+            response = await client.request(
+                method, url, content=content, headers=headers
+            )
+        except httpx.TransportError:
+            if last:
+                raise
+            await asyncio.sleep(retry_delay(attempt))
+            continue
+        if response.status_code not in RETRY_STATUSES or last:
+            return SquareResponse(response)
+        await asyncio.sleep(retry_delay(attempt, response))
+
+
+async def call(api, method, path, body=None):
+    return await get_guard(api).acall(send, method, path, body)
+
+
+async def create_order(body):
+    return await call("orders", "POST", "/v2/orders", body)
+
+
+async def retrieve_order(order_id):
+    return await call("orders", "GET", f"/v2/orders/{order_id}")
+
+
+async def get_invoice(invoice_id):
+    return await call("invoices", "GET", f"/v2/invoices/{invoice_id}")
+
+
+async def create_invoice(body):
+    return await call("invoices", "POST", "/v2/invoices", body)
+
+
+async def create_terminal_checkout(body):
+    return await call("terminal", "POST", "/v2/terminals/checkouts", body)
+
+
+async def nearby_search(params):
+    with timed("google.places"):
+        response = await get_http_client().get(
+            f"{settings.GOOGLE_PLACES_BASE_URL}/nearbysearch/json", params=params
+        )
+    return response.json()
@@ -0,0 +1,410 @@
+import functools
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.http import Http404
+from rest_framework.authentication import get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import async_upstreams
+from .authentication import CachedTokenAuthentication, issue_token
+from .hashing import HashingPoolFull, get_hashing_pool
+from .models import Order, Restaurant, Task, User, Variation
+from .rendering import JsonResponse, loads
+from .resilience import SquareUnreachable
+from .routing import replica_reads
+from .square_tasks import (
+    LOCATION_ID,
+    acreate_checkout,
+    acreate_order_invoice,
+    create_checkout,
+)
+from .tasks import arun_now, enqueue
+from .throttling import (
+    Overloaded,
+    check_rate,
+    client_ip,
+    rate_limit,
+    square_async_bound,
+    throttled_response,
+)
+from .views import record_order
+
+# Async counterparts of the views in views.py for the ASGI deployment. They
+# are routed in place of the sync views when ASYNC_VIEWS is enabled.
+# csrf_exempt in Django 4.2 wraps views in a sync function, so the attribute
+# it sets is assigned directly instead.
+
+
+def busy_response():
+    response = JsonResponse(
+        {"error": "Server is busy, please retry shortly"}, status=503
+    )
+    response["Retry-After"] = "1"
+    return response
+
+
+@rate_limit("register")
+async def register(request):
+    if request.method == "POST":
+        data = loads(request.body)
+        email = data.get("email", None)
+        password = data.get("password", None)
+
+        if not email or not password:
+            return JsonResponse({"error": "Email and Password required"}, status=400)
+
+        try:
+            if await User.objects.filter(email=email).aexists():
+                return JsonResponse(
+                    {"error": "A user with this email already exists"}, status=400
+                )
+
+            encoded = await get_hashing_pool().make_password(password)
+            await User.objects.acreate(
+                email=User.objects.normalize_email(email), password=encoded
+            )
+            return JsonResponse({"success": "User created successfully"}, status=201)
+        except HashingPoolFull:
+            return busy_response()
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=400)
+    else:
+        return JsonResponse({"error": "Invalid request method"}, status=400)
+
+
+register.csrf_exempt = True
+
+
+@rate_limit("login")
+async def login(request):
+    if request.method == "POST":
+        data = loads(request.body)
+        email = data.get("email", None)
+        password = data.get("password", None)
+
+        if not email or not password:
+            return JsonResponse({"error": "Email and Password required"}, status=400)
+
+        try:
+            user = await User.objects.aget(email=email)
+        except User.DoesNotExist:
+            return JsonResponse({"error": "Invalid email or password"}, status=400)
+
+        try:
+            is_correct, upgraded = await get_hashing_pool().check_password(
+                password, user.password
+            )
+        except HashingPoolFull:
+            return busy_response()
+
+        if is_correct:
+            if upgraded:
+                user.password = upgraded
+                await user.asave(update_fields=["password"])
+            return JsonResponse(
+                {
+                    "success": "User logged in successfully",
+                    "token": await sync_to_async(issue_token)(user),
+                },
+                status=200,
+            )
+        else:
+            return JsonResponse({"error": "Invalid email or password"}, status=400)
+    else:
+        return JsonResponse({"error": "Invalid request method"}, status=400)
+
+
+login.csrf_exempt = True
+
+
+def api_errors(view):
+    """Renders load-shedding and Square outages as JSON with Retry-After,
+    and rejected tokens as 401s, as DRF does for the sync views."""
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view(request, *args, **kwargs)
+        except (Overloaded, SquareUnreachable) as e:
+            response = JsonResponse({"error": str(e.detail)}, status=e.status_code)
+            response["Retry-After"] = str(e.wait)
+            return response
+        except AuthenticationFailed as e:
+            response = JsonResponse({"error": str(e.detail)}, status=e.status_code)
+            response["WWW-Authenticate"] = CachedTokenAuthentication.keyword
+            return response
+
+    return wrapper
+
+
+async def get_request_user(request, email=None):
+    # A token that does not resolve is rejected, as DRF does for the sync
+    # views; the email is only a fallback when no token is sent.
+    if get_authorization_header(request):
+        credentials = await sync_to_async(CachedTokenAuthentication().authenticate)(
+            request
+        )
+        if credentials is None:
+            raise AuthenticationFailed("Invalid token header.")
+        return credentials[0]
+    try:
+        return await User.objects.aget(email=email)
+    except User.DoesNotExist:
+        raise Http404("No User matches the given query.")
+
+
+async def get_restaurant(place_id):
+    try:
+        return await Restaurant.objects.aget(place_id=place_id), None
+    except Restaurant.DoesNotExist:
+        return None, JsonResponse(
+            {"error": f"Restaurant with place_id: {place_id} does not exist"},
+            status=404,
+        )
+
+
+@replica_reads
+async def nearby_restaurants(request):
+    lat = request.GET.get("lat")
+    long = request.GET.get("lng")
+    radius = 5000  # radius in meters
+    user_location = Point(float(long), float(lat), srid=4326)
+    data = await async_upstreams.nearby_search(
+        {
+            "location": f"{lat},{long}",
+            "radius": radius,
+            "type": "restaurant",
+            "key": settings.GOOGLE_MAPS_API_KEY,
+        }
+    )
+
+    results = data.get("results", [])
+    restaurants = {
+        restaurant.place_id: restaurant
+        async for restaurant in Restaurant.objects.filter(
+            place_id__in=[result["place_id"] for result in results], verified=True
+        )
+    }
+    user_location_meters = user_location.transform(3857, clone=True)
+
+    nearby = []
+    for result in results:
+        restaurant = restaurants.get(result["place_id"])
+        if restaurant is None:
+            continue
+        restaurant_location_meters = restaurant.location.transform(3857, clone=True)
+        nearby.append(
+            {
+                "name": result["name"],
+                "place_id": result["place_id"],
+                "location": result["geometry"]["location"],
+                "address": result["vicinity"],
+                "rating": result.get("rating", None),
+                "user_ratings_total": result.get("user_ratings_total", None),
+                "photo_reference": result["photos"][0]["photo_reference"]
+                if result.get("photos")
+                else None,
+                "in_range": restaurant_location_meters.distance(user_location_meters)
+                <= restaurant.geo_fence_radius,
+            }
+        )
+
+    return JsonResponse(nearby, safe=False)
+
+
+@api_errors
+@square_async_bound
+async def place_order(request, place_id):
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    data = loads(request.body)
+    user = await get_request_user(request, data.get("email"))
+    wait = check_rate(
+        "place-order", ip=client_ip(request), user=user.email, restaurant=place_id
+    )
+    if wait:
+        return throttled_response(wait)
+
+    restaurant, error = await get_restaurant(place_id)
+    if error:
+        return error
+
+    order_data = data.get("order_data", [])
+    references = [item["variation_reference_id"] for item in order_data]
+    variations = {
+        variation.reference_id: variation
+        async for variation in Variation.objects.filter(reference_id__in=references)
+    }
+    for reference in references:
+        if reference not in variations:
+            return JsonResponse(
+                {"error": f"Variation with reference_id: {reference} does not exist"},
+                status=404,
+            )
+
+    line_items = [
+        {
+            "quantity": str(item["quantity"]),
+            "catalog_object_id": variations[item["variation_reference_id"]].square_id,
+        }
+        for item in order_data
+    ]
+    response = await async_upstreams.create_order(
+        {
+            "idempotency_key": str(uuid.uuid4()),
+            "order": {"location_id": LOCATION_ID, "line_items": line_items},
+        }
+    )
+    if response.is_error():
+        return JsonResponse(
+            {"error": f"Failed to place order. Error: {response.errors}"}, status=500
+        )
+    order = response.body["order"]
+
+    created_order, invoice_task = await sync_to_async(record_order)(
+        user,
+        restaurant,
+        order,
+        {variation.square_id: variation for variation in variations.values()},
+    )
+    invoice_task = await arun_now(invoice_task, acreate_order_invoice)
+    invoice_id = (
+        invoice_task.result["invoice_id"] if invoice_task.status == Task.DONE else None
+    )
+
+    return JsonResponse(
+        {
+            "message": "Order placed and inventory updated successfully",
+            "order_id": order["id"],
+            "invoice_id": invoice_id,
+            "uoi": created_order.unique_order_identifier,
+        },
+        status=200,
+    )
+
+
+place_order.csrf_exempt = True
+
+
+@api_errors
+@square_async_bound
+async def retrieve_order(request, place_id):
+    order_id = request.GET.get("order_id")
+    if not order_id:
+        return JsonResponse({"error": "order_id parameter is required"}, status=400)
+
+    try:
+        order = await Order.objects.aget(order_id=order_id)
+    except Order.DoesNotExist:
+        raise Http404("No Order matches the given query.")
+
+    # Kept current by Square's webhooks.
+    if order.square_order is not None:
+        return JsonResponse(
+            {
+                "order": order.square_order,
+                "uoi": order.unique_order_identifier,
+                "invoice_id": order.invoice_id,
+            },
+            status=200,
+        )
+
+    result = await async_upstreams.retrieve_order(order_id)
+    if result.is_error():
+        return JsonResponse(
+            {"error": result.errors, "uoi": order.unique_order_identifier}, status=400
+        )
+    order.square_order = result.body["order"]
+    await order.asave(update_fields=["square_order"])
+    return JsonResponse(
+        {
+            "order": result.body["order"],
+            "uoi": order.unique_order_identifier,
+            "invoice_id": order.invoice_id,
+        },
+        status=200,
+    )
+
+
+@api_errors
+@square_async_bound
+async def get_invoice(request, place_id):
+    invoice_id = request.GET.get("invoice_id")
+    if not invoice_id:
+        return JsonResponse({"error": "invoice_id parameter is required"}, status=400)
+
+    order = await Order.objects.filter(invoice_id=invoice_id).afirst()
+    if order is not None and order.square_invoice is not None:
+        return JsonResponse({"invoice": order.square_invoice}, status=200)
+
+    result = await async_upstreams.get_invoice(invoice_id)
+    if result.is_success():
+        invoice = result.body["invoice"]
+        await Order.objects.filter(order_id=invoice.get("order_id")).aupdate(
+            invoice_id=invoice_id, square_invoice=invoice
+        )
+        return JsonResponse(result.body, status=200)
+    else:
+        return JsonResponse({"error": result.errors}, status=500)
+
+
+@api_errors
+@square_async_bound
+async def create_terminal_checkout(request, place_id):
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    restaurant, error = await get_restaurant(place_id)
+    if error:
+        return error
+
+    data = loads(request.body)
+    uoi = data.get("uoi")
+    if not uoi:
+        return JsonResponse({"error": "uoi parameter is required"}, status=400)
+
+    try:
+        order_obj = await Order.objects.aget(unique_order_identifier=uoi)
+    except Order.DoesNotExist:
+        return JsonResponse(
+            {"error": f"Order with UOI: {uoi} does not exist"}, status=404
+        )
+
+    # Kept current by Square's webhooks.
+    order = order_obj.square_order
+    if order is None:
+        response = await async_upstreams.retrieve_order(order_obj.order_id)
+        if response.is_error():
+            return JsonResponse({"error": response.errors}, status=400)
+        order = response.body["order"]
+
+    if order["state"] != "OPEN":
+        return JsonResponse(
+            {"error": "Cannot create a checkout for a non-OPEN order"}, status=400
+        )
+
+    user = await get_request_user(request, data.get("email"))
+    checkout_task = await sync_to_async(enqueue)(
+        create_checkout,
+        order_id=order_obj.order_id,
+        user_id=user.pk,
+        amount_money=order["total_money"],
+        idempotency_key=str(uuid.uuid4()),
+    )
+    checkout_task = await arun_now(checkout_task, acreate_checkout)
+    if checkout_task.status == Task.DONE:
+        return JsonResponse(checkout_task.result, status=200)
+    return JsonResponse(
+        {
+            "message": "Checkout queued; it is retried until Square accepts it.",
+            "task_id": checkout_task.pk,
+        },
+        status=202,
+    )
+
+
+create_terminal_checkout.csrf_exempt = True
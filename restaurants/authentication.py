@@ -0,0 +1,104 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from .models import AuthToken
+from .routing import primary_reads
+
+
+class TokenCache:
+    """A thread-safe LRU map of token key to user with a per-entry TTL.
+
+    Revocation is immediate in the revoking process; other processes stop
+    accepting a revoked token once their entry expires, so the TTL bounds how
+    long a revoked token may keep working.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def set(self, key, user):
+        with self._lock:
+            self._entries[key] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def revoke(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def revoke_user(self, user_id):
+        with self._lock:
+            for key in [k for k, (u, _) in self._entries.items() if u.pk == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_SECONDS)
+
+
+def user_for_token(key):
+    user = token_cache.get(key)
+    if user is None:
+        # A token issued a moment ago may not have reached the replicas yet.
+        try:
+            with primary_reads():
+                token = AuthToken.objects.select_related("user").get(key=key)
+        except AuthToken.DoesNotExist:
+            return None
+        user = token.user
+        token_cache.set(key, user)
+    # Hand each request its own instance so views can modify it freely.
+    return copy.copy(user)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    model = AuthToken
+
+    def authenticate_credentials(self, key):
+        user = user_for_token(key)
+        if user is None:
+            raise exceptions.AuthenticationFailed("Invalid token.")
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed("User inactive or deleted.")
+        return (user, key)
+
+
+def issue_token(user):
+    token = AuthToken.objects.create(user=user)
+    token_cache.set(token.key, user)
+    return token.key
+
+
+def revoke_token(key):
+    AuthToken.objects.filter(key=key).delete()
+    token_cache.revoke(key)
+
+
+def revoke_user_tokens(user):
+    AuthToken.objects.filter(user=user).delete()
+    token_cache.revoke_user(user.pk)
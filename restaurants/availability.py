@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+
+from .caching import get_many_cached
+from .estimation import WaitTimeEstimator, preload_stats
+from .models import Restaurant
+
+
+def compute_availability(place_ids, estimate_party_size=None):
+    rows = (
+        Restaurant.objects.filter(place_id__in=place_ids)
+        .values("pk", "place_id", "available_seats", "total_seats")
+        .annotate(queue_size=Coalesce(Sum("queue__party_size"), 0))
+    )
+    snapshot = dict.fromkeys(place_ids)
+    for row in rows:
+        snapshot[row["place_id"]] = row
+
+    if estimate_party_size:
+        found = [row for row in snapshot.values() if row]
+        estimator = WaitTimeEstimator(
+            preload_stats([row["pk"] for row in found], estimate_party_size)
+        )
+        for row in found:
+            row["estimated_wait_seconds"] = (
+                estimator.estimate(
+                    row["pk"],
+                    estimate_party_size,
+                    row["queue_size"] + 1,
+                    row["total_seats"],
+                )
+                if row["available_seats"] < estimate_party_size
+                else 0
+            )
+
+    for row in snapshot.values():
+        if row:
+            del row["pk"]
+    return snapshot
+
+
+def availability_snapshot(place_ids, estimate_party_size=None):
+    """Seats, queue length and optionally a wait estimate for many
+    restaurants, served from a short-lived cache."""
+    prefix = "availability"
+    if estimate_party_size:
+        prefix = f"availability:estimate:{estimate_party_size}"
+    return get_many_cached(
+        prefix,
+        place_ids,
+        lambda ids: compute_availability(ids, estimate_party_size),
+        settings.AVAILABILITY_CACHE_SECONDS,
+    )
@@ -0,0 +1,60 @@
+from django.contrib.gis.db.backends.postgis.base import (
+    DatabaseWrapper as PostGISDatabaseWrapper,
+)
+from django.db.backends.postgresql.creation import (
+    DatabaseCreation as PostgreSQLDatabaseCreation,
+)
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from restaurants.db_pool import close_pools, get_pool
+
+# PostGIS with connections checked out of restaurants.db_pool instead of
+# opened per request. Configure the pool with the database's "POOL" dict
+# (MIN_SIZE, MAX_SIZE, TIMEOUT, MAX_LIFETIME, MAX_IDLE, CHECK_AFTER) and keep
+# CONN_MAX_AGE at 0, so every request hands its connection back when it
+# ends.
+
+
+class DatabaseCreation(PostgreSQLDatabaseCreation):
+    # Idle pooled connections to the test database would block dropping it
+    # or cloning it for parallel test runs.
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+    def _clone_test_db(self, suffix, verbosity, keepdb=False):
+        close_pools()
+        super()._clone_test_db(suffix, verbosity, keepdb)
+
+
+class DatabaseWrapper(PostGISDatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    pool = None
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict.get("POOL")
+        if not options:
+            # Unpooled, e.g. for comparison in bench_db_pool.
+            self.pool = None
+            return super().get_new_connection(conn_params)
+        connect = super().get_new_connection
+        # Kept so the connection goes back to the pool it came from.
+        self.pool = get_pool(self.alias, conn_params, options)
+        connection = self.pool.acquire(lambda: connect(conn_params))
+        # A new connection sets this as it connects; a reused one was set up
+        # by another wrapper.
+        self.isolation_level = IsolationLevel(
+            self.settings_dict["OPTIONS"].get(
+                "isolation_level", IsolationLevel.READ_COMMITTED
+            )
+        )
+        return connection
+
+    def _close(self):
+        if self.pool is None:
+            return super()._close()
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.release(self.connection)
@@ -0,0 +1,85 @@
+import math
+import random
+import time
+
+from django.core.cache import cache
+
+LOCK_SECONDS = 5
+WAIT_STEP_SECONDS = 0.01
+
+
+def get_many_cached(prefix, ids, compute, ttl, wait=0.2, beta=1.0):
+    """Returns ``{id: value}`` for ``ids``, computing misses in one batch.
+
+    ``compute(ids)`` must return a dict for the ids it was given. Entries are
+    refreshed early with probability rising towards expiry (XFetch), so hot
+    keys are usually recomputed by one request before they expire. When a key
+    does expire, only the request that wins its lock recomputes it; the others
+    serve the stale value if there is one or wait up to ``wait`` seconds for
+    the winner before computing it themselves.
+    """
+    keys = {f"{prefix}:{id_}": id_ for id_ in ids}
+    entries = cache.get_many(keys)
+    now = time.time()
+
+    values = {}
+    stale = {}
+    refresh = []
+    for key, id_ in keys.items():
+        entry = entries.get(key)
+        if entry is None:
+            refresh.append(id_)
+            continue
+        value, delta, expires_at = entry
+        if now - delta * beta * math.log(1.0 - random.random()) >= expires_at:
+            stale[id_] = value
+            refresh.append(id_)
+        else:
+            values[id_] = value
+    if not refresh:
+        return values
+
+    owned = [
+        id_ for id_ in refresh if cache.add(f"{prefix}:{id_}:lock", 1, LOCK_SECONDS)
+    ]
+    waiting = [id_ for id_ in refresh if id_ not in owned and id_ not in stale]
+    values.update(
+        {id_: stale[id_] for id_ in refresh if id_ not in owned and id_ in stale}
+    )
+
+    if owned:
+        try:
+            values.update(_compute_and_store(prefix, owned, compute, ttl))
+        finally:
+            cache.delete_many([f"{prefix}:{id_}:lock" for id_ in owned])
+
+    deadline = time.monotonic() + wait
+    while waiting and time.monotonic() < deadline:
+        time.sleep(WAIT_STEP_SECONDS)
+        found = cache.get_many([f"{prefix}:{id_}" for id_ in waiting])
+        for id_ in list(waiting):
+            entry = found.get(f"{prefix}:{id_}")
+            if entry is not None:
+                values[id_] = entry[0]
+                waiting.remove(id_)
+
+    if waiting:
+        values.update(_compute_and_store(prefix, waiting, compute, ttl))
+    return values
+
+
+def _compute_and_store(prefix, ids, compute, ttl):
+    started = time.time()
+    computed = compute(ids)
+    finished = time.time()
+    delta = finished - started
+    # Keep entries past their soft expiry so concurrent requests have a
+    # stale value to serve while one of them recomputes.
+    cache.set_many(
+        {
+            f"{prefix}:{id_}": (value, delta, finished + ttl)
+            for id_, value in computed.items()
+        },
+        ttl * 2,
+    )
+    return computed
@@ -0,0 +1,266 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+from . import metrics
+
+# An in-process pool of PostgreSQL connections per database alias, used by
+# the restaurants.backends.postgis_pool engine. Django still "closes" its
+# connection at the end of every request; the engine hands it back here
+# instead, so the next request on any thread skips the TCP, TLS and auth
+# handshake. Under ASGI, where each request runs on its own thread and
+# CONN_MAX_AGE would strand a connection per thread, this is what makes
+# connection reuse safe.
+
+pool_wait = metrics.histogram(
+    "dineq_db_pool_wait_seconds",
+    "Time spent waiting to check a connection out of the pool.",
+    ["database"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+pool_connections = metrics.gauge(
+    "dineq_db_pool_connections",
+    "Pooled connections by state: idle or in_use.",
+    ["database", "state"],
+)
+pool_events = metrics.counter(
+    "dineq_db_pool_events_total",
+    "Connections opened and closed by the pool, with the reason, and "
+    "checkouts that timed out.",
+    ["database", "event"],
+)
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+class PooledConnection:
+    def __init__(self, connection, max_lifetime):
+        self.connection = connection
+        now = time.monotonic()
+        # Spread out expiry so connections opened together are not all
+        # replaced at the same moment.
+        self.expires_at = now + max_lifetime * random.uniform(0.9, 1.0)
+        self.idle_since = now
+
+
+class ConnectionPool:
+    """Hands out at most ``max_size`` connections, making callers wait up to
+    ``timeout`` seconds for one to come back. Connections past their
+    lifetime are replaced, ones idle beyond ``max_idle`` are closed down to
+    ``min_size``, and ones idle longer than ``check_after`` are pinged
+    before reuse."""
+
+    def __init__(
+        self, alias, min_size, max_size, timeout, max_lifetime, max_idle, check_after
+    ):
+        self.alias = alias
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.idle = deque()
+        self.in_use = {}
+        self.opening = 0
+        self.condition = threading.Condition()
+
+    def size(self):
+        return len(self.idle) + len(self.in_use) + self.opening
+
+    def report(self):
+        pool_connections.set(len(self.idle), database=self.alias, state="idle")
+        pool_connections.set(len(self.in_use), database=self.alias, state="in_use")
+
+    def discard(self, pooled, reason):
+        # Closing can block on the network, so callers do not hold the lock.
+        pool_events.inc(database=self.alias, event=f"closed_{reason}")
+        try:
+            pooled.connection.close()
+        except psycopg2.Error:
+            pass
+
+    def is_healthy(self, pooled, now):
+        connection = pooled.connection
+        if connection.closed or pooled.expires_at <= now:
+            return False
+        if now - pooled.idle_since < self.check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            if (
+                connection.get_transaction_status()
+                != extensions.TRANSACTION_STATUS_IDLE
+            ):
+                connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def prune_idle(self, now):
+        """Takes the connections idle beyond ``max_idle`` out of the pool,
+        down to ``min_size``, for the caller to close."""
+        stale = []
+        # Oldest idle connections sit at the left.
+        while len(self.idle) > self.min_size:
+            if now - self.idle[0].idle_since < self.max_idle:
+                break
+            stale.append(self.idle.popleft())
+        return stale
+
+    def reserve(self, started, deadline):
+        """Moves the most recently used idle connection to ``in_use`` and
+        returns it, or reserves a slot for a new connection and returns
+        None, waiting until ``deadline`` for either."""
+        with self.condition:
+            while True:
+                if self.idle:
+                    # Most recently used first, so surplus connections go idle.
+                    pooled = self.idle.pop()
+                    self.in_use[id(pooled.connection)] = pooled
+                    return pooled
+                if self.size() < self.max_size:
+                    self.opening += 1
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.condition.wait(remaining):
+                    if self.idle or self.size() < self.max_size:
+                        continue
+                    pool_events.inc(database=self.alias, event="timeout")
+                    pool_wait.observe(time.monotonic() - started, database=self.alias)
+                    raise PoolTimeout(
+                        f"No connection to {self.alias!r} became free within "
+                        f"{self.timeout}s; all {self.max_size} are in use."
+                    )
+
+    def acquire(self, connect):
+        """Checks out a pooled connection, or one made by ``connect()``."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self.condition:
+            stale = self.prune_idle(started)
+        for pooled in stale:
+            self.discard(pooled, "idle")
+
+        while True:
+            pooled = self.reserve(started, deadline)
+            if pooled is None:
+                break
+            # Checked outside the lock, as a ping waits on the server; its
+            # place in in_use keeps others from opening one in its stead.
+            now = time.monotonic()
+            if self.is_healthy(pooled, now):
+                with self.condition:
+                    self.report()
+                pool_wait.observe(time.monotonic() - started, database=self.alias)
+                return pooled.connection
+            with self.condition:
+                del self.in_use[id(pooled.connection)]
+                self.condition.notify()
+            self.discard(pooled, "expired" if pooled.expires_at <= now else "broken")
+
+        try:
+            pooled = PooledConnection(connect(), self.max_lifetime)
+        except BaseException:
+            with self.condition:
+                self.opening -= 1
+                # A failed connect frees the slot it reserved.
+                self.condition.notify()
+            raise
+        pool_events.inc(database=self.alias, event="opened")
+        with self.condition:
+            self.opening -= 1
+            self.in_use[id(pooled.connection)] = pooled
+            self.report()
+        pool_wait.observe(time.monotonic() - started, database=self.alias)
+        return pooled.connection
+
+    def release(self, connection):
+        with self.condition:
+            pooled = self.in_use.pop(id(connection), None)
+        if pooled is None:
+            connection.close()
+            return
+
+        reusable = not connection.closed
+        if reusable:
+            status = connection.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                reusable = False
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                # Left mid-transaction, e.g. by an error in an atomic block.
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    reusable = False
+
+        now = time.monotonic()
+        expired = pooled.expires_at <= now
+        with self.condition:
+            if reusable and not expired:
+                pooled.idle_since = now
+                self.idle.append(pooled)
+            self.report()
+            self.condition.notify()
+        if not reusable:
+            self.discard(pooled, "broken")
+        elif expired:
+            self.discard(pooled, "expired")
+
+    def close(self):
+        with self.condition:
+            idle = list(self.idle)
+            self.idle.clear()
+            self.report()
+        for pooled in idle:
+            self.discard(pooled, "shutdown")
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, conn_params, options):
+    """The pool for ``alias``; a separate one per set of connection
+    parameters, so switching to the test database never reuses connections
+    to the real one."""
+    key = (alias, repr(sorted(conn_params.items())))
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(
+                    alias,
+                    min_size=options.get("MIN_SIZE", 0),
+                    max_size=options.get("MAX_SIZE", 20),
+                    timeout=options.get("TIMEOUT", 5),
+                    max_lifetime=options.get("MAX_LIFETIME", 1800),
+                    max_idle=options.get("MAX_IDLE", 300),
+                    check_after=options.get("CHECK_AFTER", 30),
+                )
+    return pool
+
+
+def close_pools():
+    """Closes every idle pooled connection, e.g. before forking."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+
+
+def _forget_pools():
+    # A forked child shares its parent's sockets; it must open its own
+    # connections rather than use or close the inherited ones.
+    _pools.clear()
+
+
+os.register_at_fork(after_in_child=_forget_pools)
@@ -0,0 +1,191 @@
+from collections import defaultdict
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import SeatingEvent, TurnoverStat
+
+ALL_PARTIES = 0
+
+
+def party_bucket(party_size):
+    return min(party_size, settings.WAIT_ESTIMATE_MAX_PARTY_SIZE)
+
+
+def ewma(current, sample, samples, alpha):
+    if samples == 0:
+        return sample
+    return current + alpha * (sample - current)
+
+
+@dataclass
+class MemoryStat:
+    wait_per_position: float = 0.0
+    wait_samples: int = 0
+    dining_seconds: float = 0.0
+    dining_samples: int = 0
+
+
+class MemoryStatStore:
+    """Keeps turnover statistics in a dict; used for offline replay."""
+
+    def __init__(self):
+        self.stats = defaultdict(MemoryStat)
+
+    def lookup(self, restaurant_id, party_size):
+        return (
+            self.stats.get((restaurant_id, party_size)),
+            self.stats.get((restaurant_id, ALL_PARTIES)),
+        )
+
+    def update(self, restaurant_id, party_size, apply):
+        apply(self.stats[(restaurant_id, party_size)])
+
+
+def preload_stats(restaurant_ids, party_size):
+    """Loads the statistics needed to estimate ``party_size`` waits at many
+    restaurants with one query."""
+    store = MemoryStatStore()
+    for stat in TurnoverStat.objects.filter(
+        restaurant_id__in=restaurant_ids,
+        party_size__in=[party_bucket(party_size), ALL_PARTIES],
+    ):
+        store.stats[(stat.restaurant_id, stat.party_size)] = stat
+    return store
+
+
+class DatabaseStatStore:
+    def lookup(self, restaurant_id, party_size):
+        stats = {
+            stat.party_size: stat
+            for stat in TurnoverStat.objects.filter(
+                restaurant_id=restaurant_id,
+                party_size__in=[party_size, ALL_PARTIES],
+            )
+        }
+        return stats.get(party_size), stats.get(ALL_PARTIES)
+
+    def update(self, restaurant_id, party_size, apply):
+        with transaction.atomic(savepoint=False):
+            stat, _ = TurnoverStat.objects.select_for_update().get_or_create(
+                restaurant_id=restaurant_id, party_size=party_size
+            )
+            apply(stat)
+            stat.save()
+
+
+class WaitTimeEstimator:
+    """Estimates queue waits from exponentially weighted turnover statistics.
+
+    Each restaurant keeps one row per party size (plus an all-sizes row) with
+    an EWMA of seconds waited per queue position and of dining time, so an
+    estimate is a single indexed lookup regardless of history length.
+    """
+
+    def __init__(self, store=None, alpha=None):
+        self.store = store or DatabaseStatStore()
+        self.alpha = alpha or settings.WAIT_ESTIMATE_ALPHA
+
+    def estimate(self, restaurant_id, party_size, position, total_seats=None):
+        min_samples = settings.WAIT_ESTIMATE_MIN_SAMPLES
+        specific, overall = self.store.lookup(restaurant_id, party_bucket(party_size))
+        for stat in (specific, overall):
+            if stat and stat.wait_samples >= min_samples:
+                return round(position * stat.wait_per_position)
+        # Without observed waits, assume seats free up at the dining turnover
+        # rate: one seat every dining_seconds / total_seats.
+        if overall and overall.dining_samples >= min_samples and total_seats:
+            return round(position * overall.dining_seconds / total_seats)
+        return position * settings.WAIT_ESTIMATE_DEFAULT_SECONDS_PER_POSITION
+
+    def observe_wait(self, restaurant_id, party_size, position, wait_seconds):
+        sample = wait_seconds / max(position, 1)
+
+        def apply(stat):
+            stat.wait_per_position = ewma(
+                stat.wait_per_position, sample, stat.wait_samples, self.alpha
+            )
+            stat.wait_samples += 1
+
+        for bucket in (party_bucket(party_size), ALL_PARTIES):
+            self.store.update(restaurant_id, bucket, apply)
+
+    def observe_dining(self, restaurant_id, party_size, dining_seconds):
+        def apply(stat):
+            stat.dining_seconds = ewma(
+                stat.dining_seconds, dining_seconds, stat.dining_samples, self.alpha
+            )
+            stat.dining_samples += 1
+
+        for bucket in (party_bucket(party_size), ALL_PARTIES):
+            self.store.update(restaurant_id, bucket, apply)
+
+
+def log_joined(restaurant, user, party_size, position):
+    SeatingEvent.objects.create(
+        restaurant=restaurant,
+        user=user,
+        kind=SeatingEvent.JOINED,
+        party_size=party_size,
+        position=position,
+    )
+
+
+def log_seated(restaurant, entries, now, estimator=None):
+    """Records queued parties (``Queue`` rows) being seated and feeds their
+    observed waits to the estimator."""
+    estimator = estimator or WaitTimeEstimator()
+    SeatingEvent.objects.bulk_create(
+        SeatingEvent(
+            restaurant=restaurant,
+            user_id=entry.user_id,
+            kind=SeatingEvent.SEATED,
+            party_size=entry.party_size,
+            position=entry.position,
+            created_at=now,
+        )
+        for entry in entries
+    )
+    for entry in entries:
+        if entry.position:
+            estimator.observe_wait(
+                restaurant.pk,
+                entry.party_size,
+                entry.position,
+                (now - entry.joined_at).total_seconds(),
+            )
+
+
+def log_seated_directly(restaurant, user, party_size):
+    SeatingEvent.objects.create(
+        restaurant=restaurant,
+        user=user,
+        kind=SeatingEvent.SEATED,
+        party_size=party_size,
+        position=0,
+    )
+
+
+def log_released(user, estimator=None):
+    seated = (
+        SeatingEvent.objects.filter(user=user, kind=SeatingEvent.SEATED)
+        .order_by("-created_at")
+        .first()
+    )
+    if seated is None:
+        return None
+
+    released = SeatingEvent.objects.create(
+        restaurant_id=seated.restaurant_id,
+        user=user,
+        kind=SeatingEvent.RELEASED,
+        party_size=seated.party_size,
+    )
+    estimator = estimator or WaitTimeEstimator()
+    estimator.observe_dining(
+        seated.restaurant_id,
+        seated.party_size,
+        (released.created_at - seated.created_at).total_seconds(),
+    )
+    return released
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import Queue
+
+
+class Subscription:
+    """An event buffer owned by one streaming response.
+
+    Publishers may run on any thread (WSGI workers, ``sync_to_async``
+    threads), so events are handed to the subscriber's event loop with
+    ``call_soon_threadsafe``. A slow client loses its oldest events rather
+    than growing the buffer; every event carries full state so a later one
+    supersedes an earlier one.
+    """
+
+    def __init__(self, channel, buffer_size):
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(buffer_size)
+
+    def deliver(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The owning loop has shut down; the stream is already gone.
+            pass
+
+    def _put(self, event):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class EventBackend(ABC):
+    @abstractmethod
+    def publish(self, channel, event):
+        """Delivers ``event`` to every subscriber of ``channel``."""
+
+    @abstractmethod
+    def subscribe(self, channel):
+        """Returns a Subscription to ``channel`` for the running event loop."""
+
+    @abstractmethod
+    def unsubscribe(self, subscription):
+        """Stops delivering to ``subscription``."""
+
+
+class InProcessBackend(EventBackend):
+    """Fans events out to subscribers in this process only. A shared backend
+    (e.g. Redis pub/sub) would forward ``publish`` to the other workers and
+    call ``deliver`` on its local subscribers the same way."""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, settings.EVENT_SUBSCRIBER_BUFFER)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(settings.EVENT_BROKER_BACKEND)()
+    return _broker
+
+
+def restaurant_channel(place_id):
+    return f"restaurant:{place_id}"
+
+
+def user_channel(user_id):
+    return f"user:{user_id}"
+
+
+def notify_availability(restaurant, queue_size):
+    get_broker().publish(
+        restaurant_channel(restaurant.place_id),
+        {
+            "type": "availability",
+            "available_seats": restaurant.available_seats,
+            "queue_size": queue_size,
+        },
+    )
+
+
+def notify_seated(restaurant, user_ids):
+    broker = get_broker()
+    for user_id in user_ids:
+        broker.publish(
+            user_channel(user_id),
+            {
+                "type": "seated",
+                "place_id": restaurant.place_id,
+                "restaurant": restaurant.name,
+            },
+        )
+
+
+def notify_position(restaurant, user_id, position):
+    get_broker().publish(
+        user_channel(user_id),
+        {"type": "position", "place_id": restaurant.place_id, "position": position},
+    )
+
+
+def notify_queue_changed(restaurant):
+    """Pushes every waiting party its new position plus the restaurant's
+    availability, using a single ordered scan of the queue."""
+    entries = (
+        Queue.objects.filter(restaurant=restaurant)
+        .order_by("joined_at")
+        .values_list("user_id", "party_size")
+    )
+    ahead = 0
+    for user_id, party_size in entries:
+        notify_position(restaurant, user_id, ahead + 1)
+        ahead += party_size
+    notify_availability(restaurant, ahead)
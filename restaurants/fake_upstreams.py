@@ -0,0 +1,319 @@
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# A stand-in for the parts of Square and Google Places that the views call,
+# for load tests that must not touch the real, rate-limited services. Point
+# SQUARE_BASE_URL at the server root and GOOGLE_PLACES_BASE_URL at
+# <root>/maps/api/place.
+
+LOCATION_ID = "LS3AWJK2V4HW5"
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def square_error(status, code, detail):
+    category = "API_ERROR" if status >= 500 else "INVALID_REQUEST_ERROR"
+    return status, {"errors": [{"category": category, "code": code, "detail": detail}]}
+
+
+class FakeUpstreamState:
+    def __init__(self, places=()):
+        self.places = list(places)
+        self.catalog = {}
+        self.inventory = {}
+        self.orders = {}
+        self.invoices = {}
+        self.checkouts = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def new_id(self, kind):
+        return f"FAKE{kind}{next(self.ids):08d}"
+
+    def resolve_id(self, object_id, id_mappings):
+        if not object_id.startswith("#"):
+            return object_id
+        for mapping in id_mappings:
+            if mapping["client_object_id"] == object_id:
+                return mapping["object_id"]
+        real_id = self.new_id("CAT")
+        id_mappings.append({"client_object_id": object_id, "object_id": real_id})
+        return real_id
+
+    def upsert_catalog_object(self, body):
+        obj = body["object"]
+        id_mappings = []
+        obj["id"] = self.resolve_id(obj["id"], id_mappings)
+        obj["version"] = int(time.time() * 1000)
+        obj["updated_at"] = now_iso()
+        item_data = obj.get("item_data", {})
+        if item_data.get("category_id"):
+            item_data["category_id"] = self.resolve_id(
+                item_data["category_id"], id_mappings
+            )
+        for variation in item_data.get("variations", []):
+            variation["id"] = self.resolve_id(variation["id"], id_mappings)
+            variation["item_variation_data"]["item_id"] = obj["id"]
+            self.catalog[variation["id"]] = variation
+        self.catalog[obj["id"]] = obj
+        return 200, {"catalog_object": obj, "id_mappings": id_mappings}
+
+    def count(self, catalog_object_id, location_id=LOCATION_ID):
+        return {
+            "catalog_object_id": catalog_object_id,
+            "catalog_object_type": "ITEM_VARIATION",
+            "state": "IN_STOCK",
+            "location_id": location_id,
+            "quantity": str(self.inventory.get(catalog_object_id, 0)),
+            "calculated_at": now_iso(),
+        }
+
+    def batch_change_inventory(self, body):
+        counts = []
+        for change in body.get("changes", []):
+            if change["type"] == "PHYSICAL_COUNT":
+                count = change["physical_count"]
+                object_id = count["catalog_object_id"]
+                self.inventory[object_id] = int(float(count["quantity"]))
+                counts.append(self.count(object_id, count["location_id"]))
+                continue
+            adjustment = change["adjustment"]
+            object_id = adjustment["catalog_object_id"]
+            quantity = int(float(adjustment["quantity"]))
+            if adjustment.get("to_state") == "IN_STOCK":
+                self.inventory[object_id] = self.inventory.get(object_id, 0) + quantity
+            elif adjustment.get("from_state") == "IN_STOCK":
+                self.inventory[object_id] = self.inventory.get(object_id, 0) - quantity
+            counts.append(self.count(object_id, adjustment["location_id"]))
+        return 200, {"counts": counts}
+
+    def batch_retrieve_inventory_counts(self, body):
+        location_id = (body.get("location_ids") or [LOCATION_ID])[0]
+        return 200, {
+            "counts": [
+                self.count(object_id, location_id)
+                for object_id in body.get("catalog_object_ids", [])
+            ]
+        }
+
+    def create_order(self, body):
+        order = body["order"]
+        total = 0
+        for line_item in order.get("line_items", []):
+            variation = self.catalog.get(line_item.get("catalog_object_id"), {})
+            price = (
+                variation.get("item_variation_data", {})
+                .get("price_money", {})
+                .get("amount", 0)
+            )
+            line_total = price * int(line_item["quantity"])
+            total += line_total
+            line_item["uid"] = self.new_id("LI")
+            line_item["base_price_money"] = {"amount": price, "currency": "USD"}
+            line_item["total_money"] = {"amount": line_total, "currency": "USD"}
+        order.update(
+            {
+                "id": self.new_id("ORD"),
+                "state": "OPEN",
+                "version": 1,
+                "created_at": now_iso(),
+                "updated_at": now_iso(),
+                "total_money": {"amount": total, "currency": "USD"},
+            }
+        )
+        self.orders[order["id"]] = order
+        return 200, {"order": order}
+
+    def retrieve_order(self, order_id):
+        if order_id not in self.orders:
+            return square_error(404, "NOT_FOUND", f"Order {order_id} not found")
+        return 200, {"order": self.orders[order_id]}
+
+    def create_invoice(self, body):
+        invoice = body["invoice"]
+        if invoice.get("order_id") not in self.orders:
+            return square_error(400, "NOT_FOUND", "Order not found")
+        invoice.update({"id": self.new_id("INV"), "status": "DRAFT", "version": 0})
+        self.invoices[invoice["id"]] = invoice
+        return 200, {"invoice": invoice}
+
+    def get_invoice(self, invoice_id):
+        if invoice_id not in self.invoices:
+            return square_error(404, "NOT_FOUND", f"Invoice {invoice_id} not found")
+        return 200, {"invoice": self.invoices[invoice_id]}
+
+    def create_terminal_checkout(self, body):
+        checkout = body["checkout"]
+        checkout.update(
+            {"id": self.new_id("CHK"), "status": "PENDING", "created_at": now_iso()}
+        )
+        self.checkouts[checkout["id"]] = checkout
+        return 200, {"checkout": checkout}
+
+    def list_locations(self):
+        return 200, {"locations": [{"id": LOCATION_ID, "status": "ACTIVE"}]}
+
+    def nearby_search(self, query):
+        lat, lng = (float(part) for part in query["location"][0].split(","))
+        radius = float(query.get("radius", ["5000"])[0])
+        results = [
+            place
+            for place in self.places
+            if distance_meters(lat, lng, *place["coordinates"]) <= radius
+        ]
+        return 200, {
+            "status": "OK" if results else "ZERO_RESULTS",
+            "results": [
+                {key: value for key, value in place.items() if key != "coordinates"}
+                for place in results[:20]
+            ],
+        }
+
+
+def distance_meters(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 6371000 * 2 * math.asin(math.sqrt(a))
+
+
+def place_from_restaurant(restaurant):
+    lng, lat = restaurant.location.coords
+    return {
+        "place_id": restaurant.place_id,
+        "name": restaurant.name,
+        "vicinity": restaurant.address or "",
+        "geometry": {"location": {"lat": lat, "lng": lng}},
+        "rating": 4.5,
+        "user_ratings_total": 100,
+        "photos": [],
+        "coordinates": (lat, lng),
+    }
+
+
+ROUTES = [
+    ("POST", r"/v2/catalog/object", "upsert_catalog_object"),
+    ("POST", r"/v2/inventory/changes/batch-create", "batch_change_inventory"),
+    ("POST", r"/v2/inventory/counts/batch-retrieve", "batch_retrieve_inventory_counts"),
+    ("POST", r"/v2/orders", "create_order"),
+    ("GET", r"/v2/orders/(?P<order_id>[^/]+)", "retrieve_order"),
+    ("POST", r"/v2/invoices", "create_invoice"),
+    ("GET", r"/v2/invoices/(?P<invoice_id>[^/]+)", "get_invoice"),
+    ("POST", r"/v2/terminals/checkouts", "create_terminal_checkout"),
+    ("GET", r"/v2/locations", "list_locations"),
+    ("GET", r"/maps/api/place/nearbysearch/json", "nearby_search"),
+]
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, Nagle's
+    # algorithm holds the body until the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+
+        delay, fail = server.faults()
+        if delay:
+            time.sleep(delay)
+        if fail:
+            status, payload = square_error(
+                503, "SERVICE_UNAVAILABLE", "Injected failure"
+            )
+            return self.reply(status, payload)
+
+        for route_method, pattern, handler in ROUTES:
+            match = re.fullmatch(pattern, url.path)
+            if match and route_method == method:
+                args = list(match.groupdict().values())
+                if handler == "nearby_search":
+                    args = [parse_qs(url.query)]
+                elif method == "POST":
+                    args = [body]
+                with server.state.lock:
+                    status, payload = getattr(server.state, handler)(*args)
+                return self.reply(status, payload)
+
+        self.reply(*square_error(404, "NOT_FOUND", f"No fake for {method} {url.path}"))
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+    """Serves FakeUpstreamState with injected latency and errors. Each
+    response is delayed by ``latency`` seconds plus up to ``jitter`` more and
+    fails with a 503 at ``error_rate``; ``seed`` makes a run repeatable."""
+
+    daemon_threads = True
+    # Bursts of new connections from load tests overflow the default backlog.
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        address,
+        state=None,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        seed=None,
+        verbose=False,
+    ):
+        super().__init__(address, FakeUpstreamHandler)
+        self.state = state or FakeUpstreamState()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.verbose = verbose
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def faults(self):
+        with self.random_lock:
+            delay = self.latency + self.jitter * self.random.random()
+            return delay, self.random.random() < self.error_rate
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+from .instrumentation import timed
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with the work factor taken from settings.
+
+    It keeps the ``pbkdf2_sha256`` algorithm name, so existing hashes verify
+    as before and are upgraded on the next successful login whenever
+    PASSWORD_PBKDF2_ITERATIONS changes.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+    def encode(self, password, salt, iterations=None):
+        with timed("hash"):
+            return super().encode(password, salt, iterations)
@@ -0,0 +1,108 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+
+from . import metrics
+
+queue_depth = metrics.gauge(
+    "dineq_password_hash_queue_depth",
+    "Password hashing jobs admitted to the pool and not yet finished.",
+)
+rejected_jobs = metrics.counter(
+    "dineq_password_hash_rejected_total",
+    "Password hashing jobs rejected because the pool was full.",
+)
+completed_jobs = metrics.counter(
+    "dineq_password_hash_jobs_total",
+    "Password hashing jobs completed by the pool.",
+)
+wait_seconds = metrics.counter(
+    "dineq_password_hash_wait_seconds_total",
+    "Time hashing jobs spent queued before a worker picked them up.",
+)
+
+
+class HashingPoolFull(Exception):
+    pass
+
+
+class HashingPool:
+    """Runs password hashing off the event loop on a fixed set of threads.
+
+    hashlib's PBKDF2 releases the GIL, so worker threads hash in parallel
+    without the cost of shipping Django state to worker processes. At most
+    ``max_pending`` jobs are admitted; beyond that callers get
+    ``HashingPoolFull`` straight away instead of queueing without bound.
+    """
+
+    def __init__(self, workers, max_pending):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hash"
+        )
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    async def run(self, func, *args):
+        if not self.slots.acquire(blocking=False):
+            rejected_jobs.inc()
+            raise HashingPoolFull()
+
+        queue_depth.inc()
+        submitted = time.monotonic()
+
+        def job():
+            wait_seconds.inc(time.monotonic() - submitted)
+            return func(*args)
+
+        # Run in a copy of the caller's context so per-request timings
+        # see the hashing time.
+        context = contextvars.copy_context()
+        try:
+            future = self.executor.submit(context.run, job)
+        except BaseException:
+            self.finished(None)
+            raise
+        # The slot is freed when the job ends, not when its caller stops
+        # waiting, so cancelled callers cannot push past max_pending.
+        future.add_done_callback(self.finished)
+        return await asyncio.wrap_future(future)
+
+    def finished(self, future):
+        completed_jobs.inc()
+        queue_depth.dec()
+        self.slots.release()
+
+    async def make_password(self, password):
+        return await self.run(make_password, password)
+
+    async def check_password(self, password, encoded):
+        """Returns ``(is_correct, new_encoded)``; ``new_encoded`` is set when
+        the hash should be upgraded to the current hasher parameters."""
+        upgraded = []
+
+        def check():
+            return check_password(
+                password, encoded, lambda raw: upgraded.append(make_password(raw))
+            )
+
+        is_correct = await self.run(check)
+        return is_correct, upgraded[0] if upgraded else None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_hashing_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashingPool(
+                    settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_PENDING
+                )
+    return _pool
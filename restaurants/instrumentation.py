@@ -0,0 +1,185 @@
+import contextvars
+import json
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+request_duration = metrics.histogram(
+    "dineq_request_duration_seconds",
+    "Time to produce a response, by endpoint.",
+    ["endpoint", "method"],
+)
+db_duration = metrics.histogram(
+    "dineq_request_db_seconds",
+    "Time spent in SQL per request, by endpoint.",
+    ["endpoint"],
+)
+db_queries = metrics.histogram(
+    "dineq_request_db_queries",
+    "SQL queries per request, by endpoint.",
+    ["endpoint"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 250, 1000),
+)
+upstream_duration = metrics.histogram(
+    "dineq_request_upstream_seconds",
+    "Time spent waiting on an upstream API per request, by endpoint.",
+    ["endpoint", "upstream"],
+)
+render_duration = metrics.histogram(
+    "dineq_request_render_seconds",
+    "Time spent rendering the response body, by endpoint.",
+    ["endpoint"],
+)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        # Upstream name -> [calls, seconds]; "hash" is password hashing.
+        self.spans = defaultdict(lambda: [0, 0.0])
+        self.render_seconds = 0.0
+
+    def add(self, name, seconds):
+        span = self.spans[name]
+        span[0] += 1
+        span[1] += seconds
+
+
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+
+@contextmanager
+def timed(name):
+    """Charges the enclosed block to ``name`` on the current request, e.g.
+    ``square.orders``, ``google.places`` or ``hash``."""
+    timings = current_timings.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.add(name, time.perf_counter() - started)
+
+
+def record_query(execute, sql, params, many, context):
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_queries += 1
+        timings.db_seconds += time.perf_counter() - started
+
+
+def install_query_timer(sender, connection, **kwargs):
+    # connection_created fires on every reconnect of a thread's wrapper.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def endpoint_name(request):
+    match = getattr(request, "resolver_match", None)
+    return match.url_name or match.view_name if match else "unmatched"
+
+
+class ServerTimingMiddleware:
+    """Measures SQL, upstream API, password hashing and render time for each
+    request. Emits them as a Server-Timing header and a structured log line
+    and records them in per-endpoint histograms."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings, started)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time that here.
+        timings = current_timings.get()
+        if timings is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                timings.render_seconds += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, timings, started):
+        total = time.perf_counter() - started
+        endpoint = endpoint_name(request)
+
+        request_duration.observe(total, endpoint=endpoint, method=request.method)
+        db_duration.observe(timings.db_seconds, endpoint=endpoint)
+        db_queries.observe(timings.db_queries, endpoint=endpoint)
+        render_duration.observe(timings.render_seconds, endpoint=endpoint)
+        for name, (calls, seconds) in timings.spans.items():
+            upstream_duration.observe(seconds, endpoint=endpoint, upstream=name)
+
+        entries = [
+            f'db;dur={timings.db_seconds * 1000:.1f};desc="{timings.db_queries} queries"'
+        ]
+        entries += [
+            f'{name};dur={seconds * 1000:.1f};desc="{calls} calls"'
+            for name, (calls, seconds) in timings.spans.items()
+        ]
+        entries.append(f"render;dur={timings.render_seconds * 1000:.1f}")
+        entries.append(f"total;dur={total * 1000:.1f}")
+        if settings.SERVER_TIMING_HEADER:
+            response["Server-Timing"] = ", ".join(entries)
+
+        logger.info(
+            json.dumps(
+                {
+                    "event": "request",
+                    "method": request.method,
+                    "path": request.path,
+                    "endpoint": endpoint,
+                    "status": response.status_code,
+                    "total_ms": round(total * 1000, 1),
+                    "db_queries": timings.db_queries,
+                    "db_ms": round(timings.db_seconds * 1000, 1),
+                    "render_ms": round(timings.render_seconds * 1000, 1),
+                    "upstream": {
+                        name: {"calls": calls, "ms": round(seconds * 1000, 1)}
+                        for name, (calls, seconds) in timings.spans.items()
+                    },
+                }
+            )
+        )
+        return response
@@ -0,0 +1,137 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+
+from restaurants import async_upstreams, async_views
+from restaurants.fake_upstreams import FakeUpstreamServer, FakeUpstreamState
+from restaurants.resilience import reset_guards
+from restaurants.simulation import percentile_of
+from restaurants.square_client import reset_square_client
+from restaurants.views import RestaurantViewSet
+
+INVOICE_ID = "FAKEINV00000001"
+PLACE_ID = "bench-place"
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the sync get-invoice view on a WSGI-sized thread pool with its "
+        "async counterpart on one event loop, under a burst of concurrent "
+        "requests against the fake Square server. Needs no database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.SQUARE_MAX_CONCURRENCY,
+            help="Sync worker threads, as in a threaded WSGI server.",
+        )
+        parser.add_argument("--upstream-latency-ms", type=float, default=100)
+
+    def handle(self, *args, **options):
+        state = FakeUpstreamState()
+        state.invoices[INVOICE_ID] = {"id": INVOICE_ID, "status": "DRAFT"}
+        server = FakeUpstreamServer(
+            ("127.0.0.1", 0),
+            state=state,
+            latency=options["upstream_latency_ms"] / 1000,
+        )
+        server.start()
+        # Size every bulkhead to the concurrency under test so the runs
+        # measure the serving model rather than the configured caps.
+        overrides = override_settings(
+            SQUARE_BASE_URL=server.url,
+            SQUARE_ACCESS_TOKEN=settings.SQUARE_ACCESS_TOKEN or "bench-token",
+            SQUARE_BULKHEADS={},
+            SQUARE_BULKHEAD_DEFAULT=options["workers"],
+            SQUARE_ASYNC_BULKHEAD=options["requests"],
+            SQUARE_POOL_MAXSIZE=options["workers"],
+        )
+        overrides.enable()
+        reset_square_client()
+        reset_guards()
+        try:
+            results = [
+                ("wsgi", *self.run_sync(options)),
+                ("asgi", *self.run_async(options)),
+            ]
+        finally:
+            overrides.disable()
+            reset_square_client()
+            reset_guards()
+            server.stop()
+
+        self.stdout.write(
+            f"{options['requests']} concurrent get-invoice requests, "
+            f"{options['workers']} sync workers, "
+            f"{options['upstream_latency_ms']:.0f}ms upstream latency"
+        )
+        self.stdout.write(
+            f"{'server':<6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}"
+        )
+        for name, elapsed, latencies, errors in results:
+            self.stdout.write(
+                f"{name:<6} {len(latencies) / elapsed:>8.1f} "
+                f"{percentile_of(latencies, 50) * 1000:>8.1f} "
+                f"{percentile_of(latencies, 95) * 1000:>8.1f} {errors:>7}"
+            )
+
+    def run_sync(self, options):
+        view = RestaurantViewSet.as_view({"get": "get_invoice"})
+        factory = RequestFactory()
+
+        def request(started):
+            response = view(
+                factory.get(
+                    f"/restaurants/{PLACE_ID}/get-invoice/",
+                    {"invoice_id": INVOICE_ID},
+                ),
+                pk=PLACE_ID,
+            )
+            response.render()
+            return time.perf_counter() - started, response.status_code
+
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            started = time.perf_counter()
+            futures = [
+                pool.submit(request, started) for _ in range(options["requests"])
+            ]
+            outcomes = [future.result() for future in futures]
+        return self.summarize(started, outcomes)
+
+    def run_async(self, options):
+        factory = AsyncRequestFactory()
+
+        async def request(started):
+            response = await async_views.get_invoice(
+                factory.get(
+                    f"/restaurants/{PLACE_ID}/get-invoice/",
+                    {"invoice_id": INVOICE_ID},
+                ),
+                PLACE_ID,
+            )
+            return time.perf_counter() - started, response.status_code
+
+        async def burst():
+            started = time.perf_counter()
+            try:
+                outcomes = await asyncio.gather(
+                    *(request(started) for _ in range(options["requests"]))
+                )
+            finally:
+                await async_upstreams.close_http_clients()
+            return started, outcomes
+
+        return self.summarize(*asyncio.run(burst()))
+
+    def summarize(self, started, outcomes):
+        elapsed = time.perf_counter() - started
+        latencies = [latency for latency, status in outcomes]
+        errors = sum(1 for latency, status in outcomes if status != 200)
+        return elapsed, latencies, errors
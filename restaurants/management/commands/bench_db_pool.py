@@ -0,0 +1,171 @@
+import random
+import threading
+import time
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from rest_framework.test import APIClient
+
+from restaurants.db_pool import close_pools
+from restaurants.models import Queue, Restaurant, User
+from restaurants.simulation import percentile_of
+
+CENTER = (-122.4194, 37.7749)
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive short endpoints (available-seats, queue-size) from concurrent "
+        "clients, once opening a database connection per request and once "
+        "through the connection pool, and report throughput, latency and "
+        "connections opened."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--restaurants", type=int, default=200)
+        parser.add_argument("--queue", type=int, default=200)
+        parser.add_argument("--clients", type=int, default=16)
+        parser.add_argument("--requests", type=int, default=300, help="Per client.")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--keepdb", action="store_true")
+
+    def handle(self, *args, **options):
+        settings_dict = connections.settings[DEFAULT_DB_ALIAS]
+        pool_options = settings_dict.get("POOL")
+        if not pool_options or not settings_dict["ENGINE"].endswith("postgis_pool"):
+            raise CommandError(
+                "The pool is off; set DB_POOL_MAX_SIZE above 0 to compare."
+            )
+        setup_test_environment()
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options["keepdb"]
+        )
+        try:
+            self.seed(options)
+            results = []
+            for pooled in (False, True):
+                # Each client thread builds its own connection from these.
+                settings_dict["POOL"] = pool_options if pooled else None
+                with override_settings(RATE_LIMIT_ENABLED=False):
+                    results.append(self.run(pooled, options))
+                close_pools()
+        finally:
+            settings_dict["POOL"] = pool_options
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+        self.report(results, pool_options)
+
+    def seed(self, options):
+        rng = random.Random(options["seed"])
+        lng, lat = CENTER
+        self.restaurants = Restaurant.objects.bulk_create(
+            Restaurant(
+                name=f"Bench Restaurant {i}",
+                place_id=f"bench-{i}",
+                location=Point(
+                    lng + rng.uniform(-0.2, 0.2),
+                    lat + rng.uniform(-0.2, 0.2),
+                    srid=4326,
+                ),
+                address=f"{i} Bench Street",
+                verified=True,
+                available_seats=rng.randint(0, 40),
+            )
+            for i in range(options["restaurants"])
+        )
+        users = User.objects.bulk_create(
+            User(email=f"bench-user-{i}@example.com") for i in range(options["queue"])
+        )
+        Queue.objects.bulk_create(
+            Queue(
+                restaurant=rng.choice(self.restaurants),
+                user=user,
+                party_size=rng.randint(1, 4),
+                position=1,
+            )
+            for user in users
+        )
+        connections.close_all()
+
+    def client_loop(self, index, latencies, errors, options):
+        rng = random.Random(options["seed"] + index)
+        client = APIClient()
+        try:
+            for _ in range(options["requests"]):
+                restaurant = rng.choice(self.restaurants)
+                endpoint = rng.choice(["available-seats", "queue-size"])
+                started = time.perf_counter()
+                # The test client sends request_started and request_finished,
+                # so each request gets and gives back its connection as it
+                # would under a server.
+                response = client.get(f"/restaurants/{restaurant.place_id}/{endpoint}/")
+                latencies.append((time.perf_counter() - started) * 1000)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+        finally:
+            connections.close_all()
+
+    def run(self, pooled, options):
+        latencies = []
+        errors = []
+        opened = []
+        lock = threading.Lock()
+
+        def count(sender, connection, **kwargs):
+            with lock:
+                opened.append(connection.connection)
+
+        connection_created.connect(count)
+        threads = [
+            threading.Thread(
+                target=self.client_loop, args=(i, latencies, errors, options)
+            )
+            for i in range(options["clients"])
+        ]
+        started = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            connection_created.disconnect(count)
+        elapsed = time.perf_counter() - started
+        return {
+            "mode": "pooled" if pooled else "per request",
+            "requests": len(latencies),
+            "rps": len(latencies) / elapsed,
+            "p50": percentile_of(latencies, 50),
+            "p95": percentile_of(latencies, 95),
+            "p99": percentile_of(latencies, 99),
+            "errors": len(errors),
+            # A reused connection is handed out again, not reopened.
+            "connections": len({id(connection) for connection in opened}),
+        }
+
+    def report(self, results, pool_options):
+        self.stdout.write(
+            f"{'mode':<12} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'errors':>7} {'connections':>12}"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['mode']:<12} {result['rps']:>8.1f} {result['p50']:>8.2f} "
+                f"{result['p95']:>8.2f} {result['p99']:>8.2f} {result['errors']:>7} "
+                f"{result['connections']:>12}"
+            )
+        before, after = results
+        self.stdout.write(
+            f"With a pool of up to {pool_options['MAX_SIZE']}, median latency "
+            f"fell by {(1 - after['p50'] / before['p50']) * 100:.0f}% and "
+            f"throughput rose {after['rps'] / before['rps']:.1f}x."
+        )
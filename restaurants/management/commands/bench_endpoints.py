@@ -0,0 +1,506 @@
+import itertools
+import json
+import random
+import time
+from unittest import mock
+
+import requests
+from django.contrib.auth.hashers import make_password
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from rest_framework.test import APIClient
+
+from restaurants.fake_upstreams import (
+    FakeUpstreamServer,
+    FakeUpstreamState,
+    place_from_restaurant,
+)
+from restaurants.models import Category, Item, Queue, Restaurant, User, Variation
+from restaurants.simulation import percentile_of
+from restaurants.square_client import reset_square_client
+
+CENTER = (-122.4194, 37.7749)
+PASSWORD = "bench-password"
+
+# Per-request ceilings for the default dataset: p95 latency in ms, SQL
+# queries and outbound HTTP calls. Query counts that grow with the data
+# (get-menu, nearby) are sized for the defaults; pass --budgets with a
+# JSON file of overrides when benchmarking other sizes.
+BUDGETS = {
+    "list": {"p95_ms": 150, "queries": 1, "outbound": 0},
+    "list_expanded": {"p95_ms": 1500, "queries": 4, "outbound": 0},
+    "retrieve": {"p95_ms": 500, "queries": 4, "outbound": 0},
+    "create": {"p95_ms": 250, "queries": 6, "outbound": 0},
+    "update": {"p95_ms": 250, "queries": 8, "outbound": 0},
+    "partial_update": {"p95_ms": 250, "queries": 8, "outbound": 0},
+    "destroy": {"p95_ms": 250, "queries": 15, "outbound": 0},
+    "upsert_menu": {"p95_ms": 1500, "queries": 120, "outbound": 0},
+    "get_menu": {"p95_ms": 500, "queries": 120, "outbound": 0},
+    "available_seats": {"p95_ms": 100, "queries": 2, "outbound": 0},
+    "availability": {"p95_ms": 150, "queries": 3, "outbound": 0},
+    "menu_search": {"p95_ms": 200, "queries": 1, "outbound": 0},
+    "update_inventory": {"p95_ms": 300, "queries": 20, "outbound": 0},
+    "place_order": {"p95_ms": 500, "queries": 28, "outbound": 2},
+    "retrieve_order": {"p95_ms": 200, "queries": 2, "outbound": 0},
+    "get_invoice": {"p95_ms": 200, "queries": 2, "outbound": 0},
+    "create_terminal_checkout": {"p95_ms": 300, "queries": 20, "outbound": 1},
+    "join_queue": {"p95_ms": 150, "queries": 10, "outbound": 0},
+    "queue_position": {"p95_ms": 100, "queries": 8, "outbound": 0},
+    "get_queue_size": {"p95_ms": 100, "queries": 3, "outbound": 0},
+    "release_seats": {"p95_ms": 300, "queries": 30, "outbound": 0},
+    "nearby": {"p95_ms": 500, "queries": 25, "outbound": 1},
+    "login": {"p95_ms": 2000, "queries": 5, "outbound": 0},
+    "register": {"p95_ms": 2000, "queries": 3, "outbound": 0},
+}
+
+
+class Endpoint:
+    def __init__(self, name, request, iterations=None):
+        self.name = name
+        self.request = request
+        self.iterations = iterations
+        self.latencies = []
+        self.queries = []
+        self.outbound = []
+        self.errors = []
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a test database with a realistic dataset and benchmark every "
+        "RestaurantViewSet action plus nearby, login and register against the "
+        "fake Square and Places server. Fails when an endpoint exceeds its "
+        "latency, query-count or outbound-call budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--restaurants", type=int, default=2000)
+        parser.add_argument("--categories", type=int, default=10)
+        parser.add_argument("--items", type=int, default=10, help="Per category.")
+        parser.add_argument("--variations", type=int, default=3, help="Per item.")
+        parser.add_argument("--queue", type=int, default=500)
+        parser.add_argument("--iterations", type=int, default=30)
+        parser.add_argument("--warmup", type=int, default=3)
+        parser.add_argument("--upstream-latency-ms", type=float, default=0)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--budgets", help="JSON file of budget overrides.")
+        parser.add_argument(
+            "--only", nargs="*", help="Endpoint names to run; default all."
+        )
+        parser.add_argument("--keepdb", action="store_true")
+
+    def handle(self, *args, **options):
+        budgets = {name: dict(budget) for name, budget in BUDGETS.items()}
+        if options["budgets"]:
+            with open(options["budgets"]) as f:
+                for name, budget in json.load(f).items():
+                    budgets.setdefault(name, {}).update(budget)
+
+        setup_test_environment()
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options["keepdb"]
+        )
+        self.rng = random.Random(options["seed"])
+        self.state = FakeUpstreamState()
+        server = FakeUpstreamServer(
+            ("127.0.0.1", 0),
+            state=self.state,
+            latency=options["upstream_latency_ms"] / 1000,
+            seed=options["seed"],
+        )
+        server.start()
+        settings_override = override_settings(
+            SQUARE_BASE_URL=server.url,
+            SQUARE_ACCESS_TOKEN="bench",
+            GOOGLE_PLACES_BASE_URL=f"{server.url}/maps/api/place",
+            RATE_LIMIT_ENABLED=False,
+        )
+        settings_override.enable()
+        reset_square_client()
+        try:
+            started = time.monotonic()
+            self.seed(options)
+            self.stdout.write(f"Seeded in {time.monotonic() - started:.1f}s")
+            endpoints = self.endpoints(options)
+            if options["only"]:
+                endpoints = [e for e in endpoints if e.name in options["only"]]
+            for endpoint in endpoints:
+                self.run(endpoint, options)
+        finally:
+            reset_square_client()
+            settings_override.disable()
+            server.stop()
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+        failures = self.report(endpoints, budgets)
+        if failures:
+            raise CommandError(
+                f"{len(failures)} budget(s) exceeded:\n" + "\n".join(failures)
+            )
+
+    def seed(self, options):
+        lng, lat = CENTER
+        restaurants = Restaurant.objects.bulk_create(
+            Restaurant(
+                name=f"Bench Restaurant {i}",
+                place_id=f"bench-{i}",
+                location=Point(
+                    lng + self.rng.uniform(-0.2, 0.2) * bool(i),
+                    lat + self.rng.uniform(-0.2, 0.2) * bool(i),
+                    srid=4326,
+                ),
+                address=f"{i} Bench Street",
+                verified=True,
+                total_seats=20,
+                # The main restaurant is full so joins go to the queue.
+                available_seats=0 if i == 0 else 20,
+            )
+            for i in range(options["restaurants"])
+        )
+        self.restaurant = restaurants[0]
+        self.other = restaurants[1]
+        self.place_ids = [r.place_id for r in restaurants[:100]]
+        self.state.places = [place_from_restaurant(r) for r in restaurants]
+
+        categories = Category.objects.bulk_create(
+            Category(
+                name=f"Category {c}",
+                category_id=f"BENCHCAT{c}",
+                restaurant=self.restaurant,
+                square_id=f"BENCHCAT{c}",
+            )
+            for c in range(options["categories"])
+        )
+        items = Item.objects.bulk_create(
+            Item(
+                name=f"Item {c}-{i}",
+                item_id=f"BENCHITEM{c}-{i}",
+                category=category,
+                square_id=f"BENCHITEM{c}-{i}",
+                description="A dish seeded for benchmarking.",
+            )
+            for c, category in enumerate(categories)
+            for i in range(options["items"])
+        )
+        variations = Variation.objects.bulk_create(
+            Variation(
+                name=f"Size {v}",
+                reference_id=f"#{item.name}__{v}__{self.restaurant.place_id}",
+                item=item,
+                price=5 + v,
+                quantity=1000,
+                square_id=f"BENCHVAR{item.pk}-{v}",
+            )
+            for item in items
+            for v in range(options["variations"])
+        )
+        self.variations = variations
+        for variation in variations:
+            self.state.catalog[variation.square_id] = {
+                "id": variation.square_id,
+                "item_variation_data": {
+                    "price_money": {"amount": int(variation.price * 100)}
+                },
+            }
+            self.state.inventory[variation.square_id] = 1000
+
+        encoded = make_password(PASSWORD)
+        total = options["queue"] + 2 * (options["iterations"] + options["warmup"])
+        users = User.objects.bulk_create(
+            User(email=f"bench-user-{i}@example.com", password=encoded)
+            for i in range(total)
+        )
+        self.diner = User.objects.create(
+            email="bench-diner@example.com", password=encoded
+        )
+        queued, self.joiners = users[: options["queue"]], iter(
+            users[options["queue"] :]
+        )
+        position = 1
+        entries = []
+        for user in queued:
+            party_size = self.rng.randint(1, 4)
+            entries.append(
+                Queue(
+                    restaurant=self.restaurant,
+                    user=user,
+                    party_size=party_size,
+                    position=position,
+                )
+            )
+            position += party_size
+        Queue.objects.bulk_create(entries)
+        self.last_queued = queued[-1] if queued else None
+
+        self.created = []
+        self.orders = []
+        self.registrations = itertools.count()
+
+    def endpoints(self, options):
+        place_id = self.restaurant.place_id
+        detail = f"/restaurants/{place_id}"
+        menu = [
+            {
+                "name": f"Upsert Category {c}",
+                "items": [
+                    {
+                        "name": f"Upsert Item {c}-{i}",
+                        "description": "Upserted by the benchmark.",
+                        "variations": [
+                            {"name": "Regular", "price": 1000},
+                            {"name": "Large", "price": 1400},
+                        ],
+                    }
+                    for i in range(2)
+                ],
+            }
+            for c in range(2)
+        ]
+        variation_ids = [v.reference_id for v in self.variations[:2]]
+
+        def restaurant_body(i):
+            return {
+                "name": f"Created Restaurant {i}",
+                "place_id": f"bench-created-{i}",
+                "location": f"SRID=4326;POINT({CENTER[0]} {CENTER[1]})",
+                "address": f"{i} Created Street",
+            }
+
+        def create(client, i):
+            response = client.post("/restaurants/", restaurant_body(i), format="json")
+            if response.status_code == 201:
+                self.created.append(response.data["id"])
+            return response
+
+        def place_order(client, i):
+            response = client.post(
+                f"{detail}/place-order/",
+                {
+                    "email": self.diner.email,
+                    "order_data": [
+                        {"variation_reference_id": ref, "quantity": 1}
+                        for ref in variation_ids
+                    ],
+                },
+                format="json",
+            )
+            if response.status_code == 200:
+                self.orders.append(response.data)
+            return response
+
+        def order(i):
+            return self.orders[i % len(self.orders)]
+
+        def register(client, i):
+            return client.post(
+                "/register/",
+                {
+                    "email": f"bench-new-{next(self.registrations)}@example.com",
+                    "password": PASSWORD,
+                },
+                format="json",
+            )
+
+        # Order matters: writes that later endpoints depend on run first.
+        heavy = min(options["iterations"], 5)
+        return [
+            Endpoint("list", lambda c, i: c.get("/restaurants/")),
+            Endpoint(
+                "list_expanded",
+                lambda c, i: c.get("/restaurants/", {"expand": "categories"}),
+                heavy,
+            ),
+            Endpoint(
+                "retrieve", lambda c, i: c.get(f"/restaurants/{self.restaurant.pk}/")
+            ),
+            Endpoint("create", create),
+            Endpoint(
+                "update",
+                lambda c, i: c.put(
+                    f"/restaurants/{self.created[0]}/",
+                    restaurant_body(0) | {"description": f"Updated {i}"},
+                    format="json",
+                ),
+            ),
+            Endpoint(
+                "partial_update",
+                lambda c, i: c.patch(
+                    f"/restaurants/{self.other.pk}/",
+                    {"description": f"Patched {i}"},
+                    format="json",
+                ),
+            ),
+            Endpoint(
+                "destroy",
+                lambda c, i: c.delete(f"/restaurants/{self.created.pop()}/"),
+            ),
+            Endpoint(
+                "upsert_menu",
+                lambda c, i: c.post(
+                    f"/restaurants/{self.other.place_id}/upsert-menu/",
+                    {"menu_data": menu},
+                    format="json",
+                ),
+                heavy,
+            ),
+            Endpoint("get_menu", lambda c, i: c.get(f"{detail}/get-menu/")),
+            Endpoint(
+                "available_seats", lambda c, i: c.get(f"{detail}/available-seats/")
+            ),
+            Endpoint(
+                "availability",
+                lambda c, i: c.get(
+                    "/restaurants/availability/",
+                    {"place_ids": ",".join(self.place_ids), "estimate": "1"},
+                ),
+            ),
+            Endpoint(
+                "menu_search",
+                lambda c, i: c.get(
+                    "/restaurants/search/",
+                    {"q": f"item {i % 10}", "lat": CENTER[1], "lng": CENTER[0]},
+                ),
+            ),
+            Endpoint(
+                "update_inventory",
+                lambda c, i: c.post(
+                    f"{detail}/update-inventory/",
+                    {
+                        "inventory_data": [
+                            {"variation_reference_id": ref, "quantity": 900 + i}
+                            for ref in variation_ids
+                        ]
+                    },
+                    format="json",
+                ),
+            ),
+            Endpoint("place_order", place_order),
+            Endpoint(
+                "retrieve_order",
+                lambda c, i: c.get(
+                    f"{detail}/retrieve-order/", {"order_id": order(i)["order_id"]}
+                ),
+            ),
+            Endpoint(
+                "get_invoice",
+                lambda c, i: c.get(
+                    f"{detail}/get-invoice/", {"invoice_id": order(i)["invoice_id"]}
+                ),
+            ),
+            Endpoint(
+                "create_terminal_checkout",
+                lambda c, i: c.post(
+                    f"{detail}/checkout/",
+                    {"uoi": order(i)["uoi"], "email": self.diner.email},
+                    format="json",
+                ),
+            ),
+            Endpoint(
+                "join_queue",
+                lambda c, i: c.post(
+                    f"{detail}/join-queue/",
+                    {"email": next(self.joiners).email, "party_size": 2},
+                    format="json",
+                ),
+            ),
+            Endpoint(
+                "queue_position",
+                lambda c, i: c.get(
+                    f"{detail}/queue-position/", {"email": self.last_queued.email}
+                ),
+            ),
+            Endpoint("get_queue_size", lambda c, i: c.get(f"{detail}/queue-size/")),
+            Endpoint(
+                "release_seats",
+                lambda c, i: c.post(
+                    f"{detail}/release-seats/", {"seats_released": 2}, format="json"
+                ),
+            ),
+            Endpoint(
+                "nearby",
+                lambda c, i: c.get(
+                    "/nearby-restaurants/", {"lat": CENTER[1], "lng": CENTER[0]}
+                ),
+            ),
+            Endpoint(
+                "login",
+                lambda c, i: c.post(
+                    "/login/",
+                    {"email": self.diner.email, "password": PASSWORD},
+                    format="json",
+                ),
+            ),
+            Endpoint("register", register),
+        ]
+
+    def run(self, endpoint, options):
+        client = APIClient()
+        outbound = []
+        send = requests.Session.send
+
+        def counting_send(session, request, **kwargs):
+            outbound.append(request.url)
+            return send(session, request, **kwargs)
+
+        iterations = endpoint.iterations or options["iterations"]
+        warmup = min(options["warmup"], iterations)
+        with mock.patch.object(requests.Session, "send", counting_send):
+            for i in range(warmup + iterations):
+                outbound.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = endpoint.request(client, i)
+                    elapsed = time.perf_counter() - started
+                if response.status_code >= 400:
+                    endpoint.errors.append(
+                        f"{response.status_code} {response.content[:200]!r}"
+                    )
+                if i < warmup:
+                    continue
+                endpoint.latencies.append(elapsed * 1000)
+                endpoint.queries.append(len(queries))
+                endpoint.outbound.append(len(outbound))
+
+    def report(self, endpoints, budgets):
+        failures = []
+        self.stdout.write(
+            f"{'endpoint':<26} {'n':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'queries':>8} {'outbound':>8}"
+        )
+        for endpoint in endpoints:
+            p95 = percentile_of(endpoint.latencies, 95)
+            queries = max(endpoint.queries, default=0)
+            outbound = max(endpoint.outbound, default=0)
+            self.stdout.write(
+                f"{endpoint.name:<26} {len(endpoint.latencies):>4} "
+                f"{percentile_of(endpoint.latencies, 50):>8.1f} {p95:>8.1f} "
+                f"{percentile_of(endpoint.latencies, 99):>8.1f} "
+                f"{queries:>8} {outbound:>8}"
+            )
+
+            budget = budgets.get(endpoint.name, {})
+            for label, value in (
+                ("p95_ms", p95),
+                ("queries", queries),
+                ("outbound", outbound),
+            ):
+                if label in budget and value > budget[label]:
+                    failures.append(
+                        f"{endpoint.name}: {label} {value:.0f} > {budget[label]}"
+                    )
+            if endpoint.errors:
+                failures.append(
+                    f"{endpoint.name}: {len(endpoint.errors)} error responses, "
+                    f"first: {endpoint.errors[0]}"
+                )
+        return failures
@@ -0,0 +1,116 @@
+import json
+import time
+from decimal import Decimal
+from io import BytesIO
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from restaurants.models import Restaurant
+from restaurants.rendering import OrjsonParser, OrjsonRenderer
+from restaurants.serializers import RestaurantSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare DRF's JSON renderer and parser with the orjson ones on a "
+        "get-menu payload and a restaurant listing page. Needs no database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--categories", type=int, default=20)
+        parser.add_argument("--items", type=int, default=25, help="Per category.")
+        parser.add_argument("--variations", type=int, default=4, help="Per item.")
+        parser.add_argument("--restaurants", type=int, default=200)
+        parser.add_argument("--iterations", type=int, default=50)
+
+    def handle(self, *args, **options):
+        payloads = {"get_menu": self.menu(options), "list": self.listing(options)}
+        self.stdout.write(
+            f"{'payload':<10} {'KB':>8} {'render':>8} {'orjson':>8} "
+            f"{'parse':>8} {'orjson':>8} {'speedup':>8}"
+        )
+        for name, data in payloads.items():
+            content = JSONRenderer().render(data)
+            if json.loads(OrjsonRenderer().render(data)) != json.loads(content):
+                raise CommandError(f"{name}: orjson output differs from DRF's.")
+            render = self.time(lambda: JSONRenderer().render(data), options)
+            fast_render = self.time(lambda: OrjsonRenderer().render(data), options)
+            parse = self.time(lambda: JSONParser().parse(BytesIO(content)), options)
+            fast_parse = self.time(
+                lambda: OrjsonParser().parse(BytesIO(content)), options
+            )
+            self.stdout.write(
+                f"{name:<10} {len(content) / 1024:>8.1f} {render:>8.2f} "
+                f"{fast_render:>8.2f} {parse:>8.2f} {fast_parse:>8.2f} "
+                f"{(render + parse) / (fast_render + fast_parse):>7.1f}x"
+            )
+        self.stdout.write("Times are milliseconds per call.")
+
+    def time(self, func, options):
+        started = time.perf_counter()
+        for _ in range(options["iterations"]):
+            func()
+        return (time.perf_counter() - started) * 1000 / options["iterations"]
+
+    def menu(self, options):
+        # The shape CategorySerializer produces for get-menu. Prices stay
+        # Decimal to exercise the renderers' fallback encoders.
+        return [
+            {
+                "id": c,
+                "items": [
+                    {
+                        "id": c * 1000 + i,
+                        "variations": [
+                            {
+                                "id": (c * 1000 + i) * 10 + v,
+                                "name": f"Size {v}",
+                                "variation_id": f"#Variation_{c}_{i}_{v}",
+                                "reference_id": f"#Item_{c}_{i}__Size_{v}__place",
+                                "price": Decimal("9.99") + v,
+                                "quantity": 100,
+                                "square_id": f"SQVAR{c:03d}{i:03d}{v}",
+                                "item": c * 1000 + i,
+                            }
+                            for v in range(options["variations"])
+                        ],
+                        "name": f"Item {i}",
+                        "description": "House favourite, served with seasonal sides.",
+                        "item_id": f"#Item_{c}_{i}",
+                        "reference_id": f"#Item_{c}_{i}__place",
+                        "square_id": f"SQITEM{c:03d}{i:03d}",
+                        "category": c,
+                    }
+                    for i in range(options["items"])
+                ],
+                "name": f"Category {c}",
+                "category_id": f"#Category_{c}",
+                "reference_id": f"#Category_{c}__place",
+                "square_id": f"SQCAT{c:03d}",
+                "restaurant": 1,
+            }
+            for c in range(options["categories"])
+        ]
+
+    def listing(self, options):
+        restaurants = [
+            Restaurant(
+                id=i,
+                name=f"Restaurant {i}",
+                place_id=f"place-{i}",
+                location=Point(-122.4194 + i / 1000, 37.7749, srid=4326),
+                address=f"{i} Market St",
+                verified=True,
+            )
+            for i in range(options["restaurants"])
+        ]
+        return {
+            "next": None,
+            "previous": None,
+            "results": RestaurantSerializer(
+                restaurants, many=True, context={"expand": set()}
+            ).data,
+        }
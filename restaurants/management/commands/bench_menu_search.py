@@ -0,0 +1,162 @@
+import time
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from restaurants.models import Category, Item, Restaurant, Variation
+from restaurants.search import search_menu, search_queryset
+from restaurants.simulation import percentile_of
+
+CENTER = (-122.4194, 37.7749)
+DISHES = [
+    "Burger",
+    "Pizza",
+    "Tikka Masala",
+    "Ramen",
+    "Burrito",
+    "Pad Thai",
+    "Caesar Salad",
+    "Pho",
+    "Margherita",
+    "Biryani",
+    "Tacos",
+    "Lasagna",
+]
+STYLES = [
+    "Classic",
+    "Spicy",
+    "Vegan",
+    "Chicken",
+    "Paneer",
+    "Smoked",
+    "Truffle",
+    "Garlic",
+]
+CATEGORIES = ["Starters", "Mains", "Sides", "Desserts", "Drinks"]
+# Misspelled on purpose; trigram matching should still find them.
+QUERIES = ["burger", "chiken tikka", "margarita", "vegan", "desserts"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a PostgreSQL test database with a large menu catalog and time "
+        "the menu search with and without a geo filter."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=1_000_000)
+        parser.add_argument("--restaurants", type=int, default=10_000)
+        parser.add_argument("--variations", type=int, default=2, help="Per item.")
+        parser.add_argument("--radius", type=int, default=5000)
+        parser.add_argument("--limit", type=int, default=50)
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument("--keepdb", action="store_true")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("bench_menu_search needs the PostgreSQL database.")
+
+        setup_test_environment()
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options["keepdb"]
+        )
+        try:
+            started = time.monotonic()
+            self.seed(options)
+            self.stdout.write(f"Seeded in {time.monotonic() - started:.1f}s")
+            self.stdout.write(
+                f"{'query':<16} {'geo':>4} {'hits':>5} {'p50 ms':>8} {'p95 ms':>8}"
+            )
+            location = Point(*CENTER, srid=4326)
+            for query in QUERIES:
+                for geo in (False, True):
+                    self.bench(query, location if geo else None, options)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+    def bench(self, query, location, options):
+        latencies = []
+        for _ in range(options["iterations"] + 1):
+            started = time.perf_counter()
+            hits = search_menu(query, location, options["radius"], options["limit"])
+            latencies.append((time.perf_counter() - started) * 1000)
+        # The first run warms the caches.
+        latencies = latencies[1:]
+        self.stdout.write(
+            f"{query:<16} {'yes' if location else 'no':>4} {len(hits):>5} "
+            f"{percentile_of(latencies, 50):>8.1f} {percentile_of(latencies, 95):>8.1f}"
+        )
+        if options["verbosity"] > 1:
+            self.stdout.write(
+                search_queryset(query, location, options["radius"])[
+                    : options["limit"]
+                ].explain(analyze=True)
+            )
+
+    def seed(self, options):
+        tables = {
+            model: model._meta.db_table
+            for model in (Restaurant, Category, Item, Variation)
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {tables[Restaurant]} (name, place_id, location, address,
+                    verified, geo_fence_radius, total_seats, available_seats,
+                    menu_version)
+                SELECT 'Restaurant ' || i, 'place-' || i,
+                    ST_SetSRID(ST_MakePoint(%s + random() - 0.5,
+                        %s + random() - 0.5), 4326),
+                    i || ' Market St', true, 5000, 20, 20, 0
+                FROM generate_series(1, %s) i
+                """,
+                [*CENTER, options["restaurants"]],
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {tables[Category]} (name, category_id, restaurant_id)
+                SELECT name, '#' || name, r.id
+                FROM {tables[Restaurant]} r, unnest(%s::text[]) name
+                """,
+                [CATEGORIES],
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {tables[Item]} (name, description, item_id, category_id)
+                SELECT style || ' ' || dish,
+                    'House ' || lower(dish) || ' with seasonal sides.',
+                    '#Item' || i, c.first + i %% c.count
+                FROM generate_series(1, %s) i,
+                    LATERAL (SELECT (%s::text[])[1 + i %% %s] AS dish,
+                        (%s::text[])[1 + (i / %s) %% %s] AS style) names,
+                    (SELECT min(id) AS first, count(*) AS count
+                        FROM {tables[Category]}) c
+                """,
+                [
+                    options["items"],
+                    DISHES,
+                    len(DISHES),
+                    STYLES,
+                    len(DISHES),
+                    len(STYLES),
+                ],
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {tables[Variation]} (name, reference_id, item_id, price,
+                    quantity)
+                SELECT 'Size ' || v, item.item_id || '__' || v, item.id, 8 + v, 100
+                FROM {tables[Item]} item, generate_series(1, %s) v
+                """,
+                [options["variations"]],
+            )
+            for table in tables.values():
+                cursor.execute(f"ANALYZE {table}")
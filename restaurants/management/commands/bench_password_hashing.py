@@ -0,0 +1,83 @@
+import asyncio
+import os
+import time
+
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.management.base import BaseCommand
+
+from restaurants.hashing import HashingPool
+
+
+async def probe_loop_lag(stop, interval=0.01):
+    worst = 0.0
+    while not stop.is_set():
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.monotonic() - started - interval)
+    return worst
+
+
+async def timed(run):
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_loop_lag(stop))
+    await asyncio.sleep(0)
+    started = time.monotonic()
+    await run()
+    elapsed = time.monotonic() - started
+    stop.set()
+    return elapsed, await probe
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare login password checks on the request thread with checks "
+        "offloaded to the hashing pool: throughput per core and worst event "
+        "loop stall."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--logins", type=int, default=64)
+        parser.add_argument("--concurrency", type=int, default=32)
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+
+    def handle(self, *args, **options):
+        asyncio.run(self.bench(options))
+
+    async def bench(self, options):
+        password = "correct horse battery staple"
+        encoded = make_password(password)
+        logins = options["logins"]
+        workers = options["workers"]
+        cores = min(workers, os.cpu_count() or 1)
+
+        async def inline():
+            # What a sync login view does: hash on the serving thread.
+            for _ in range(logins):
+                check_password(password, encoded)
+
+        pool = HashingPool(workers, options["concurrency"])
+        slots = asyncio.Semaphore(options["concurrency"])
+
+        async def one_login():
+            async with slots:
+                await pool.check_password(password, encoded)
+
+        async def pooled():
+            await asyncio.gather(*(one_login() for _ in range(logins)))
+
+        self.stdout.write(
+            f"{logins} logins, {workers} hashing workers on {os.cpu_count()} cores"
+        )
+        self.stdout.write(
+            f"{'mode':<8} {'logins/s':>9} {'per core':>9} {'max stall':>10}"
+        )
+        for label, run, used_cores in (
+            ("inline", inline, 1),
+            ("pool", pooled, cores),
+        ):
+            elapsed, stall = await timed(run)
+            rate = logins / elapsed
+            self.stdout.write(
+                f"{label:<8} {rate:>9.1f} {rate / used_cores:>9.1f} "
+                f"{stall * 1000:>8.0f}ms"
+            )
@@ -0,0 +1,275 @@
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import override_settings
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from rest_framework.test import APIClient
+
+from restaurants.authentication import issue_token
+from restaurants.models import Category, Item, Queue, Restaurant, User, Variation
+from restaurants.simulation import percentile_of
+
+CENTER = (-122.4194, 37.7749)
+
+# Share of requests per endpoint; joins are followed by a queue-size read
+# from the same client, which must come from the primary.
+MIX = {
+    "get_menu": 30,
+    "available_seats": 25,
+    "get_queue_size": 15,
+    "retrieve": 10,
+    "list": 5,
+    "join_queue": 15,
+}
+
+
+class QueryLoad:
+    """SQL statements and time per database alias, summed over threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = {}
+        self.seconds = {}
+
+    def wrapper(self, alias):
+        def record(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self.lock:
+                    self.queries[alias] = self.queries.get(alias, 0) + 1
+                    self.seconds[alias] = self.seconds.get(alias, 0.0) + elapsed
+
+        return record
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive a read-heavy mix of restaurant endpoints from concurrent "
+        "clients, once with every query on the primary and once with pure "
+        "reads routed to the replicas, and report how much SQL time leaves "
+        "the primary."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--restaurants", type=int, default=500)
+        parser.add_argument("--categories", type=int, default=10)
+        parser.add_argument("--items", type=int, default=10, help="Per category.")
+        parser.add_argument("--queue", type=int, default=300)
+        parser.add_argument("--clients", type=int, default=16)
+        parser.add_argument("--requests", type=int, default=200, help="Per client.")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--keepdb", action="store_true")
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError(
+                "No replicas configured; set DATABASE_REPLICA_HOSTS. In the "
+                "test database each replica mirrors the primary."
+            )
+        setup_test_environment()
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options["keepdb"]
+        )
+        try:
+            self.seed(options)
+            results = []
+            for routed in (False, True):
+                replicas = settings.DATABASE_REPLICAS if routed else []
+                with override_settings(
+                    DATABASE_REPLICAS=replicas, RATE_LIMIT_ENABLED=False
+                ):
+                    results.append(self.run(routed, options))
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+        self.report(results)
+
+    def seed(self, options):
+        rng = random.Random(options["seed"])
+        lng, lat = CENTER
+        restaurants = Restaurant.objects.bulk_create(
+            Restaurant(
+                name=f"Bench Restaurant {i}",
+                place_id=f"bench-{i}",
+                location=Point(
+                    lng + rng.uniform(-0.2, 0.2),
+                    lat + rng.uniform(-0.2, 0.2),
+                    srid=4326,
+                ),
+                address=f"{i} Bench Street",
+                verified=True,
+                # Full, so every join queues.
+                available_seats=0,
+            )
+            for i in range(options["restaurants"])
+        )
+        self.restaurants = restaurants
+        menu_restaurants = restaurants[:10]
+        categories = Category.objects.bulk_create(
+            Category(
+                name=f"Category {c}",
+                category_id=f"BENCHCAT{r.pk}-{c}",
+                restaurant=r,
+            )
+            for r in menu_restaurants
+            for c in range(options["categories"])
+        )
+        items = Item.objects.bulk_create(
+            Item(
+                name=f"Item {category.pk}-{i}",
+                item_id=f"BENCHITEM{category.pk}-{i}",
+                category=category,
+                description="A dish seeded for benchmarking.",
+            )
+            for category in categories
+            for i in range(options["items"])
+        )
+        Variation.objects.bulk_create(
+            Variation(
+                name=f"Size {v}",
+                reference_id=f"#{item.pk}__{v}",
+                item=item,
+                price=5 + v,
+                quantity=1000,
+            )
+            for item in items
+            for v in range(2)
+        )
+        self.menu_place_ids = [r.place_id for r in menu_restaurants]
+
+        encoded = make_password("bench-password")
+        joins = options["clients"] * options["requests"]
+        users = User.objects.bulk_create(
+            User(email=f"bench-user-{i}@example.com", password=encoded)
+            for i in range(options["queue"] + options["clients"] + joins)
+        )
+        Queue.objects.bulk_create(
+            Queue(
+                restaurant=rng.choice(restaurants),
+                user=user,
+                party_size=rng.randint(1, 4),
+                position=1,
+            )
+            for user in users[: options["queue"]]
+        )
+        # Readers never write, so they stay on the replicas; each join uses
+        # a fresh token whose client is then pinned to the primary.
+        rest = users[options["queue"] :]
+        self.reader_tokens = [issue_token(u) for u in rest[: options["clients"]]]
+        self.joiner_tokens = iter([issue_token(u) for u in rest[options["clients"] :]])
+        self.joiner_lock = threading.Lock()
+
+    def next_joiner(self):
+        with self.joiner_lock:
+            return next(self.joiner_tokens)
+
+    def request(self, client, name, rng):
+        restaurant = rng.choice(self.restaurants)
+        detail = f"/restaurants/{restaurant.place_id}"
+        if name == "get_menu":
+            return [
+                client.get(f"/restaurants/{rng.choice(self.menu_place_ids)}/get-menu/")
+            ]
+        if name == "available_seats":
+            return [client.get(f"{detail}/available-seats/")]
+        if name == "get_queue_size":
+            return [client.get(f"{detail}/queue-size/")]
+        if name == "retrieve":
+            return [client.get(f"/restaurants/{restaurant.pk}/", {"expand": ""})]
+        if name == "list":
+            return [client.get("/restaurants/")]
+        joiner = APIClient()
+        joiner.credentials(HTTP_AUTHORIZATION=f"Token {self.next_joiner()}")
+        return [
+            joiner.post(f"{detail}/join-queue/", {"party_size": 2}, format="json"),
+            joiner.get(f"{detail}/queue-size/"),
+        ]
+
+    def client_loop(self, index, load, latencies, errors, options):
+        rng = random.Random(options["seed"] + index)
+        names = rng.choices(
+            list(MIX), weights=list(MIX.values()), k=options["requests"]
+        )
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {self.reader_tokens[index]}")
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(
+                        connections[alias].execute_wrapper(load.wrapper(alias))
+                    )
+                for name in names:
+                    started = time.perf_counter()
+                    responses = self.request(client, name, rng)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    errors.extend(
+                        r.status_code for r in responses if r.status_code >= 400
+                    )
+        finally:
+            connections.close_all()
+
+    def run(self, routed, options):
+        load = QueryLoad()
+        latencies = []
+        errors = []
+        threads = [
+            threading.Thread(
+                target=self.client_loop, args=(i, load, latencies, errors, options)
+            )
+            for i in range(options["clients"])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        return {
+            "mode": "replicas" if routed else "primary only",
+            "requests": len(latencies),
+            "rps": len(latencies) / elapsed,
+            "p50": percentile_of(latencies, 50),
+            "p95": percentile_of(latencies, 95),
+            "errors": len(errors),
+            "queries": load.queries,
+            "seconds": load.seconds,
+        }
+
+    def report(self, results):
+        self.stdout.write(
+            f"{'mode':<14} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7} "
+            f"{'primary q':>10} {'primary s':>10} {'replica q':>10} {'replica s':>10}"
+        )
+        for result in results:
+            primary_queries = result["queries"].get(DEFAULT_DB_ALIAS, 0)
+            primary_seconds = result["seconds"].get(DEFAULT_DB_ALIAS, 0.0)
+            replica_queries = sum(result["queries"].values()) - primary_queries
+            replica_seconds = sum(result["seconds"].values()) - primary_seconds
+            self.stdout.write(
+                f"{result['mode']:<14} {result['rps']:>8.1f} {result['p50']:>8.1f} "
+                f"{result['p95']:>8.1f} {result['errors']:>7} "
+                f"{primary_queries:>10} {primary_seconds:>10.2f} "
+                f"{replica_queries:>10} {replica_seconds:>10.2f}"
+            )
+        before = results[0]["seconds"].get(DEFAULT_DB_ALIAS, 0.0)
+        after = results[1]["seconds"].get(DEFAULT_DB_ALIAS, 0.0)
+        if before:
+            self.stdout.write(
+                f"SQL time on the primary fell by {(1 - after / before) * 100:.0f}% "
+                f"with reads routed to {len(settings.DATABASE_REPLICAS)} replica(s)."
+            )
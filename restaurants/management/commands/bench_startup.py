@@ -0,0 +1,197 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter per measurement, with -X importtime, so nothing
+# the parent already imported hides a module's cost.
+CHILD = """
+import asyncio
+import json
+import sys
+import time
+from wsgiref.util import setup_testing_defaults
+
+started = time.perf_counter()
+from dineQ.{entry_point} import application
+
+loaded = time.perf_counter()
+from django.test.utils import setup_test_environment
+
+# Lets the request through ALLOWED_HOSTS as "testserver".
+setup_test_environment()
+sys.stderr.write("bench_startup: first request\\n")
+sys.stderr.flush()
+requested = time.perf_counter()
+if "{entry_point}" == "wsgi":
+    statuses = []
+    environ = {{"REQUEST_METHOD": "GET", "PATH_INFO": {path!r}}}
+    setup_testing_defaults(environ)
+    environ["HTTP_HOST"] = "testserver"
+    body = application(environ, lambda status, headers: statuses.append(status))
+    b"".join(body)
+    body.close()
+    status = int(statuses[0].split()[0])
+else:
+    messages = []
+
+    async def receive():
+        return {{"type": "http.request", "body": b"", "more_body": False}}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(
+        application(
+            {{
+                "type": "http",
+                "asgi": {{"version": "3.0"}},
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": {path!r},
+                "query_string": b"",
+                "headers": [(b"host", b"testserver")],
+                "server": ("testserver", 80),
+                "client": ("127.0.0.1", 50000),
+            }},
+            receive,
+            send,
+        )
+    )
+    status = messages[0]["status"]
+finished = time.perf_counter()
+print(
+    json.dumps(
+        {{
+            "import_ms": (loaded - started) * 1000,
+            "request_ms": (finished - requested) * 1000,
+            "status": status,
+            "loaded": [module for module in {watched!r} if module in sys.modules],
+        }}
+    )
+)
+"""
+
+# Heavy dependencies that should load on first use rather than at start-up.
+WATCHED = ["square.client", "apimatic_requests_client_adapter", "httpx"]
+
+
+def import_group(module):
+    # The project's own modules are listed one by one, others by package.
+    if module.split(".")[0] in ("restaurants", "dineQ"):
+        return module
+    return module.split(".")[0]
+
+
+def parse_importtime(stderr):
+    """Self import time in ms per module group and phase, where phase is
+    "import" while loading the application and "first request" after."""
+    phase = "import"
+    groups = {}
+    for line in stderr.splitlines():
+        if line.startswith("bench_startup: first request"):
+            phase = "first request"
+            continue
+        if not line.startswith("import time:"):
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        key = (import_group(name.strip()), phase)
+        groups[key] = groups.get(key, 0.0) + int(self_us) / 1000
+    return groups
+
+
+class Command(BaseCommand):
+    help = (
+        "Start fresh interpreters that load the WSGI or ASGI application and "
+        "serve one request, and report the import time, time to the first "
+        "response and the packages and project modules slowest to import."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--entry-points",
+            nargs="+",
+            choices=["wsgi", "asgi"],
+            default=["wsgi", "asgi"],
+        )
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument(
+            "--path", default="/metrics/", help="Served as the first request."
+        )
+        parser.add_argument("--top", type=int, default=15)
+        parser.add_argument(
+            "--budget-ms",
+            type=float,
+            help="Fail when the median time to the first response exceeds this.",
+        )
+
+    def handle(self, *args, **options):
+        over_budget = []
+        for entry_point in options["entry_points"]:
+            runs = [
+                self.run(entry_point, options["path"]) for _ in range(options["runs"])
+            ]
+            total = self.report(entry_point, runs, options["top"])
+            if options["budget_ms"] and total > options["budget_ms"]:
+                over_budget.append(f"{entry_point} {total:.0f} ms")
+        if over_budget:
+            raise CommandError(
+                f"First response over {options['budget_ms']:.0f} ms: "
+                + ", ".join(over_budget)
+            )
+
+    def run(self, entry_point, path):
+        code = CHILD.format(entry_point=entry_point, path=path, watched=WATCHED)
+        started = time.perf_counter()
+        child = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=settings.BASE_DIR,
+            env=os.environ.copy(),
+            capture_output=True,
+            text=True,
+        )
+        wall_ms = (time.perf_counter() - started) * 1000
+        if child.returncode:
+            raise CommandError(f"{entry_point} child failed:\n{child.stderr[-2000:]}")
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        result["process_ms"] = wall_ms
+        result["imports"] = parse_importtime(child.stderr)
+        return result
+
+    def report(self, entry_point, runs, top):
+        import_ms = statistics.median(run["import_ms"] for run in runs)
+        request_ms = statistics.median(run["request_ms"] for run in runs)
+        process_ms = statistics.median(run["process_ms"] for run in runs)
+        self.stdout.write(
+            f"{entry_point}: import {import_ms:.0f} ms, first request "
+            f"{request_ms:.0f} ms (status {runs[-1]['status']}), whole process "
+            f"{process_ms:.0f} ms; median of {len(runs)} runs"
+        )
+
+        keys = {key for run in runs for key in run["imports"]}
+        slowest = sorted(
+            (
+                (statistics.median(run["imports"].get(key, 0.0) for run in runs),) + key
+                for key in keys
+            ),
+            reverse=True,
+        )[:top]
+        self.stdout.write(f"  {'module':<48} {'ms':>8}  phase")
+        for ms, module, phase in slowest:
+            self.stdout.write(f"  {module:<48} {ms:>8.1f}  {phase}")
+
+        loaded = runs[-1]["loaded"]
+        deferred = [module for module in WATCHED if module not in loaded]
+        self.stdout.write(
+            f"  loaded by the first response: {', '.join(loaded) or 'none'}; "
+            f"deferred: {', '.join(deferred) or 'none'}"
+        )
+        return import_ms + request_ms
@@ -0,0 +1,165 @@
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from restaurants.models import Category, Item, Order, Queue, Restaurant, User, Variation
+
+# The last migration without the hot lookup indexes.
+BEFORE_INDEXES = "0019_auth_token"
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a PostgreSQL test database with about a million rows per hot "
+        "table and print the EXPLAIN plan of each hot lookup with and without "
+        "the indexes added in 0020_hot_lookup_indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--restaurants", type=int, default=10_000)
+        parser.add_argument("--users", type=int, default=100_000)
+        parser.add_argument("--keepdb", action="store_true")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("explain_hot_queries needs the PostgreSQL database.")
+
+        setup_test_environment()
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options["keepdb"]
+        )
+        try:
+            started = time.monotonic()
+            self.seed(options)
+            self.stdout.write(f"Seeded in {time.monotonic() - started:.1f}s")
+            after = self.explain_all(options)
+            call_command("migrate", "restaurants", BEFORE_INDEXES, verbosity=0)
+            before = self.explain_all(options)
+            call_command("migrate", "restaurants", verbosity=0)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+        for name in after:
+            self.stdout.write(f"\n{name}")
+            self.stdout.write(f"  before: {self.summary(before[name])}")
+            self.stdout.write(f"  after:  {self.summary(after[name])}")
+            if options["verbosity"] > 1:
+                self.stdout.write(before[name])
+                self.stdout.write(after[name])
+
+    def seed(self, options):
+        rows = options["rows"]
+        tables = {
+            model: model._meta.db_table
+            for model in (Restaurant, Category, Item, Variation, User, Queue, Order)
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {tables[Restaurant]} (name, place_id, location, address,
+                    verified, geo_fence_radius, total_seats, available_seats,
+                    menu_version)
+                SELECT 'Restaurant ' || i, 'place-' || i,
+                    ST_SetSRID(ST_MakePoint(-122.4 + random(), 37.7 + random()), 4326),
+                    i || ' Market St', i %% 10 = 0, 5000, 20, 20, 0
+                FROM generate_series(1, %s) i
+                """,
+                [options["restaurants"]],
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {tables[Category]} (name, category_id, restaurant_id)
+                SELECT 'Mains', '#Mains', min(id) FROM {tables[Restaurant]}
+                """
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {tables[Item]} (name, item_id, category_id)
+                SELECT 'Item ' || i, '#Item' || i, (SELECT min(id) FROM {tables[Category]})
+                FROM generate_series(1, 1000) i
+                """
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {tables[Variation]} (name, reference_id, item_id, price,
+                    quantity)
+                SELECT 'Regular', '#Item_' || i || '__Regular', item.id, 9.99, 100
+                FROM generate_series(1, %s) i
+                JOIN {tables[Item]} item ON item.item_id = '#Item' || (i %% 1000 + 1)
+                """,
+                [rows],
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {tables[User]} (email, password, is_staff_user, is_active,
+                    is_seated)
+                SELECT 'diner' || i || '@example.com', '', false, true, false
+                FROM generate_series(1, %s) i
+                """,
+                [options["users"]],
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {tables[Queue]} (restaurant_id, user_id, party_size,
+                    joined_at)
+                SELECT r.first + i %% %s, u.first + i %% %s, 1 + i %% 6,
+                    now() - i * interval '1 second'
+                FROM generate_series(1, %s) i,
+                    (SELECT min(id) AS first FROM {tables[Restaurant]}) r,
+                    (SELECT min(id) AS first FROM {tables[User]}) u
+                """,
+                [options["restaurants"], options["users"], rows],
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {tables[Order]} (user_id, unique_order_identifier,
+                    order_id, created_at)
+                SELECT u.first + i %% %s, lpad(to_hex(i), 6, '0'), 'ORDER' || i, now()
+                FROM generate_series(1, %s) i,
+                    (SELECT min(id) AS first FROM {tables[User]}) u
+                """,
+                [options["users"], rows],
+            )
+            for table in tables.values():
+                cursor.execute(f"ANALYZE {table}")
+
+    def explain_all(self, options):
+        rows = options["rows"]
+        restaurant = Restaurant.objects.get(place_id=f"place-{options['restaurants']}")
+        entry = Queue.objects.filter(restaurant=restaurant).last()
+        queries = {
+            "place_order: Variation by reference_id": Variation.objects.filter(
+                reference_id=f"#Item_{rows // 2}__Regular"
+            ),
+            "retrieve_order: Order by order_id": Order.objects.filter(
+                order_id=f"ORDER{rows // 2}"
+            ),
+            "queue_position: Queue ahead of an entry": Queue.objects.filter(
+                restaurant=restaurant, joined_at__lt=entry.joined_at
+            ),
+            "release_seats: Queue in joined_at order": Queue.objects.filter(
+                restaurant=restaurant
+            ).order_by("joined_at")[:100],
+            "nearby: verified Restaurants by place_id": Restaurant.objects.filter(
+                place_id__in=[f"place-{i}" for i in range(5, 200, 5)], verified=True
+            ),
+        }
+        return {name: queryset.explain() for name, queryset in queries.items()}
+
+    def summary(self, plan):
+        nodes = [
+            line.strip().lstrip("-> ").split("  ")[0]
+            for line in plan.splitlines()
+            if "Scan" in line
+        ]
+        return "; ".join(nodes) or plan.splitlines()[0]
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from restaurants.webhooks import process_events
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply stored Square webhook events to local orders, inventory and "
+        "seating state."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Seconds between batches; 0 processes once and exits.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            applied = process_events()
+            if applied or not options["interval"]:
+                self.stdout.write(f"applied {applied} webhook events")
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
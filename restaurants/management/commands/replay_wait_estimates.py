@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+
+from restaurants.estimation import MemoryStatStore, WaitTimeEstimator
+from restaurants.models import Restaurant, SeatingEvent
+from restaurants.simulation import percentile_of
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the seating event log through a fresh wait-time estimator and "
+        "report how far its estimates at join time were from actual waits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--restaurant", help="Only replay this place_id.")
+        parser.add_argument("--alpha", type=float, default=None)
+
+    def handle(self, *args, **options):
+        estimator = WaitTimeEstimator(MemoryStatStore(), alpha=options["alpha"])
+        events = SeatingEvent.objects.order_by("created_at", "id")
+        restaurants = Restaurant.objects.all()
+        if options["restaurant"]:
+            events = events.filter(restaurant__place_id=options["restaurant"])
+            restaurants = restaurants.filter(place_id=options["restaurant"])
+        # The views estimate with the restaurant's seat count; so must the
+        # replay, or it scores a different estimator.
+        total_seats = dict(restaurants.values_list("pk", "total_seats"))
+
+        waiting = {}
+        seated = {}
+        errors = []
+        for event in events.iterator(chunk_size=2000):
+            key = (event.restaurant_id, event.user_id)
+            if event.kind == SeatingEvent.JOINED:
+                predicted = estimator.estimate(
+                    event.restaurant_id,
+                    event.party_size,
+                    event.position,
+                    total_seats.get(event.restaurant_id),
+                )
+                waiting[key] = (event, predicted)
+            elif event.kind == SeatingEvent.SEATED:
+                seated[event.user_id] = event
+                if key not in waiting:
+                    continue
+                joined, predicted = waiting.pop(key)
+                actual = (event.created_at - joined.created_at).total_seconds()
+                errors.append(predicted - actual)
+                estimator.observe_wait(
+                    event.restaurant_id, joined.party_size, joined.position, actual
+                )
+            elif event.kind == SeatingEvent.RELEASED:
+                seated_event = seated.pop(event.user_id, None)
+                if seated_event is not None:
+                    estimator.observe_dining(
+                        event.restaurant_id,
+                        seated_event.party_size,
+                        (event.created_at - seated_event.created_at).total_seconds(),
+                    )
+            elif event.kind == SeatingEvent.LEFT:
+                waiting.pop(key, None)
+
+        if not errors:
+            self.stdout.write("No completed waits to score.")
+            return
+
+        absolute = [abs(error) for error in errors]
+        self.stdout.write(f"scored waits:       {len(errors)}")
+        self.stdout.write(f"mean abs error:     {sum(absolute) / len(absolute):.0f}s")
+        self.stdout.write(f"median abs error:   {percentile_of(absolute, 50):.0f}s")
+        self.stdout.write(f"p90 abs error:      {percentile_of(absolute, 90):.0f}s")
+        self.stdout.write(f"mean bias:          {sum(errors) / len(errors):+.0f}s")
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+
+from restaurants.fake_upstreams import (
+    FakeUpstreamServer,
+    FakeUpstreamState,
+    place_from_restaurant,
+)
+from restaurants.models import Restaurant
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local stand-in for the Square and Google Places endpoints the "
+        "API uses, with optional latency and error injection."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8100)
+        parser.add_argument(
+            "--latency-ms", type=float, default=0, help="Added to every response."
+        )
+        parser.add_argument(
+            "--jitter-ms",
+            type=float,
+            default=0,
+            help="Uniform random extra latency on top of --latency-ms.",
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=0,
+            help="Fraction of requests answered with a 503.",
+        )
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument("--verbose", action="store_true")
+
+    def handle(self, *args, **options):
+        # Nearby search answers with the verified restaurants in this database
+        # so the view finds matches for them.
+        places = [
+            place_from_restaurant(restaurant)
+            for restaurant in Restaurant.objects.filter(verified=True)
+        ]
+        server = FakeUpstreamServer(
+            (options["host"], options["port"]),
+            state=FakeUpstreamState(places),
+            latency=options["latency_ms"] / 1000,
+            jitter=options["jitter_ms"] / 1000,
+            error_rate=options["error_rate"],
+            seed=options["seed"],
+            verbose=options["verbose"],
+        )
+        self.stdout.write(
+            f"Serving {len(places)} places on {server.url}. Point the API at it "
+            f"with:\n"
+            f"  SQUARE_BASE_URL={server.url}\n"
+            f"  GOOGLE_PLACES_BASE_URL={server.url}/maps/api/place"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
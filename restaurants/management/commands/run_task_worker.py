@@ -0,0 +1,73 @@
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from restaurants.db_pool import close_pools
+from restaurants.metrics import serve_metrics
+from restaurants.tasks import Worker
+
+
+def work(concurrency, metrics_port):
+    worker = Worker(concurrency, settings.TASK_POLL_SECONDS)
+    signal.signal(signal.SIGTERM, lambda *args: worker.stop())
+    if metrics_port:
+        serve_metrics(metrics_port)
+    worker.run_forever()
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued Square side effects: catalog syncs, inventory changes, "
+        "invoices and terminal checkouts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=1)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.TASK_WORKER_CONCURRENCY,
+            help="Worker threads per process.",
+        )
+        parser.add_argument(
+            "--metrics-port",
+            type=int,
+            default=0,
+            help="Serve Prometheus metrics from this port, one port per "
+            "process counting up from it; 0 disables.",
+        )
+
+    def handle(self, *args, **options):
+        concurrency = options["concurrency"]
+        metrics_port = options["metrics_port"]
+        self.stdout.write(
+            f"Running tasks on {options['processes']} processes with "
+            f"{concurrency} threads each"
+        )
+        if options["processes"] == 1:
+            work(concurrency, metrics_port)
+            return
+
+        # Forked children must not share the parent's database connections.
+        connections.close_all()
+        close_pools()
+        processes = [
+            multiprocessing.Process(
+                target=work,
+                args=(concurrency, metrics_port + index if metrics_port else 0),
+            )
+            for index in range(options["processes"])
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
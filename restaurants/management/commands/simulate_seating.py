@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from restaurants.seating import SCHEDULERS, build_scheduler
+from restaurants.simulation import generate_trace, simulate
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a synthetic arrival/release trace against each seating "
+        "strategy and report seat utilization and wait-time percentiles."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seats", type=int, default=40)
+        parser.add_argument("--minutes", type=int, default=600)
+        parser.add_argument("--arrival-rate", type=float, default=0.25)
+        parser.add_argument("--mean-dining", type=float, default=45)
+        parser.add_argument("--window", type=int, default=None)
+        parser.add_argument("--max-wait", type=int, default=30)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument(
+            "--strategies", nargs="+", default=list(SCHEDULERS), metavar="STRATEGY"
+        )
+
+    def handle(self, *args, **options):
+        trace = generate_trace(
+            options["minutes"],
+            options["arrival_rate"],
+            options["mean_dining"],
+            seed=options["seed"],
+        )
+        self.stdout.write(
+            f"{len(trace)} parties, {options['seats']} seats, "
+            f"{options['minutes']} minutes"
+        )
+        self.stdout.write(
+            f"{'strategy':<12} {'util':>6} {'p50':>7} {'p90':>7} {'p99':>7} "
+            f"{'unseated':>8}"
+        )
+        for strategy in options["strategies"]:
+            scheduler = build_scheduler(
+                strategy,
+                window=options["window"],
+                max_wait_minutes=options["max_wait"],
+            )
+            result = simulate(strategy, scheduler, trace, options["seats"])
+            self.stdout.write(
+                f"{strategy:<12} {result.utilization:>6.1%} "
+                f"{result.wait_percentile(50):>6.1f}m "
+                f"{result.wait_percentile(90):>6.1f}m "
+                f"{result.wait_percentile(99):>6.1f}m "
+                f"{result.unseated:>8}"
+            )
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from restaurants.metrics import serve_metrics
+from restaurants.sweeper import sweep
+
+
+class Command(BaseCommand):
+    help = (
+        "Expire stale queue entries, reclaim seats from abandoned parties and "
+        "run a seating pass for every affected restaurant."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Seconds between sweeps; 0 sweeps once and exits.",
+        )
+        parser.add_argument(
+            "--metrics-port",
+            type=int,
+            default=0,
+            help="Serve the sweeper's Prometheus metrics from this port; needs "
+            "--interval. 0 disables.",
+        )
+
+    def handle(self, *args, **options):
+        if options["metrics_port"]:
+            # Its counters live in this process, so only a sweeper that
+            # keeps running can be scraped.
+            if not options["interval"]:
+                raise CommandError("--metrics-port needs --interval.")
+            serve_metrics(options["metrics_port"])
+        while True:
+            result = sweep()
+            self.stdout.write(
+                f"expired {result.expired_entries} queue entries, reclaimed "
+                f"{result.reclaimed_seats} seats from {result.reclaimed_users} "
+                f"users, seated {result.seated_parties} parties across "
+                f"{len(result.restaurants)} restaurants, pruned "
+                f"{result.pruned_menu_changes} menu changes and "
+                f"{result.pruned_tasks} finished tasks"
+            )
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,204 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Min
+
+from .menu_snapshot import invalidate_snapshot, pack_delta
+from .models import Category, Item, MenuChange, Restaurant, Variation
+from .serializers import CategorySerializer, ItemSerializer, VariationSerializer
+
+KINDS = {
+    Category: MenuChange.CATEGORY,
+    Item: MenuChange.ITEM,
+    Variation: MenuChange.VARIATION,
+}
+SECTIONS = {
+    MenuChange.CATEGORY: "categories",
+    MenuChange.ITEM: "items",
+    MenuChange.VARIATION: "variations",
+}
+
+
+def record_menu_changes(restaurant_id, changes, deleted=False):
+    """Records ``(kind, object_id)`` pairs as one new menu version and
+    returns it. The version bump locks the restaurant row, so versions
+    commit in order."""
+    with transaction.atomic():
+        Restaurant.objects.filter(pk=restaurant_id).update(
+            menu_version=F("menu_version") + 1
+        )
+        version = Restaurant.objects.values_list("menu_version", flat=True).get(
+            pk=restaurant_id
+        )
+        MenuChange.objects.bulk_create(
+            MenuChange(
+                restaurant_id=restaurant_id,
+                version=version,
+                kind=kind,
+                object_id=object_id,
+                deleted=deleted,
+            )
+            for kind, object_id in changes
+        )
+    return version
+
+
+def changes_since(restaurant, since):
+    """Returns the menu version, the categories, items and variations
+    changed after version ``since`` and the ids of deleted ones, each keyed
+    by section, or None when the log no longer reaches back that far and the
+    client needs the full menu."""
+    version = restaurant.menu_version
+    if since > version:
+        return None
+    if since < version:
+        oldest = MenuChange.objects.filter(restaurant=restaurant).aggregate(
+            oldest=Min("version")
+        )["oldest"]
+        if oldest is None or oldest > since + 1:
+            return None
+
+    # Later changes to the same object supersede earlier ones.
+    latest = {}
+    for kind, object_id, deleted in (
+        MenuChange.objects.filter(
+            restaurant=restaurant, version__gt=since, version__lte=version
+        )
+        .order_by("version", "id")
+        .values_list("kind", "object_id", "deleted")
+    ):
+        latest[kind, object_id] = deleted
+
+    changed = {kind: set() for kind in SECTIONS}
+    deleted = {kind: set() for kind in SECTIONS}
+    for (kind, object_id), was_deleted in latest.items():
+        (deleted if was_deleted else changed)[kind].add(object_id)
+
+    objects = {
+        MenuChange.CATEGORY: Category.objects.filter(
+            restaurant=restaurant, pk__in=changed[MenuChange.CATEGORY]
+        ),
+        MenuChange.ITEM: Item.objects.filter(
+            category__restaurant=restaurant, pk__in=changed[MenuChange.ITEM]
+        ),
+        MenuChange.VARIATION: Variation.objects.filter(
+            item__category__restaurant=restaurant,
+            pk__in=changed[MenuChange.VARIATION],
+        ),
+    }
+    rows = {}
+    removed = {}
+    for kind, section in SECTIONS.items():
+        rows[section] = list(objects[kind].order_by("id"))
+        # Objects deleted after the log was read count as deleted too.
+        missing = changed[kind] - {row.id for row in rows[section]}
+        removed[section] = sorted(deleted[kind] | missing)
+    return version, rows, removed
+
+
+def menu_delta(restaurant, since):
+    """The changes after version ``since`` serialized as JSON-style rows,
+    or None when the client needs the full menu."""
+    changes = changes_since(restaurant, since)
+    if changes is None:
+        return None
+    version, rows, deleted = changes
+    flat = {"expand": set()}
+    return {
+        "version": version,
+        "full": False,
+        "deleted": deleted,
+        "categories": CategorySerializer(
+            rows["categories"], many=True, context=flat
+        ).data,
+        "items": ItemSerializer(rows["items"], many=True, context=flat).data,
+        "variations": VariationSerializer(rows["variations"], many=True).data,
+    }
+
+
+def packed_menu_delta(restaurant, since):
+    """The changes after version ``since`` in the snapshot's MessagePack
+    layout, or None when the client needs the full menu."""
+    changes = changes_since(restaurant, since)
+    if changes is None:
+        return None
+    return pack_delta(restaurant, *changes)
+
+
+PARENTS = {Category: "restaurant_id", Item: "category_id", Variation: "item_id"}
+
+
+class PendingDeletions:
+    """The menu objects deleted in one transaction, tombstoned in one batch
+    when it commits rather than with a few queries per object."""
+
+    def __init__(self):
+        self.deleted = []
+
+    @classmethod
+    def for_transaction(cls, using):
+        connection = transaction.get_connection(using)
+        # Rolling back a transaction or savepoint drops its callbacks from
+        # this list, so a batch found here will still be recorded.
+        for _, callback, _ in connection.run_on_commit:
+            if isinstance(callback, cls):
+                return callback
+        pending = cls()
+        transaction.on_commit(pending, using=using)
+        return pending
+
+    def __call__(self):
+        # Parents deleted along with their children are in the batch; the
+        # rest are still in the database.
+        parents = {kind: {} for kind in SECTIONS}
+        for kind, object_id, parent_id in self.deleted:
+            parents[kind][object_id] = parent_id
+        category_of = dict(parents[MenuChange.ITEM])
+        category_of.update(
+            Item.objects.filter(
+                pk__in=set(parents[MenuChange.VARIATION].values()) - category_of.keys()
+            ).values_list("pk", "category_id")
+        )
+        restaurant_of = dict(parents[MenuChange.CATEGORY])
+        restaurant_of.update(
+            Category.objects.filter(
+                pk__in=set(category_of.values()) - restaurant_of.keys()
+            ).values_list("pk", "restaurant_id")
+        )
+
+        # Deletions undone by a rolled-back savepoint are not tombstoned.
+        survivors = set()
+        for model, kind in KINDS.items():
+            survivors.update(
+                (kind, object_id)
+                for object_id in model.objects.filter(pk__in=parents[kind]).values_list(
+                    "pk", flat=True
+                )
+            )
+
+        changes = defaultdict(list)
+        for kind, object_id, parent_id in self.deleted:
+            if (kind, object_id) in survivors:
+                continue
+            if kind == MenuChange.VARIATION:
+                parent_id = category_of.get(parent_id)
+            if kind != MenuChange.CATEGORY:
+                parent_id = restaurant_of.get(parent_id)
+            if parent_id is not None:
+                changes[parent_id].append((kind, object_id))
+
+        # Deleting a whole restaurant records nothing.
+        place_ids = dict(
+            Restaurant.objects.filter(pk__in=changes).values_list("pk", "place_id")
+        )
+        for restaurant_id, place_id in place_ids.items():
+            record_menu_changes(restaurant_id, changes[restaurant_id], deleted=True)
+            invalidate_snapshot(place_id)
+
+
+def record_deletion(sender, instance, using, **kwargs):
+    """Tombstones menu objects deleted outside the API, e.g. in the admin,
+    once the deleting transaction commits."""
+    PendingDeletions.for_transaction(using).deleted.append(
+        (KINDS[sender], instance.pk, getattr(instance, PARENTS[sender]))
+    )
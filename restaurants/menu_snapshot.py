@@ -0,0 +1,165 @@
+import msgpack
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.renderers import BaseRenderer
+
+from .models import Category, Restaurant
+from .routing import primary_reads
+
+# A compact MessagePack form of a restaurant's menu for mobile clients. Each
+# table is stored column by column, so field names appear once per menu
+# instead of once per row. Items and variations point at their parent by
+# its index in the parent table. Prices are integer cents. Variation
+# reference ids all end in "__<place_id>"; that suffix is stored once as
+# reference_suffix and stripped from every row. Deltas for ``?since=`` use
+# the same layout with ``full`` false and a ``deleted`` map of ids per
+# table; as a delta may lack the parent rows, items and variations name
+# their parent by id in ``category_id`` and ``item_id`` columns instead.
+
+MEDIA_TYPE = "application/vnd.dineq.menu+msgpack"
+VERSION = 1
+
+
+def snapshot_key(place_id):
+    return f"menu-snapshot:{place_id}"
+
+
+def strip_suffix(references, place_id):
+    """Returns the shared reference suffix, or "" if any reference lacks
+    it, and the references without it."""
+    suffix = f"__{place_id}"
+    if all(reference and reference.endswith(suffix) for reference in references):
+        return suffix, [reference[: -len(suffix)] for reference in references]
+    return "", references
+
+
+def build_snapshot(restaurant):
+    # Read before the menu so a snapshot never claims changes it lacks.
+    menu_version = Restaurant.objects.values_list("menu_version", flat=True).get(
+        pk=restaurant.pk
+    )
+    categories = {"id": [], "name": [], "square_id": []}
+    items = {"id": [], "category": [], "name": [], "description": [], "square_id": []}
+    variations = {
+        "id": [],
+        "item": [],
+        "name": [],
+        "price": [],
+        "quantity": [],
+        "square_id": [],
+        "reference_id": [],
+    }
+    for category in Category.objects.filter(restaurant=restaurant).prefetch_related(
+        "items__variations"
+    ):
+        category_index = len(categories["id"])
+        categories["id"].append(category.id)
+        categories["name"].append(category.name)
+        categories["square_id"].append(category.square_id)
+        for item in category.items.all():
+            item_index = len(items["id"])
+            items["id"].append(item.id)
+            items["category"].append(category_index)
+            items["name"].append(item.name)
+            items["description"].append(item.description)
+            items["square_id"].append(item.square_id)
+            for variation in item.variations.all():
+                variations["id"].append(variation.id)
+                variations["item"].append(item_index)
+                variations["name"].append(variation.name)
+                variations["price"].append(int(variation.price * 100))
+                variations["quantity"].append(variation.quantity)
+                variations["square_id"].append(variation.square_id)
+                variations["reference_id"].append(variation.reference_id)
+
+    suffix, variations["reference_id"] = strip_suffix(
+        variations["reference_id"], restaurant.place_id
+    )
+    return msgpack.packb(
+        {
+            "version": VERSION,
+            "place_id": restaurant.place_id,
+            "menu_version": menu_version,
+            "full": True,
+            "reference_suffix": suffix,
+            "categories": categories,
+            "items": items,
+            "variations": variations,
+        }
+    )
+
+
+def pack_delta(restaurant, menu_version, rows, deleted):
+    """Packs the changed categories, items and variations in ``rows`` and
+    the deleted ids for a ``?since=`` request."""
+    categories = rows["categories"]
+    items = rows["items"]
+    variations = rows["variations"]
+    suffix, references = strip_suffix(
+        [variation.reference_id for variation in variations], restaurant.place_id
+    )
+    return msgpack.packb(
+        {
+            "version": VERSION,
+            "place_id": restaurant.place_id,
+            "menu_version": menu_version,
+            "full": False,
+            "reference_suffix": suffix,
+            "categories": {
+                "id": [category.id for category in categories],
+                "name": [category.name for category in categories],
+                "square_id": [category.square_id for category in categories],
+            },
+            "items": {
+                "id": [item.id for item in items],
+                "category_id": [item.category_id for item in items],
+                "name": [item.name for item in items],
+                "description": [item.description for item in items],
+                "square_id": [item.square_id for item in items],
+            },
+            "variations": {
+                "id": [variation.id for variation in variations],
+                "item_id": [variation.item_id for variation in variations],
+                "name": [variation.name for variation in variations],
+                "price": [int(variation.price * 100) for variation in variations],
+                "quantity": [variation.quantity for variation in variations],
+                "square_id": [variation.square_id for variation in variations],
+                "reference_id": references,
+            },
+            "deleted": deleted,
+        }
+    )
+
+
+def refresh_snapshot(restaurant):
+    # Cached for a long time, so built from the primary rather than a
+    # replica that may lag behind the change that invalidated it.
+    with primary_reads():
+        snapshot = build_snapshot(restaurant)
+    cache.set(
+        snapshot_key(restaurant.place_id), snapshot, settings.MENU_SNAPSHOT_SECONDS
+    )
+    return snapshot
+
+
+def cached_snapshot(place_id):
+    return cache.get(snapshot_key(place_id))
+
+
+def invalidate_snapshot(place_id):
+    cache.delete(snapshot_key(place_id))
+
+
+class MenuSnapshotRenderer(BaseRenderer):
+    """Serves prebuilt snapshots as-is and packs anything else, such as
+    error bodies, with MessagePack."""
+
+    media_type = MEDIA_TYPE
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        return msgpack.packb(data, default=str)
@@ -0,0 +1,157 @@
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Returns ``(sample name, labels, value)`` for every series."""
+        with self._lock:
+            return [
+                (self.name, dict(zip(self.labelnames, key)), value)
+                for key, value in self.values.items()
+            ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            self.values[self._key(labels)] += amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            self.values[self._key(labels)] += amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=None):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets or self.default_buckets)
+        # Per series: one count per bucket, then the sum and the count.
+        self.values = defaultdict(lambda: [0] * (len(self.buckets) + 2))
+
+    def observe(self, value, **labels):
+        with self._lock:
+            series = self.values[self._key(labels)]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, series in self.values.items():
+                labels = dict(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, series):
+                    samples.append(
+                        (f"{self.name}_bucket", {**labels, "le": str(bound)}, count)
+                    )
+                samples.append(
+                    (f"{self.name}_bucket", {**labels, "le": "+Inf"}, series[-1])
+                )
+                samples.append((f"{self.name}_sum", labels, series[-2]))
+                samples.append((f"{self.name}_count", labels, series[-1]))
+        return samples
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _register(metric_class, name, documentation, labelnames, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = metric_class(
+                name, documentation, labelnames, **kwargs
+            )
+        return metric
+
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return _register(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=None):
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def all_metrics():
+    with _registry_lock:
+        return list(_registry.values())
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_prometheus():
+    """Renders every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in sorted(all_metrics(), key=lambda metric: metric.name):
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            if labels:
+                pairs = ",".join(
+                    f'{label}="{escape_label(str(v))}"' for label, v in labels.items()
+                )
+                name = f"{name}{{{pairs}}}"
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port):
+    """Serves this process's metrics on ``port`` from a daemon thread, for
+    background commands whose counters the web workers' metrics/ never
+    sees."""
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.1 on 2026-10-19 00:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0016_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queue',
+            name='position',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='TurnoverStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('party_size', models.IntegerField()),
+                ('wait_per_position', models.FloatField(default=0)),
+                ('wait_samples', models.IntegerField(default=0)),
+                ('dining_seconds', models.FloatField(default=0)),
+                ('dining_samples', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turnover_stats', to='restaurants.restaurant')),
+            ],
+            options={
+                'unique_together': {('restaurant', 'party_size')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SeatingEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('joined', 'Joined queue'), ('seated', 'Seated'), ('released', 'Released seats'), ('left', 'Left queue')], max_length=10)),
+                ('party_size', models.IntegerField()),
+                ('position', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seating_events', to='restaurants.restaurant')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='seating_events', to='restaurants.user')),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['user', 'kind', 'created_at'], name='restaurants_user_id_95c1ad_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.1 on 2026-10-19 00:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0017_seating_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='queue_timeout_minutes',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='seat_timeout_minutes',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.1 on 2026-10-19 00:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0019_auth_token'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['restaurant', 'joined_at'], name='queue_restaurant_joined_idx'),
+        ),
+        migrations.AlterField(
+            model_name='queue',
+            name='restaurant',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='queue', to='restaurants.restaurant'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='order_id',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='variation',
+            name='reference_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=models.Index(condition=models.Q(('verified', True)), fields=['place_id'], name='restaurant_verified_place_idx'),
+        ),
+    ]
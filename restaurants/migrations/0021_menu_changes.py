@@ -0,0 +1,35 @@
+# Generated by Django 4.2.1 on 2026-10-19 00:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0020_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='menu_version',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='MenuChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('category', 'Category'), ('item', 'Item'), ('variation', 'Variation')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='menu_changes', to='restaurants.restaurant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['restaurant', 'version'], name='restaurants_restaur_08a559_idx')],
+            },
+        ),
+    ]
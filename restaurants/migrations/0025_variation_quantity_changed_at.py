@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-19 01:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0024_tasks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='variation',
+            name='quantity_changed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
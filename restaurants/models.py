@@ -1,6 +1,10 @@
+import secrets
+
 from django.contrib.auth.hashers import check_password, make_password
 from django.contrib.auth.models import BaseUserManager
 from django.contrib.gis.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.utils import timezone
 from django.utils.crypto import get_random_string
 
 
@@ -14,6 +18,22 @@ class Restaurant(models.Model):
     geo_fence_radius = models.IntegerField(default=5000)
     total_seats = models.IntegerField(default=20)
     available_seats = models.IntegerField(default=20)
+    # Per-restaurant overrides for the sweeper; null uses the global setting.
+    queue_timeout_minutes = models.IntegerField(blank=True, null=True)
+    seat_timeout_minutes = models.IntegerField(blank=True, null=True)
+    # Bumped once per batch of menu changes; see MenuChange.
+    menu_version = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Nearby search keeps only the verified places among Google's
+            # results; this stays small next to the full place_id index.
+            models.Index(
+                fields=["place_id"],
+                condition=models.Q(verified=True),
+                name="restaurant_verified_place_idx",
+            )
+        ]
 
     def __str__(self):
         return self.name
@@ -28,6 +48,15 @@ class Category(models.Model):
     )
     square_id = models.CharField(max_length=255, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            GinIndex(
+                fields=["name"],
+                opclasses=["gin_trgm_ops"],
+                name="category_name_trgm_idx",
+            )
+        ]
+
 
 class Item(models.Model):
     name = models.CharField(max_length=255)
@@ -39,6 +68,19 @@ class Item(models.Model):
     )
     square_id = models.CharField(max_length=255, blank=True, null=True)
 
+    class Meta:
+        # Menu search matches words in these by trigram similarity.
+        indexes = [
+            GinIndex(
+                fields=["name"], opclasses=["gin_trgm_ops"], name="item_name_trgm_idx"
+            ),
+            GinIndex(
+                fields=["description"],
+                opclasses=["gin_trgm_ops"],
+                name="item_description_trgm_idx",
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -46,16 +88,46 @@ class Item(models.Model):
 class Variation(models.Model):
     name = models.CharField(max_length=255)
     variation_id = models.CharField(max_length=255, blank=True, null=True)
-    reference_id = models.CharField(max_length=255, blank=True, null=True)
+    reference_id = models.CharField(
+        max_length=255, blank=True, null=True, db_index=True
+    )
     item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name="variations")
     price = models.DecimalField(max_digits=7, decimal_places=2)
     quantity = models.IntegerField(default=0)
+    # When quantity last changed, so older Square counts can be ignored.
+    quantity_changed_at = models.DateTimeField(blank=True, null=True)
     square_id = models.CharField(max_length=255, blank=True, null=True)
 
     def __str__(self):
         return self.name
 
 
+class MenuChange(models.Model):
+    """One category, item or variation touched by menu version ``version``.
+    Clients holding an older version fetch only what changed since."""
+
+    CATEGORY = "category"
+    ITEM = "item"
+    VARIATION = "variation"
+    KIND_CHOICES = [
+        (CATEGORY, "Category"),
+        (ITEM, "Item"),
+        (VARIATION, "Variation"),
+    ]
+
+    restaurant = models.ForeignKey(
+        Restaurant, on_delete=models.CASCADE, related_name="menu_changes"
+    )
+    version = models.BigIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["restaurant", "version"])]
+
+
 class UserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
         if not email:
@@ -82,24 +154,103 @@ class User(models.Model):
         self.password = make_password(password)
 
     def check_password(self, raw_password):
-        return check_password(raw_password, self.password)
+        def upgrade(raw_password):
+            self.set_password(raw_password)
+            self.save(update_fields=["password"])
+
+        return check_password(raw_password, self.password, upgrade)
+
+    # Lets DRF treat token-authenticated users like django.contrib.auth users.
+    @property
+    def is_authenticated(self):
+        return True
+
+    @property
+    def is_anonymous(self):
+        return False
 
     def __str__(self):
         return self.email
 
 
+class AuthToken(models.Model):
+    key = models.CharField(max_length=40, primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="auth_tokens")
+    created = models.DateTimeField(auto_now_add=True)
+
+    def save(self, *args, **kwargs):
+        if not self.key:
+            self.key = secrets.token_hex(20)
+        return super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.key
+
+
 class Queue(models.Model):
+    # Indexed by queue_restaurant_joined_idx, which leads with restaurant.
     restaurant = models.ForeignKey(
-        Restaurant, on_delete=models.CASCADE, related_name="queue"
+        Restaurant, on_delete=models.CASCADE, related_name="queue", db_index=False
     )
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="queue_entries"
     )
     party_size = models.IntegerField()
+    position = models.IntegerField(blank=True, null=True)
     joined_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ["joined_at"]
+        indexes = [
+            models.Index(
+                fields=["restaurant", "joined_at"], name="queue_restaurant_joined_idx"
+            )
+        ]
+
+
+class SeatingEvent(models.Model):
+    JOINED = "joined"
+    SEATED = "seated"
+    RELEASED = "released"
+    LEFT = "left"
+    KIND_CHOICES = [
+        (JOINED, "Joined queue"),
+        (SEATED, "Seated"),
+        (RELEASED, "Released seats"),
+        (LEFT, "Left queue"),
+    ]
+
+    restaurant = models.ForeignKey(
+        Restaurant, on_delete=models.CASCADE, related_name="seating_events"
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, related_name="seating_events"
+    )
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    party_size = models.IntegerField()
+    position = models.IntegerField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["created_at", "id"]
+        indexes = [models.Index(fields=["user", "kind", "created_at"])]
+
+
+class TurnoverStat(models.Model):
+    restaurant = models.ForeignKey(
+        Restaurant, on_delete=models.CASCADE, related_name="turnover_stats"
+    )
+    # 0 holds the statistics across all party sizes.
+    party_size = models.IntegerField()
+    wait_per_position = models.FloatField(default=0)
+    wait_samples = models.IntegerField(default=0)
+    dining_seconds = models.FloatField(default=0)
+    dining_samples = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ["restaurant", "party_size"]
+
 
 def generate_uoi():
     return get_random_string(length=6)
@@ -110,10 +261,77 @@ class Order(models.Model):
     unique_order_identifier = models.CharField(
         max_length=6, unique=True, default=generate_uoi
     )
-    order_id = models.CharField(max_length=255)
+    order_id = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Square's order and invoice as of their last webhook, so reads do not
+    # have to ask Square.
+    square_order = models.JSONField(blank=True, null=True)
+    invoice_id = models.CharField(max_length=255, blank=True, null=True, unique=True)
+    square_invoice = models.JSONField(blank=True, null=True)
+    payment_status = models.CharField(max_length=20, blank=True, default="")
 
     class Meta:
         ordering = ["-id"]
 
     def __str__(self):
-        return f"Order {self.unique_order_identifier} by {self.user.email}"
\ No newline at end of file
+        return f"Order {self.unique_order_identifier} by {self.user.email}"
+
+
+class WebhookEvent(models.Model):
+    """A Square webhook event stored as received. process_webhooks applies
+    it later; the unique event_id drops Square's redeliveries."""
+
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=models.Q(processed_at__isnull=True),
+                name="webhook_event_pending_idx",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id}"
+
+
+class Task(models.Model):
+    """A queued call to ``name(**args)``, run by the task workers. A worker
+    leases a task by pushing run_at past the lease, so a task whose worker
+    died becomes due again. Failures are retried with backoff until
+    max_attempts, then the task is left DEAD for inspection."""
+
+    PENDING = "pending"
+    DONE = "done"
+    DEAD = "dead"
+    STATUS_CHOICES = [(PENDING, "Pending"), (DONE, "Done"), (DEAD, "Dead")]
+
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField()
+    run_at = models.DateTimeField(default=timezone.now)
+    result = models.JSONField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["run_at"],
+                condition=models.Q(status="pending"),
+                name="task_pending_run_at_idx",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
@@ -0,0 +1,12 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class RestaurantCursorPagination(CursorPagination):
+    """Pages by primary key, so any page costs the same to fetch no matter how
+    far into the listing it is."""
+
+    ordering = "id"
+    page_size = settings.RESTAURANT_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.RESTAURANT_MAX_PAGE_SIZE
@@ -0,0 +1,320 @@
+import functools
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from rest_framework import exceptions
+
+from . import metrics
+from .instrumentation import timed
+from .throttling import Overloaded
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+breaker_state = metrics.gauge(
+    "dineq_square_circuit_state",
+    "Square circuit breaker state per API: 0 closed, 1 half-open, 2 open.",
+    ["api"],
+)
+breaker_rejections = metrics.counter(
+    "dineq_square_rejected_total",
+    "Square calls failed fast by an open circuit or a full bulkhead.",
+    ["api", "reason"],
+)
+square_calls = metrics.counter(
+    "dineq_square_calls_total",
+    "Square calls that were let through, by outcome.",
+    ["api", "outcome"],
+)
+bulkhead_in_flight = metrics.gauge(
+    "dineq_square_in_flight",
+    "Square calls currently holding a bulkhead slot.",
+    ["api"],
+)
+
+
+@functools.cache
+def transport_errors():
+    # Imported on first use so loading this module does not pull in the HTTP
+    # clients; an except clause only evaluates this once something is raised.
+    import httpx
+    import requests
+
+    return (requests.RequestException, httpx.TransportError)
+
+
+class SquareUnavailable(Overloaded):
+    status_code = 503
+    default_detail = "Square is unavailable, please retry shortly."
+    default_code = "square_unavailable"
+
+
+class SquareUnreachable(exceptions.APIException):
+    """A call Square did not answer. Unlike SquareUnavailable the call was
+    made and failed, so queued tasks spend an attempt on it and back off."""
+
+    status_code = 503
+    default_detail = "Square did not respond, please retry shortly."
+    default_code = "square_unreachable"
+
+    def __init__(self, wait=1, detail=None):
+        super().__init__(detail)
+        # DRF's exception handler turns this into a Retry-After header.
+        self.wait = wait
+
+
+class CircuitBreaker:
+    """Opens when the failure rate over the last ``window`` seconds reaches
+    ``failure_rate`` (once at least ``min_calls`` were made), fails fast for
+    ``open_seconds``, then lets ``probes`` trial calls through. The circuit
+    closes when they all succeed and reopens on the first failure.
+
+    Callers ask ``allow()`` before a call and report the outcome with
+    ``record_success()``/``record_failure()``, so sync and async code can
+    share one breaker.
+    """
+
+    def __init__(
+        self,
+        name,
+        window=None,
+        min_calls=None,
+        failure_rate=None,
+        open_seconds=None,
+        probes=None,
+    ):
+        self.name = name
+        self.window = window or settings.SQUARE_BREAKER_WINDOW_SECONDS
+        self.min_calls = min_calls or settings.SQUARE_BREAKER_MIN_CALLS
+        self.failure_rate = failure_rate or settings.SQUARE_BREAKER_FAILURE_RATE
+        self.open_seconds = open_seconds or settings.SQUARE_BREAKER_OPEN_SECONDS
+        self.probes = probes or settings.SQUARE_BREAKER_HALF_OPEN_PROBES
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes_started = 0
+        self.probes_passed = 0
+        # One [second, calls, failures] bucket per second in the window.
+        self.buckets = deque()
+        self._lock = threading.Lock()
+        breaker_state.set(STATE_VALUES[CLOSED], api=name)
+
+    def _set_state(self, state, now):
+        if state != self.state:
+            logger.warning("Square %s circuit %s -> %s", self.name, self.state, state)
+        self.state = state
+        if state == OPEN:
+            self.opened_at = now
+        if state == HALF_OPEN:
+            self.probes_started = self.probes_passed = 0
+        if state == CLOSED:
+            self.buckets.clear()
+        breaker_state.set(STATE_VALUES[state], api=self.name)
+
+    def _record(self, now, failed):
+        second = int(now)
+        if not self.buckets or self.buckets[-1][0] != second:
+            self.buckets.append([second, 0, 0])
+        self.buckets[-1][1] += 1
+        self.buckets[-1][2] += failed
+        while self.buckets[0][0] <= second - self.window:
+            self.buckets.popleft()
+
+        calls = sum(bucket[1] for bucket in self.buckets)
+        failures = sum(bucket[2] for bucket in self.buckets)
+        if calls >= self.min_calls and failures / calls >= self.failure_rate:
+            self._set_state(OPEN, now)
+
+    def allow(self):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+                self._set_state(HALF_OPEN, now)
+            if self.state == HALF_OPEN:
+                if self.probes_started >= self.probes:
+                    return False
+                self.probes_started += 1
+            return self.state != OPEN
+
+    def retry_after(self):
+        remaining = self.open_seconds - (time.monotonic() - self.opened_at)
+        return max(int(remaining + 0.999), 1)
+
+    def record_success(self):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probes_passed += 1
+                if self.probes_passed >= self.probes:
+                    self._set_state(CLOSED, now)
+            elif self.state == CLOSED:
+                self._record(now, False)
+
+    def record_failure(self):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._set_state(OPEN, now)
+            elif self.state == CLOSED:
+                self._record(now, True)
+
+    def record_cancelled(self):
+        """Gives back a half-open probe slot for a call that never reached
+        Square, e.g. one that failed while building the request."""
+        with self._lock:
+            if self.state == HALF_OPEN and self.probes_started:
+                self.probes_started -= 1
+
+
+class Bulkhead:
+    """Caps concurrent calls into one Square API so a slow API cannot tie
+    up every worker; callers over the cap are turned away immediately."""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.slots = threading.BoundedSemaphore(limit)
+
+    def acquire(self):
+        if not self.slots.acquire(blocking=False):
+            return False
+        bulkhead_in_flight.inc(api=self.name)
+        return True
+
+    def release(self):
+        bulkhead_in_flight.dec(api=self.name)
+        self.slots.release()
+
+
+def is_failure(response):
+    # Client errors mean Square answered; only throttling and server errors
+    # count against the circuit.
+    status = getattr(response, "status_code", 200)
+    return status == 429 or status >= 500
+
+
+class Guard:
+    """The breaker and bulkheads for one Square API area. Sync and async
+    callers share the breaker; async callers get a larger bulkhead of their
+    own since a waiting coroutine does not hold a worker thread."""
+
+    def __init__(self, name):
+        self.name = name
+        self.breaker = CircuitBreaker(name)
+        self.bulkhead = Bulkhead(
+            name,
+            settings.SQUARE_BULKHEADS.get(name, settings.SQUARE_BULKHEAD_DEFAULT),
+        )
+        self.async_bulkhead = Bulkhead(name, settings.SQUARE_ASYNC_BULKHEAD)
+
+    def enter(self, bulkhead):
+        """Raises SquareUnavailable unless the call may go ahead."""
+        if not self.breaker.allow():
+            breaker_rejections.inc(api=self.name, reason="open")
+            raise SquareUnavailable(
+                self.breaker.retry_after(),
+                f"Square {self.name} API is unavailable, please retry shortly.",
+            )
+        if not bulkhead.acquire():
+            self.breaker.record_cancelled()
+            breaker_rejections.inc(api=self.name, reason="bulkhead")
+            raise SquareUnavailable(
+                settings.LOAD_SHED_RETRY_AFTER_SECONDS,
+                f"Too many requests waiting on the Square {self.name} API.",
+            )
+
+    def exit(self, bulkhead, response=None, error=None):
+        bulkhead.release()
+        if error is not None:
+            square_calls.inc(api=self.name, outcome="error")
+            self.breaker.record_failure()
+            return SquareUnreachable(
+                self.breaker.retry_after() if self.breaker.state == OPEN else 1,
+                f"Square {self.name} API did not respond, please retry shortly.",
+            )
+        elif is_failure(response):
+            square_calls.inc(api=self.name, outcome="failure")
+            self.breaker.record_failure()
+        else:
+            square_calls.inc(api=self.name, outcome="success")
+            self.breaker.record_success()
+
+    def cancel(self, bulkhead):
+        bulkhead.release()
+        self.breaker.record_cancelled()
+
+    def call(self, func, *args, **kwargs):
+        self.enter(self.bulkhead)
+        try:
+            with timed(f"square.{self.name}"):
+                response = func(*args, **kwargs)
+        except transport_errors() as e:
+            raise self.exit(self.bulkhead, error=e) from e
+        except BaseException:
+            self.cancel(self.bulkhead)
+            raise
+        self.exit(self.bulkhead, response)
+        return response
+
+    async def acall(self, func, *args, **kwargs):
+        self.enter(self.async_bulkhead)
+        try:
+            with timed(f"square.{self.name}"):
+                response = await func(*args, **kwargs)
+        except transport_errors() as e:
+            raise self.exit(self.async_bulkhead, error=e) from e
+        except BaseException:
+            self.cancel(self.async_bulkhead)
+            raise
+        self.exit(self.async_bulkhead, response)
+        return response
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def get_guard(name):
+    with _guards_lock:
+        guard = _guards.get(name)
+        if guard is None:
+            guard = _guards[name] = Guard(name)
+        return guard
+
+
+def reset_guards():
+    with _guards_lock:
+        _guards.clear()
+
+
+class GuardedApi:
+    def __init__(self, api, guard):
+        self._api = api
+        self._guard = guard
+
+    def __getattr__(self, name):
+        attr = getattr(self._api, name)
+        if not callable(attr):
+            return attr
+        return functools.partial(self._guard.call, attr)
+
+
+class GuardedSquareClient:
+    """Wraps a square Client so every ``client.<api>.<method>()`` call goes
+    through that API's circuit breaker and bulkhead."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        from square.api.base_api import BaseApi
+
+        attr = getattr(self.client, name)
+        if not isinstance(attr, BaseApi):
+            return attr
+        return GuardedApi(attr, get_guard(name))
@@ -0,0 +1,144 @@
+import contextvars
+import functools
+import hashlib
+import random
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import get_authorization_header
+
+from . import metrics
+from .throttling import client_ip
+
+# Pure-read views run inside reads_from_replica(), which sends their queries
+# to a replica. A client that wrote within DATABASE_REPLICA_PIN_SECONDS is
+# pinned to the primary instead, so it always reads its own writes despite
+# replication lag. Everything else, including writes and reads inside write
+# views, stays on the primary.
+
+routed_requests = metrics.counter(
+    "dineq_db_routed_requests_total",
+    "Pure-read requests by the database their reads went to: replica, or "
+    "primary because the client wrote recently.",
+    ["target"],
+)
+
+read_alias = contextvars.ContextVar("read_alias", default=None)
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def pin_key(request):
+    # Token clients are pinned per token, others per address.
+    auth = get_authorization_header(request).split()
+    if len(auth) == 2 and auth[0].lower() == b"token":
+        identity = auth[1]
+    else:
+        identity = client_ip(request).encode()
+    return f"db-pin:{hashlib.sha256(identity).hexdigest()[:32]}"
+
+
+def pin_to_primary(request):
+    cache.set(pin_key(request), 1, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def is_pinned(request):
+    return cache.get(pin_key(request)) is not None
+
+
+@contextmanager
+def reads_from_replica(request):
+    """Routes the enclosed reads to one replica, chosen per request."""
+    alias = None
+    if settings.DATABASE_REPLICAS:
+        if is_pinned(request):
+            routed_requests.inc(target="primary")
+        else:
+            alias = random.choice(settings.DATABASE_REPLICAS)
+            routed_requests.inc(target="replica")
+    token = read_alias.set(alias)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Keeps the enclosed reads on the primary, e.g. when they fill a cache
+    that must not lag behind."""
+    token = read_alias.set(None)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+
+
+def replica_reads(view):
+    """Serves a function view's reads from a replica; for class-based views
+    decorate dispatch with method_decorator."""
+    if iscoroutinefunction(view):
+
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            with reads_from_replica(request):
+                return await view(request, *args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with reads_from_replica(request):
+            return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaPinMiddleware:
+    """Pins a client to the primary after each successful write it makes."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        self.pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        self.pin(request, response)
+        return response
+
+    def pin(self, request, response):
+        if (
+            settings.DATABASE_REPLICAS
+            and request.method not in SAFE_METHODS
+            and response.status_code < 400
+        ):
+            pin_to_primary(request)
@@ -0,0 +1,92 @@
+import math
+
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.measure import D
+from django.contrib.postgres.expressions import ArraySubquery
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db.models import F, OuterRef
+from django.db.models.functions import Greatest, JSONObject
+
+from .models import Item, Variation
+
+METERS_PER_DEGREE = 111_320
+
+# Menu search matches words in item names, item descriptions and category
+# names by trigram similarity, so "burgr" still finds "Cheese Burger". Each
+# column has a GIN trigram index; the three matches are combined with a
+# UNION so every branch can use its own index, where an OR across the
+# category join could not.
+
+
+def matching_items(query):
+    return (
+        Item.objects.filter(name__trigram_word_similar=query)
+        .values("pk")
+        .union(
+            Item.objects.filter(description__trigram_word_similar=query).values("pk"),
+            Item.objects.filter(category__name__trigram_word_similar=query).values(
+                "pk"
+            ),
+        )
+    )
+
+
+def search_queryset(query, location=None, radius=None):
+    """Item hits from verified restaurants, optionally within ``radius``
+    meters of ``location``, best match first, each with its variations."""
+    variations = (
+        Variation.objects.filter(item=OuterRef("pk"))
+        .order_by("pk")
+        .values(
+            json=JSONObject(
+                id="id",
+                name="name",
+                price="price",
+                quantity="quantity",
+                square_id="square_id",
+                reference_id="reference_id",
+            )
+        )
+    )
+    hits = Item.objects.filter(
+        pk__in=matching_items(query), category__restaurant__verified=True
+    ).annotate(
+        score=Greatest(
+            TrigramWordSimilarity(query, "name"),
+            TrigramWordSimilarity(query, "description"),
+            TrigramWordSimilarity(query, "category__name"),
+        ),
+        item_variations=ArraySubquery(variations),
+    )
+    ordering = ["-score", "pk"]
+    if location is not None:
+        # Degrees of longitude shrink away from the equator, so measuring
+        # the radius in them covers the whole circle. This lets the spatial
+        # index narrow the restaurants before the exact distance check.
+        degrees = radius / (METERS_PER_DEGREE * math.cos(math.radians(location.y)))
+        hits = hits.filter(
+            category__restaurant__location__dwithin=(location, degrees),
+            category__restaurant__location__distance_lte=(location, D(m=radius)),
+        ).annotate(distance=Distance("category__restaurant__location", location))
+        ordering = ["-score", "distance", "pk"]
+
+    fields = ["id", "name", "description", "square_id", "score", "item_variations"]
+    if location is not None:
+        fields.append("distance")
+    return hits.order_by(*ordering).values(
+        *fields,
+        category_name=F("category__name"),
+        place_id=F("category__restaurant__place_id"),
+        restaurant_name=F("category__restaurant__name"),
+    )
+
+
+def search_menu(query, location=None, radius=None, limit=50):
+    """The top ``limit`` hits of search_queryset(), fetched in one query."""
+    results = []
+    for row in search_queryset(query, location, radius)[:limit]:
+        row["variations"] = row.pop("item_variations")
+        if "distance" in row:
+            row["distance"] = round(row["distance"].m)
+        results.append(row)
+    return results
@@ -0,0 +1,159 @@
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Least
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .estimation import log_seated
+from .models import Queue, Restaurant, User
+
+
+class SeatingScheduler(ABC):
+    """Picks which queued parties to seat given the seats currently free.
+
+    ``queue`` is consumed lazily in ``joined_at`` order, so strategies only
+    pay for the part of the queue they actually look at.
+    """
+
+    def __init__(self, max_wait_minutes=None):
+        self.max_wait = (
+            timedelta(minutes=max_wait_minutes) if max_wait_minutes else None
+        )
+
+    @abstractmethod
+    def select(self, queue, available_seats, now):
+        """Returns the entries to seat, whose party sizes fit in
+        ``available_seats``."""
+
+    def is_starving(self, entry, now):
+        return self.max_wait is not None and now - entry.joined_at >= self.max_wait
+
+
+class FifoScheduler(SeatingScheduler):
+    def select(self, queue, available_seats, now):
+        seated = []
+        for entry in queue:
+            if entry.party_size > available_seats:
+                break
+            available_seats -= entry.party_size
+            seated.append(entry)
+        return seated
+
+
+class SkipAheadScheduler(SeatingScheduler):
+    """Lets smaller parties jump over at most ``window`` parties that do not
+    fit. Once a blocked party has waited ``max_wait_minutes`` nobody may jump
+    over it any more, so seats accumulate for it as with strict FIFO."""
+
+    def __init__(self, window=5, max_wait_minutes=None):
+        super().__init__(max_wait_minutes)
+        self.window = window
+
+    def select(self, queue, available_seats, now):
+        seated = []
+        skipped = 0
+        for entry in queue:
+            if available_seats <= 0:
+                break
+            if entry.party_size <= available_seats:
+                available_seats -= entry.party_size
+                seated.append(entry)
+                continue
+            if self.is_starving(entry, now):
+                break
+            skipped += 1
+            if skipped > self.window:
+                break
+        return seated
+
+
+class BestFitScheduler(SeatingScheduler):
+    """Packs the largest parties that still fit from the first ``window``
+    entries. Starving parties are served first in FIFO order and block
+    packing when they do not fit."""
+
+    def __init__(self, window=20, max_wait_minutes=None):
+        super().__init__(max_wait_minutes)
+        self.window = window
+
+    def select(self, queue, available_seats, now):
+        candidates = list(islice(queue, self.window))
+        seated = []
+        rest = []
+        for entry in candidates:
+            if not self.is_starving(entry, now):
+                rest.append(entry)
+            elif entry.party_size <= available_seats:
+                available_seats -= entry.party_size
+                seated.append(entry)
+            else:
+                return seated
+
+        for entry in sorted(rest, key=lambda e: (-e.party_size, e.joined_at)):
+            if available_seats <= 0:
+                break
+            if entry.party_size <= available_seats:
+                available_seats -= entry.party_size
+                seated.append(entry)
+        return seated
+
+
+SCHEDULERS = {
+    "fifo": FifoScheduler,
+    "skip-ahead": SkipAheadScheduler,
+    "best-fit": BestFitScheduler,
+}
+
+
+def build_scheduler(strategy, window=None, max_wait_minutes=None):
+    scheduler_class = SCHEDULERS.get(strategy) or import_string(strategy)
+    kwargs = {"max_wait_minutes": max_wait_minutes}
+    if window is not None and scheduler_class is not FifoScheduler:
+        kwargs["window"] = window
+    return scheduler_class(**kwargs)
+
+
+def get_scheduler():
+    return build_scheduler(
+        settings.SEATING_STRATEGY,
+        window=settings.SEATING_WINDOW,
+        max_wait_minutes=settings.SEATING_MAX_WAIT_MINUTES,
+    )
+
+
+def seat_waiting_parties(restaurant, scheduler=None, released_seats=0):
+    """Seats whoever the scheduler picks, after giving back
+    ``released_seats`` (capped at total_seats) under the same row lock."""
+    scheduler = scheduler or get_scheduler()
+    with transaction.atomic():
+        if released_seats:
+            Restaurant.objects.filter(pk=restaurant.pk).update(
+                available_seats=Least(
+                    F("available_seats") + released_seats, F("total_seats")
+                )
+            )
+        locked = Restaurant.objects.select_for_update().get(pk=restaurant.pk)
+        queue = (
+            Queue.objects.filter(restaurant=locked)
+            .select_related("user")
+            .order_by("joined_at")
+            .iterator(chunk_size=100)
+        )
+        now = timezone.now()
+        seated = scheduler.select(queue, locked.available_seats, now)
+        if seated:
+            locked.available_seats -= sum(entry.party_size for entry in seated)
+            locked.save(update_fields=["available_seats"])
+            User.objects.filter(pk__in=[entry.user_id for entry in seated]).update(
+                is_seated=True
+            )
+            Queue.objects.filter(pk__in=[entry.pk for entry in seated]).delete()
+            log_seated(locked, seated, now)
+
+    restaurant.available_seats = locked.available_seats
+    return seated
@@ -3,13 +3,33 @@ from rest_framework import serializers
 from .models import Category, Item, Restaurant, Variation
 
 
+class SparseFieldsMixin:
+    """Limits output to the ``fields`` set in the serializer context and drops
+    the ``expandable`` relations that are not named in its ``expand`` set."""
+
+    expandable = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get("fields")
+        expand = self.context.get("expand", set(self.expandable))
+        for name in list(self.fields):
+            if name in self.expandable:
+                keep = name in expand
+            else:
+                keep = not fields or name in fields
+            if not keep:
+                self.fields.pop(name)
+
+
 class VariationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Variation
         fields = '__all__'
 
 
-class ItemSerializer(serializers.ModelSerializer):
+class ItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable = ("variations",)
     variations = VariationSerializer(many=True, read_only=True)
 
     class Meta:
@@ -17,7 +37,8 @@ class ItemSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable = ("items",)
     items = ItemSerializer(many=True, read_only=True)
 
     class Meta:
@@ -25,7 +46,8 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class RestaurantSerializer(serializers.ModelSerializer):
+class RestaurantSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable = ("categories",)
     categories = CategorySerializer(many=True, read_only=True)
 
     class Meta:
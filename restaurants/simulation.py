@@ -0,0 +1,101 @@
+import heapq
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+PARTY_SIZES = [1, 2, 2, 2, 3, 4, 4, 5, 6, 8]
+EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+
+@dataclass
+class SimulatedParty:
+    party_size: int
+    joined_at: datetime
+    dining_minutes: float
+
+
+@dataclass
+class SimulationResult:
+    strategy: str
+    utilization: float
+    waits: list = field(default_factory=list)
+    unseated: int = 0
+
+    def wait_percentile(self, percentile):
+        return percentile_of(self.waits, percentile)
+
+
+def percentile_of(values, percentile):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(percentile / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def generate_trace(minutes, arrivals_per_minute, mean_dining_minutes, seed=None):
+    rng = random.Random(seed)
+    trace = []
+    now = 0.0
+    while True:
+        now += rng.expovariate(arrivals_per_minute)
+        if now >= minutes:
+            return trace
+        trace.append(
+            SimulatedParty(
+                party_size=rng.choice(PARTY_SIZES),
+                joined_at=EPOCH + timedelta(minutes=now),
+                dining_minutes=rng.expovariate(1 / mean_dining_minutes),
+            )
+        )
+
+
+def simulate(strategy, scheduler, trace, total_seats):
+    """Replays ``trace`` the way the API handles it: arrivals sit down
+    directly when seats are free (``join_queue``) and every departure runs a
+    seating pass (``release_seats``)."""
+    available = total_seats
+    queue = []
+    departures = []
+    waits = []
+    occupied_minutes = 0.0
+    last_event = EPOCH
+
+    def seat(party, now):
+        nonlocal available
+        available -= party.party_size
+        waits.append((now - party.joined_at).total_seconds() / 60)
+        leaves_at = now + timedelta(minutes=party.dining_minutes)
+        heapq.heappush(departures, (leaves_at, id(party), party))
+
+    def advance(now):
+        nonlocal occupied_minutes, last_event
+        elapsed = (now - last_event).total_seconds() / 60
+        occupied_minutes += (total_seats - available) * elapsed
+        last_event = now
+
+    for party in trace:
+        while departures and departures[0][0] <= party.joined_at:
+            now, _, leaving = heapq.heappop(departures)
+            advance(now)
+            available += leaving.party_size
+            seated = scheduler.select(iter(queue), available, now)
+            seated_ids = {id(entry) for entry in seated}
+            for entry in seated:
+                seat(entry, now)
+            queue = [entry for entry in queue if id(entry) not in seated_ids]
+
+        advance(party.joined_at)
+        if party.party_size <= available:
+            seat(party, party.joined_at)
+        else:
+            queue.append(party)
+
+    end = trace[-1].joined_at if trace else EPOCH
+    advance(end)
+    # Parties still waiting count with their wait so far, otherwise a
+    # strategy that starves large parties would look better than it is.
+    waits.extend((end - entry.joined_at).total_seconds() / 60 for entry in queue)
+    horizon = (end - EPOCH).total_seconds() / 60
+    utilization = occupied_minutes / (total_seats * horizon) if horizon else 0.0
+    return SimulationResult(strategy, utilization, waits, unseated=len(queue))
@@ -0,0 +1,78 @@
+import threading
+
+from django.conf import settings
+
+from .resilience import GuardedSquareClient
+
+# The Square SDK and requests take a good part of a worker's start-up to
+# import, so they are loaded when the first Square call builds the client.
+
+# Every Square write we make carries an idempotency key, so POSTs are as safe
+# to retry as reads.
+RETRY_METHODS = ["GET", "PUT", "POST", "DELETE"]
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+def build_http_client():
+    """A requests session sized for SQUARE_MAX_CONCURRENCY callers, with
+    connect/read timeouts and backoff on throttling and server errors."""
+    from apimatic_requests_client_adapter.requests_client import RequestsClient
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retries = Retry(
+        total=settings.SQUARE_MAX_RETRIES,
+        backoff_factor=settings.SQUARE_RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=RETRY_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.SQUARE_POOL_MAXSIZE,
+        max_retries=retries,
+    )
+    http_client = RequestsClient(
+        timeout=(settings.SQUARE_CONNECT_TIMEOUT, settings.SQUARE_READ_TIMEOUT)
+    )
+    http_client.session.mount("https://", adapter)
+    http_client.session.mount("http://", adapter)
+    return http_client
+
+
+def build_square_client():
+    from square.client import Client
+
+    options = {"environment": settings.SQUARE_ENVIRONMENT}
+    if settings.SQUARE_BASE_URL:
+        options = {"environment": "custom", "custom_url": settings.SQUARE_BASE_URL}
+    return Client(
+        access_token=settings.SQUARE_ACCESS_TOKEN,
+        http_client_instance=build_http_client(),
+        **options,
+    )
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_square_client():
+    """The process-wide Square client; its connection pool is shared by
+    every request served by this process and each API is guarded by a
+    circuit breaker and bulkhead."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GuardedSquareClient(build_square_client())
+    return _client
+
+
+def reset_square_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.client.config.http_client.session.close()
+        _client = None
@@ -0,0 +1,281 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from . import async_upstreams
+from .menu_changes import record_menu_changes
+from .menu_snapshot import invalidate_snapshot
+from .models import Category, Item, MenuChange, Order, Variation
+from .square_client import get_square_client
+from .webhooks import release_diner
+
+# Square side effects run as tasks (see tasks.py). Each takes the
+# idempotency key chosen when it was queued, so a retry of a call that
+# reached Square but lost its response does not repeat it. Inventory counts
+# carry the time of the local change, so Square orders them correctly even
+# when they arrive out of order. The async views make their first attempt
+# at a task with the matching a-prefixed coroutine, which calls Square
+# through async_upstreams instead of the blocking SDK.
+
+LOCATION_ID = "LS3AWJK2V4HW5"
+DEVICE_ID = "9fa747a2-25ff-48ee-b078-04381f7c828f"
+INVENTORY_BATCH_SIZE = 100
+
+
+class SquareError(Exception):
+    pass
+
+
+def check(response):
+    if response.is_error():
+        raise SquareError(response.errors)
+    return response.body
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def physical_count(square_id, quantity, occurred_at):
+    return {
+        "type": "PHYSICAL_COUNT",
+        "physical_count": {
+            "location_id": LOCATION_ID,
+            "catalog_object_id": square_id,
+            "state": "IN_STOCK",
+            "quantity": str(quantity),
+            "occurred_at": occurred_at,
+        },
+    }
+
+
+def set_inventory_count(variation_id, quantity, occurred_at, idempotency_key):
+    square_id = (
+        Variation.objects.filter(pk=variation_id)
+        .values_list("square_id", flat=True)
+        .first()
+    )
+    if not square_id:
+        # Not in the catalog yet; the menu sync sends its count.
+        return None
+    body = {
+        "idempotency_key": idempotency_key,
+        "changes": [physical_count(square_id, quantity, occurred_at)],
+    }
+    check(get_square_client().inventory.batch_change_inventory(body))
+    return None
+
+
+def record_inventory_sale(square_id, quantity, occurred_at, idempotency_key):
+    body = {
+        "idempotency_key": idempotency_key,
+        "changes": [
+            {
+                "type": "ADJUSTMENT",
+                "adjustment": {
+                    "location_id": LOCATION_ID,
+                    "catalog_object_id": square_id,
+                    "from_state": "IN_STOCK",
+                    "to_state": "SOLD",
+                    "quantity": str(quantity),
+                    "occurred_at": occurred_at,
+                },
+            }
+        ],
+    }
+    check(get_square_client().inventory.batch_change_inventory(body))
+    return None
+
+
+def invoice_body(location_id, order_id, idempotency_key):
+    due_date = (datetime.now() + timedelta(days=5)).date()
+    return {
+        "invoice": {
+            "location_id": location_id,
+            "order_id": order_id,
+            "payment_requests": [{"request_type": "BALANCE", "due_date": due_date}],
+            "delivery_method": "EMAIL",
+            "accepted_payment_methods": {"card": True},
+        },
+        "idempotency_key": idempotency_key,
+    }
+
+
+def create_order_invoice(order_id, idempotency_key):
+    order = Order.objects.get(order_id=order_id)
+    if order.invoice_id:
+        # A webhook or an earlier attempt already recorded it.
+        return {"invoice_id": order.invoice_id}
+    invoice = check(
+        get_square_client().invoices.create_invoice(
+            body=invoice_body(LOCATION_ID, order_id, idempotency_key)
+        )
+    )["invoice"]
+    Order.objects.filter(pk=order.pk).update(
+        invoice_id=invoice["id"], square_invoice=invoice
+    )
+    return {"invoice_id": invoice["id"]}
+
+
+async def acreate_order_invoice(order_id, idempotency_key):
+    """create_order_invoice for the async views' first attempt."""
+    order = await Order.objects.aget(order_id=order_id)
+    if order.invoice_id:
+        return {"invoice_id": order.invoice_id}
+    invoice = check(
+        await async_upstreams.create_invoice(
+            invoice_body(LOCATION_ID, order_id, idempotency_key)
+        )
+    )["invoice"]
+    await Order.objects.filter(pk=order.pk).aupdate(
+        invoice_id=invoice["id"], square_invoice=invoice
+    )
+    return {"invoice_id": invoice["id"]}
+
+
+def checkout_body(order_id, amount_money, idempotency_key):
+    return {
+        "idempotency_key": idempotency_key,
+        "checkout": {
+            "amount_money": amount_money,
+            "order_id": order_id,
+            "device_options": {"device_id": DEVICE_ID},
+            "payment_type": "CARD_PRESENT",
+        },
+    }
+
+
+def create_checkout(order_id, user_id, amount_money, idempotency_key):
+    body = check(
+        get_square_client().terminal.create_terminal_checkout(
+            body=checkout_body(order_id, amount_money, idempotency_key)
+        )
+    )
+    release_diner(user_id)
+    return body
+
+
+async def acreate_checkout(order_id, user_id, amount_money, idempotency_key):
+    """create_checkout for the async views' first attempt."""
+    body = check(
+        await async_upstreams.create_terminal_checkout(
+            checkout_body(order_id, amount_money, idempotency_key)
+        )
+    )
+    await sync_to_async(release_diner)(user_id)
+    return body
+
+
+def temporary_id(name, place_id):
+    return f"#{name.replace(' ', '_')}__{place_id}"
+
+
+def item_object(item, item_square_id, variations, category_square_id, place_id):
+    return {
+        "type": "ITEM",
+        "id": item_square_id,
+        "item_data": {
+            "name": item.name,
+            "description": item.description,
+            "category_id": category_square_id,
+            "variations": [
+                {
+                    "type": "ITEM_VARIATION",
+                    "id": variation.square_id
+                    or temporary_id(f"{item.name} {variation.name}", place_id),
+                    "item_variation_data": {
+                        "item_id": item_square_id,
+                        "name": variation.name,
+                        "pricing_type": "FIXED_PRICING",
+                        "price_money": {
+                            "amount": int(variation.price * 100),
+                            "currency": "USD",
+                        },
+                    },
+                }
+                for variation in variations
+            ],
+        },
+    }
+
+
+def sync_menu_category(category_id, idempotency_key):
+    """Upserts a category with its items and variations to the catalog,
+    saves the ids Square gave them and sets their stock to the local
+    counts."""
+    client = get_square_client()
+    category = Category.objects.select_related("restaurant").get(pk=category_id)
+    place_id = category.restaurant.place_id
+    category_square_id = check(
+        client.catalog.upsert_catalog_object(
+            {
+                "idempotency_key": idempotency_key,
+                "object": {
+                    "type": "CATEGORY",
+                    "id": category.square_id or temporary_id(category.name, place_id),
+                    "category_data": {"name": category.name},
+                },
+            }
+        )
+    )["catalog_object"]["id"]
+
+    items = list(category.items.prefetch_related("variations"))
+    synced_variations = []
+    for item in items:
+        item_square_id = item.square_id or temporary_id(item.name, place_id)
+        variations = list(item.variations.all())
+        catalog_object = check(
+            client.catalog.upsert_catalog_object(
+                {
+                    "idempotency_key": f"{idempotency_key}:{item.pk}",
+                    "object": item_object(
+                        item, item_square_id, variations, category_square_id, place_id
+                    ),
+                }
+            )
+        )["catalog_object"]
+        item.item_id = item.square_id = catalog_object["id"]
+        for variation, synced in zip(
+            variations, catalog_object["item_data"]["variations"]
+        ):
+            variation.square_id = synced["id"]
+            synced_variations.append(variation)
+
+    restaurant = category.restaurant
+    occurred_at = now_iso()
+    with transaction.atomic():
+        Category.objects.filter(pk=category.pk).update(
+            category_id=category_square_id, square_id=category_square_id
+        )
+        Item.objects.bulk_update(items, ["item_id", "square_id"])
+        Variation.objects.bulk_update(synced_variations, ["square_id"])
+        quantities = dict(
+            Variation.objects.filter(
+                pk__in=[variation.pk for variation in synced_variations]
+            ).values_list("square_id", "quantity")
+        )
+        record_menu_changes(
+            restaurant.pk,
+            [(MenuChange.CATEGORY, category.pk)]
+            + [(MenuChange.ITEM, item.pk) for item in items]
+            + [(MenuChange.VARIATION, variation.pk) for variation in synced_variations],
+        )
+        transaction.on_commit(lambda: invalidate_snapshot(place_id))
+
+    changes = [
+        physical_count(square_id, quantity, occurred_at)
+        for square_id, quantity in quantities.items()
+    ]
+    # Counts are absolute, so each attempt can send them under a new key.
+    for start in range(0, len(changes), INVENTORY_BATCH_SIZE):
+        check(
+            client.inventory.batch_change_inventory(
+                {
+                    "idempotency_key": str(uuid.uuid4()),
+                    "changes": changes[start : start + INVENTORY_BATCH_SIZE],
+                }
+            )
+        )
+    return {"category_id": category_square_id}
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Sum
+from django.http import JsonResponse, StreamingHttpResponse
+
+from .authentication import user_for_token
+from .events import get_broker, restaurant_channel, user_channel
+from .models import Queue, Restaurant, User
+
+# Server-Sent Event streams. These only make sense under ASGI
+# (dineQ.asgi.application): each open stream is a coroutine parked on its
+# subscription, so idle clients cost a few kilobytes instead of a worker
+# thread. Streams are closed after EVENT_STREAM_MAX_SECONDS and browsers'
+# EventSource reconnects on its own, which also bounds how long a stream to a
+# client that vanished without a clean disconnect can linger.
+
+
+def format_event(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def event_stream(channel, initial_event):
+    # The view's reads are done; hand its database connection back to the
+    # pool now rather than when the stream closes minutes later.
+    await sync_to_async(close_old_connections)()
+    broker = get_broker()
+    subscription = broker.subscribe(channel)
+    deadline = time.monotonic() + settings.EVENT_STREAM_MAX_SECONDS
+    try:
+        yield f"retry: {settings.EVENT_STREAM_RETRY_MS}\n"
+        yield format_event(initial_event)
+        while time.monotonic() < deadline:
+            try:
+                event = await subscription.get(settings.EVENT_STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+            else:
+                yield format_event(event)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def stream_response(channel, initial_event):
+    response = StreamingHttpResponse(
+        event_stream(channel, initial_event), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+async def restaurant_events(request, place_id):
+    try:
+        restaurant = await Restaurant.objects.aget(place_id=place_id)
+    except Restaurant.DoesNotExist:
+        return JsonResponse(
+            {"error": f"Restaurant with place_id: {place_id} does not exist"},
+            status=404,
+        )
+
+    queue_size = (
+        await Queue.objects.filter(restaurant=restaurant).aaggregate(
+            total=Sum("party_size")
+        )
+    )["total"] or 0
+    return stream_response(
+        restaurant_channel(place_id),
+        {
+            "type": "availability",
+            "available_seats": restaurant.available_seats,
+            "queue_size": queue_size,
+        },
+    )
+
+
+async def user_events(request):
+    # EventSource cannot send an Authorization header, so the token is taken
+    # from the query string. Looking diners up by email lets anyone follow
+    # anyone else's queue, so it is only for old clients and off by default.
+    token = request.GET.get("token")
+    if token:
+        user = await sync_to_async(user_for_token)(token)
+        if user is None:
+            return JsonResponse({"error": "Invalid token."}, status=401)
+    elif settings.EVENT_STREAM_ALLOW_EMAIL and request.GET.get("email"):
+        try:
+            user = await User.objects.aget(email=request.GET.get("email"))
+        except User.DoesNotExist:
+            return JsonResponse({"error": "User does not exist"}, status=404)
+    else:
+        return JsonResponse({"error": "A token is required."}, status=401)
+
+    return stream_response(
+        user_channel(user.pk), {"type": "status", "is_seated": user.is_seated}
+    )
@@ -0,0 +1,228 @@
+import logging
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    DateTimeField,
+    DurationField,
+    Exists,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Subquery,
+    Value,
+)
+from django.db.models.functions import Coalesce, Least
+from django.utils import timezone
+
+from . import metrics
+from .events import get_broker, notify_queue_changed, notify_seated, user_channel
+from .models import MenuChange, Order, Queue, Restaurant, SeatingEvent, Task, User
+from .seating import seat_waiting_parties
+
+logger = logging.getLogger(__name__)
+
+expired_entries = metrics.counter(
+    "dineq_sweeper_queue_entries_expired_total",
+    "Queue entries removed by the sweeper after their timeout.",
+    ["restaurant"],
+)
+reclaimed_seats = metrics.counter(
+    "dineq_sweeper_seats_reclaimed_total",
+    "Seats returned to restaurants from parties seated past the cutoff.",
+    ["restaurant"],
+)
+sweeper_seated = metrics.counter(
+    "dineq_sweeper_parties_seated_total",
+    "Queued parties seated by the sweeper's seating pass.",
+    ["restaurant"],
+)
+
+
+@dataclass
+class SweepResult:
+    expired_entries: int = 0
+    reclaimed_users: int = 0
+    reclaimed_seats: int = 0
+    seated_parties: int = 0
+    pruned_menu_changes: int = 0
+    pruned_tasks: int = 0
+    restaurants: set = field(default_factory=set)
+
+
+def expire_stale_queue_entries(now, result):
+    minutes = ExpressionWrapper(
+        Coalesce(
+            "restaurant__queue_timeout_minutes",
+            Value(settings.QUEUE_ENTRY_TIMEOUT_MINUTES),
+        )
+        * Value(timedelta(minutes=1)),
+        output_field=DurationField(),
+    )
+    stale = Queue.objects.filter(
+        joined_at__lt=ExpressionWrapper(
+            Value(now) - minutes, output_field=DateTimeField()
+        )
+    ).values_list(
+        "pk", "restaurant_id", "restaurant__place_id", "user_id", "party_size"
+    )
+
+    while True:
+        with transaction.atomic():
+            batch = list(
+                stale.select_for_update(skip_locked=True, of=("self",))[
+                    : settings.SWEEPER_BATCH_SIZE
+                ]
+            )
+            if not batch:
+                return
+            deleted, _ = Queue.objects.filter(pk__in=[row[0] for row in batch]).delete()
+            SeatingEvent.objects.bulk_create(
+                SeatingEvent(
+                    restaurant_id=restaurant_id,
+                    user_id=user_id,
+                    kind=SeatingEvent.LEFT,
+                    party_size=party_size,
+                    created_at=now,
+                )
+                for _, restaurant_id, _, user_id, party_size in batch
+            )
+        result.expired_entries += deleted
+
+        broker = get_broker()
+        for _, restaurant_id, place_id, user_id, _ in batch:
+            result.restaurants.add(restaurant_id)
+            expired_entries.inc(restaurant=place_id)
+            broker.publish(
+                user_channel(user_id), {"type": "expired", "place_id": place_id}
+            )
+
+
+def reclaim_abandoned_seats(now, result):
+    """Frees the seats of users still marked seated past their restaurant's
+    cutoff who have not placed an order since sitting down."""
+    last_seated = SeatingEvent.objects.filter(
+        user=OuterRef("pk"), kind=SeatingEvent.SEATED
+    ).order_by("-created_at")
+    candidates = (
+        User.objects.filter(is_seated=True)
+        .annotate(
+            seated_at=Subquery(last_seated.values("created_at")[:1]),
+            seated_restaurant=Subquery(last_seated.values("restaurant_id")[:1]),
+            seated_place_id=Subquery(last_seated.values("restaurant__place_id")[:1]),
+            seated_party=Subquery(last_seated.values("party_size")[:1]),
+            seat_timeout=Subquery(
+                last_seated.values("restaurant__seat_timeout_minutes")[:1]
+            ),
+        )
+        .filter(seated_at__isnull=False)
+        .exclude(
+            Exists(
+                Order.objects.filter(
+                    user=OuterRef("pk"), created_at__gte=OuterRef("seated_at")
+                )
+            )
+        )
+        .values_list(
+            "pk",
+            "seated_at",
+            "seated_restaurant",
+            "seated_place_id",
+            "seated_party",
+            "seat_timeout",
+        )
+    )
+
+    place_ids = {}
+    abandoned = []
+    for row in candidates.iterator():
+        user_id, seated_at, restaurant_id, place_id, party_size, timeout = row
+        cutoff = now - timedelta(minutes=timeout or settings.SEAT_TIMEOUT_MINUTES)
+        if seated_at < cutoff:
+            place_ids[restaurant_id] = place_id
+            abandoned.append((user_id, restaurant_id, party_size))
+
+    for start in range(0, len(abandoned), settings.SWEEPER_BATCH_SIZE):
+        batch = abandoned[start : start + settings.SWEEPER_BATCH_SIZE]
+        seats = {}
+        with transaction.atomic():
+            released = set(
+                User.objects.select_for_update()
+                .filter(pk__in=[row[0] for row in batch], is_seated=True)
+                .values_list("pk", flat=True)
+            )
+            batch = [row for row in batch if row[0] in released]
+            User.objects.filter(pk__in=released).update(is_seated=False)
+            for _, restaurant_id, party_size in batch:
+                seats[restaurant_id] = seats.get(restaurant_id, 0) + party_size
+            for restaurant_id, count in seats.items():
+                Restaurant.objects.filter(pk=restaurant_id).update(
+                    available_seats=Least(
+                        F("available_seats") + count, F("total_seats")
+                    )
+                )
+            SeatingEvent.objects.bulk_create(
+                SeatingEvent(
+                    restaurant_id=restaurant_id,
+                    user_id=user_id,
+                    kind=SeatingEvent.RELEASED,
+                    party_size=party_size,
+                    created_at=now,
+                )
+                for user_id, restaurant_id, party_size in batch
+            )
+
+        result.reclaimed_users += len(batch)
+        for restaurant_id, count in seats.items():
+            result.reclaimed_seats += count
+            result.restaurants.add(restaurant_id)
+            reclaimed_seats.inc(count, restaurant=place_ids[restaurant_id])
+
+
+def prune_menu_changes(now, result):
+    cutoff = now - timedelta(hours=settings.MENU_CHANGE_RETENTION_HOURS)
+    result.pruned_menu_changes, _ = MenuChange.objects.filter(
+        created_at__lt=cutoff
+    ).delete()
+
+
+def prune_tasks(now, result):
+    # Dead tasks are kept for inspection and requeueing from the admin.
+    cutoff = now - timedelta(hours=settings.TASK_RETENTION_HOURS)
+    result.pruned_tasks, _ = Task.objects.filter(
+        status=Task.DONE, finished_at__lt=cutoff
+    ).delete()
+
+
+def sweep(now=None):
+    now = now or timezone.now()
+    result = SweepResult()
+    expire_stale_queue_entries(now, result)
+    reclaim_abandoned_seats(now, result)
+    prune_menu_changes(now, result)
+    prune_tasks(now, result)
+
+    # One seating pass per restaurant that lost queue entries or got seats
+    # back, rather than one per reclaimed party.
+    for restaurant in Restaurant.objects.filter(pk__in=result.restaurants):
+        seated = seat_waiting_parties(restaurant)
+        result.seated_parties += len(seated)
+        if seated:
+            sweeper_seated.inc(len(seated), restaurant=restaurant.place_id)
+            notify_seated(restaurant, [entry.user_id for entry in seated])
+        notify_queue_changed(restaurant)
+
+    logger.info(
+        "sweep expired_entries=%d reclaimed_users=%d reclaimed_seats=%d "
+        "seated_parties=%d pruned_menu_changes=%d pruned_tasks=%d restaurants=%d",
+        result.expired_entries,
+        result.reclaimed_users,
+        result.reclaimed_seats,
+        result.seated_parties,
+        result.pruned_menu_changes,
+        result.pruned_tasks,
+        len(result.restaurants),
+    )
+    return result
@@ -0,0 +1,244 @@
+import logging
+import random
+import threading
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .models import Task
+from .throttling import Overloaded
+
+# A small durable queue for side effects on Square. Tasks are rows in the
+# same database as the state they belong to, so queueing one in the
+# transaction that makes a local change means the change and its side effect
+# commit together. Workers claim due rows with SELECT ... FOR UPDATE SKIP
+# LOCKED, so any number of worker threads and processes can share the table.
+
+logger = logging.getLogger(__name__)
+
+task_runs = metrics.counter(
+    "dineq_task_runs_total",
+    "Task attempts by task and outcome: succeeded, retried, deferred or dead.",
+    ["task", "outcome"],
+)
+task_seconds = metrics.histogram(
+    "dineq_task_seconds", "Time spent on each task attempt.", ["task"]
+)
+tasks_waiting = metrics.gauge(
+    "dineq_tasks",
+    "Pending and dead tasks as last counted by a worker.",
+    ["task", "status"],
+)
+
+
+def task_name(func):
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+def short_name(name):
+    return name.rsplit(".", 1)[-1]
+
+
+def enqueue(func, **kwargs):
+    """Queues ``func(**kwargs)``; the arguments must be JSON-serializable.
+    Call it inside the transaction making the matching local change."""
+    return Task.objects.create(
+        name=task_name(func), args=kwargs, max_attempts=settings.TASK_MAX_ATTEMPTS
+    )
+
+
+def backoff_seconds(attempts):
+    """Exponential backoff with jitter, so tasks that failed together do not
+    all retry at the same moment."""
+    ceiling = min(
+        settings.TASK_BACKOFF_MAX_SECONDS,
+        settings.TASK_BACKOFF_SECONDS * 2 ** (attempts - 1),
+    )
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def claim(limit=1, pk=None):
+    """Leases up to ``limit`` due tasks, oldest first."""
+    now = timezone.now()
+    due = Task.objects.filter(status=Task.PENDING, run_at__lte=now)
+    if pk is not None:
+        due = due.filter(pk=pk)
+    with transaction.atomic():
+        tasks = list(due.order_by("run_at").select_for_update(skip_locked=True)[:limit])
+        Task.objects.filter(pk__in=[task.pk for task in tasks]).update(
+            run_at=now + timedelta(seconds=settings.TASK_LEASE_SECONDS),
+            attempts=F("attempts") + 1,
+        )
+    for task in tasks:
+        task.attempts += 1
+    return tasks
+
+
+def finish(task, **fields):
+    for name, value in fields.items():
+        setattr(task, name, value)
+    Task.objects.filter(pk=task.pk).update(**fields)
+
+
+def record(task, started, result=None, error=None):
+    """Records how an attempt at a leased task went on ``task``."""
+    name = short_name(task.name)
+    if isinstance(error, Overloaded):
+        # The call was turned away before reaching Square (an open circuit or
+        # a full bulkhead); that says nothing about the task, so it waits
+        # without spending an attempt.
+        outcome = "deferred"
+        finish(
+            task,
+            attempts=task.attempts - 1,
+            run_at=timezone.now() + timedelta(seconds=error.wait),
+            last_error=repr(error),
+        )
+    elif error is not None:
+        if task.attempts >= task.max_attempts:
+            outcome = "dead"
+            logger.error(
+                "task %s %s is dead after %d attempts: %r",
+                name,
+                task.pk,
+                task.attempts,
+                error,
+            )
+            finish(
+                task,
+                status=Task.DEAD,
+                finished_at=timezone.now(),
+                last_error=repr(error),
+            )
+        else:
+            outcome = "retried"
+            logger.warning("task %s %s failed: %r", name, task.pk, error)
+            finish(
+                task,
+                run_at=timezone.now()
+                + timedelta(seconds=backoff_seconds(task.attempts)),
+                last_error=repr(error),
+            )
+    else:
+        outcome = "succeeded"
+        finish(
+            task,
+            status=Task.DONE,
+            result=result,
+            finished_at=timezone.now(),
+            last_error="",
+        )
+    task_seconds.observe(time.perf_counter() - started, task=name)
+    task_runs.inc(task=name, outcome=outcome)
+    return task
+
+
+def run(task):
+    """Runs a leased task and records how it went on ``task``."""
+    started = time.perf_counter()
+    try:
+        result = import_string(task.name)(**task.args)
+    except Exception as e:
+        return record(task, started, error=e)
+    return record(task, started, result=result)
+
+
+def run_now(task):
+    """Tries a just-queued task in the calling thread, so a request can
+    answer with its result while Square is healthy. Left to the workers if
+    one already has it or it fails. Call after the enqueueing transaction
+    commits."""
+    for claimed in claim(pk=task.pk):
+        return run(claimed)
+    return task
+
+
+async def arun_now(task, attempt):
+    """run_now for the async views. ``attempt`` is a coroutine function
+    doing the task's work without blocking the event loop; it is called
+    with the task's arguments and its outcome is recorded as run's is."""
+    for claimed in await sync_to_async(claim)(pk=task.pk):
+        started = time.perf_counter()
+        try:
+            result = await attempt(**claimed.args)
+        except Exception as e:
+            return await sync_to_async(record)(claimed, started, error=e)
+        return await sync_to_async(record)(claimed, started, result=result)
+    return task
+
+
+_counted = set()
+
+
+def count_waiting():
+    # Series counted before but now empty drop to zero.
+    counts = dict.fromkeys(_counted, 0)
+    for row in (
+        Task.objects.filter(status__in=[Task.PENDING, Task.DEAD])
+        .values("name", "status")
+        .annotate(count=Count("id"))
+    ):
+        counts[short_name(row["name"]), row["status"]] = row["count"]
+    for (name, status), count in counts.items():
+        tasks_waiting.set(count, task=name, status=status)
+    _counted.update(counts)
+
+
+class Worker:
+    """Runs due tasks on ``concurrency`` threads, each claiming one task at
+    a time. Square calls spend most of their time waiting, so threads give
+    plenty of concurrency per process."""
+
+    def __init__(self, concurrency, poll_seconds):
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self.stopping = threading.Event()
+
+    def work(self):
+        while not self.stopping.is_set():
+            close_old_connections()
+            tasks = claim()
+            if not tasks:
+                self.stopping.wait(self.poll_seconds)
+                continue
+            try:
+                run(tasks[0])
+            except Exception:
+                # Recording the outcome failed; the lease runs out and the
+                # task is retried.
+                logger.exception("task %s could not be recorded", tasks[0].pk)
+
+    def count(self):
+        while not self.stopping.is_set():
+            close_old_connections()
+            try:
+                count_waiting()
+            except Exception:
+                logger.exception("counting waiting tasks failed")
+            self.stopping.wait(settings.TASK_COUNT_SECONDS)
+
+    def run_forever(self):
+        threads = [
+            threading.Thread(target=self.work, daemon=True)
+            for _ in range(self.concurrency)
+        ]
+        threads.append(threading.Thread(target=self.count, daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(1)
+        finally:
+            self.stopping.set()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        self.stopping.set()
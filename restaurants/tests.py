@@ -1,3 +1,1418 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+import msgpack
+import requests
+from asgiref.sync import sync_to_async
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from . import async_views
+from .async_views import get_request_user
+from .authentication import TokenCache, issue_token
+from .caching import get_many_cached
+from .db_pool import ConnectionPool, PoolTimeout
+from .estimation import MemoryStatStore, WaitTimeEstimator, ewma
+from .fake_upstreams import FakeUpstreamServer
+from .hashing import HashingPool, HashingPoolFull
+from .menu_changes import record_menu_changes
+from .menu_snapshot import MEDIA_TYPE
+from .models import (
+    Category,
+    Item,
+    MenuChange,
+    Order,
+    Queue,
+    Restaurant,
+    SeatingEvent,
+    Task,
+    User,
+    Variation,
+    WebhookEvent,
+)
+from .rendering import OrjsonRenderer
+from .resilience import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    get_guard,
+    reset_guards,
+)
+from .routing import (
+    ReplicaPinMiddleware,
+    ReplicaRouter,
+    primary_reads,
+    reads_from_replica,
+)
+from .search import search_menu
+from .seating import BestFitScheduler, FifoScheduler, SkipAheadScheduler
+from .serializers import RestaurantSerializer
+from .simulation import EPOCH, SimulatedParty, generate_trace, simulate
+from .square_client import get_square_client, reset_square_client
+from .square_tasks import SquareError, check
+from .streams import user_events
+from .sweeper import SweepResult, expire_stale_queue_entries, reclaim_abandoned_seats
+from .tasks import arun_now, backoff_seconds, claim, enqueue, run, run_now, short_name
+from .throttling import (
+    Overloaded,
+    LocalBucketBackend,
+    parse_rate,
+    rate_limit,
+    throttled_response,
+)
+from .views import RestaurantViewSet, adjust_inventory, record_order, square_webhook
+from .webhooks import is_valid_signature, process_events, signature_for, store_event
+
+
+class FakeSquareHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # One handler instance is created per TCP connection.
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.server.failures:
+            self.server.failures -= 1
+            self.reply(503, b'{"errors": []}')
+        else:
+            self.reply(200, b'{"locations": []}')
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SquareClientTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSquareHandler)
+        self.server.connections = 0
+        self.server.requests = 0
+        self.server.failures = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        settings_override = override_settings(
+            SQUARE_BASE_URL=f"http://127.0.0.1:{self.server.server_port}",
+            SQUARE_ACCESS_TOKEN="test-token",
+            SQUARE_RETRY_BACKOFF=0,
+        )
+        settings_override.enable()
+        reset_square_client()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(reset_square_client)
+
+    def test_client_is_shared(self):
+        self.assertIs(get_square_client(), get_square_client())
+
+    def test_calls_reuse_one_connection(self):
+        for _ in range(5):
+            self.assertTrue(get_square_client().locations.list_locations().is_success())
+
+        self.assertEqual(self.server.requests, 5)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_server_errors_are_retried(self):
+        self.server.failures = 1
+
+        self.assertTrue(get_square_client().locations.list_locations().is_success())
+        self.assertEqual(self.server.requests, 2)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_on_failure_rate_and_closes_after_probes(self):
+        breaker = CircuitBreaker(
+            "test",
+            window=60,
+            min_calls=4,
+            failure_rate=0.5,
+            open_seconds=0.05,
+            probes=2,
+        )
+        for failed in (False, True, False):
+            self.assertTrue(breaker.allow())
+            if failed:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.05)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker(
+            "test", window=60, min_calls=1, failure_rate=1, open_seconds=0.05, probes=1
+        )
+        breaker.record_failure()
+        time.sleep(0.05)
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+
+
+class SparseFieldsTests(SimpleTestCase):
+    def test_nesting_is_opt_in(self):
+        fields = RestaurantSerializer(context={"expand": set()}).fields
+        self.assertNotIn("categories", fields)
+        self.assertIn("place_id", fields)
+
+    def test_fields_and_expand(self):
+        serializer = RestaurantSerializer(
+            [], many=True, context={"expand": {"categories"}, "fields": {"name"}}
+        )
+        self.assertEqual(set(serializer.child.fields), {"name", "categories"})
+
+
+class OrjsonRendererTests(SimpleTestCase):
+    def test_matches_drf_for_decimals(self):
+        data = {"price": Decimal("9.99"), 1: ["one"]}
+        self.assertEqual(
+            json.loads(OrjsonRenderer().render(data)),
+            json.loads(JSONRenderer().render(data)),
+        )
+
+    def test_matches_drf_for_utc_datetimes(self):
+        data = {"at": datetime(2024, 5, 1, 12, 30, tzinfo=dt_timezone.utc)}
+        rendered = OrjsonRenderer().render(data)
+        self.assertEqual(json.loads(rendered), {"at": "2024-05-01T12:30:00Z"})
+        self.assertEqual(json.loads(rendered), json.loads(JSONRenderer().render(data)))
+
+    def test_renders_points_as_coordinates(self):
+        rendered = OrjsonRenderer().render({"location": Point(-122.4, 37.7)})
+        self.assertEqual(json.loads(rendered), {"location": [-122.4, 37.7]})
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class MenuSearchTests(SimpleTestCase):
+    def search(self, **params):
+        view = RestaurantViewSet.as_view({"get": "search"})
+        return view(APIRequestFactory().get("/restaurants/search/", params))
+
+    def test_requires_query(self):
+        self.assertEqual(self.search(q=" ").status_code, 400)
+
+    def test_rejects_bad_location(self):
+        self.assertEqual(self.search(q="burger", lat="37.7").status_code, 400)
+        self.assertEqual(self.search(q="burger", radius="-1").status_code, 400)
+
+
+@override_settings(SQUARE_WEBHOOK_SIGNATURE_KEY="key", SQUARE_WEBHOOK_URL=None)
+class SquareWebhookTests(SimpleTestCase):
+    url = "http://testserver/webhooks/square/"
+    body = b'{"event_id": "1", "type": "order.updated", "data": {}}'
+
+    def test_signature(self):
+        signature = signature_for(self.url, self.body, "key")
+        self.assertTrue(is_valid_signature(signature, self.url, self.body, "key"))
+        self.assertFalse(
+            is_valid_signature(signature, self.url, self.body + b" ", "key")
+        )
+        self.assertFalse(is_valid_signature(signature, self.url, self.body, None))
+
+    def test_rejects_unsigned_events(self):
+        request = RequestFactory().post(
+            "/webhooks/square/",
+            self.body,
+            content_type="application/json",
+            HTTP_X_SQUARE_HMACSHA256_SIGNATURE="forged",
+        )
+        self.assertEqual(square_webhook(request).status_code, 403)
+
+
+@override_settings(TASK_BACKOFF_SECONDS=2, TASK_BACKOFF_MAX_SECONDS=60)
+class TaskQueueTests(SimpleTestCase):
+    def test_backoff_doubles_up_to_the_cap(self):
+        for attempts, ceiling in [(1, 2), (2, 4), (4, 16), (10, 60)]:
+            delay = backoff_seconds(attempts)
+            self.assertGreaterEqual(delay, ceiling / 2)
+            self.assertLessEqual(delay, ceiling)
+
+    def test_square_errors_raise(self):
+        class Response:
+            body = {}
+            errors = [{"code": "NOT_FOUND"}]
+
+            def is_error(self):
+                return True
+
+        with self.assertRaises(SquareError):
+            check(Response())
+
+
+@override_settings(DATABASE_REPLICAS=["replica_1"])
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+
+    def read_alias(self, token):
+        request = RequestFactory().get("/", HTTP_AUTHORIZATION=f"Token {token}")
+        with reads_from_replica(request):
+            return self.router.db_for_read(Restaurant)
+
+    def test_only_pure_reads_use_replicas(self):
+        self.assertIsNone(self.router.db_for_read(Restaurant))
+        self.assertEqual(self.read_alias("reader"), "replica_1")
+        with reads_from_replica(RequestFactory().get("/")):
+            with primary_reads():
+                self.assertIsNone(self.router.db_for_read(Restaurant))
+        self.assertEqual(self.router.db_for_write(Restaurant), "default")
+
+    def test_writers_read_from_the_primary(self):
+        middleware = ReplicaPinMiddleware(lambda request: HttpResponse())
+        middleware(RequestFactory().post("/", HTTP_AUTHORIZATION="Token writer"))
+        self.assertIsNone(self.read_alias("writer"))
+        self.assertEqual(self.read_alias("reader"), "replica_1")
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.status = 0
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.status = 0
+
+    def close(self):
+        self.closed = 1
+
+
+class SlowPingConnection(FakeConnection):
+    def __init__(self):
+        super().__init__()
+        self.pinging = threading.Event()
+        self.answer = threading.Event()
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql):
+        self.pinging.set()
+        self.answer.wait(5)
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def pool(self, **options):
+        defaults = {
+            "min_size": 0,
+            "max_size": 2,
+            "timeout": 0.05,
+            "max_lifetime": 60,
+            "max_idle": 60,
+            "check_after": 60,
+        }
+        return ConnectionPool("default", **{**defaults, **options})
+
+    def test_reuses_released_connections(self):
+        pool = self.pool()
+        connection = pool.acquire(FakeConnection)
+        pool.release(connection)
+        self.assertIs(pool.acquire(FakeConnection), connection)
+
+    def test_waits_then_times_out_when_exhausted(self):
+        pool = self.pool()
+        first = pool.acquire(FakeConnection)
+        pool.acquire(FakeConnection)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(FakeConnection)
+        threading.Timer(0.01, pool.release, [first]).start()
+        self.assertIs(pool.acquire(FakeConnection), first)
+
+    def test_discards_broken_and_expired_connections(self):
+        pool = self.pool(max_lifetime=0)
+        expired = pool.acquire(FakeConnection)
+        pool.release(expired)
+        self.assertTrue(expired.closed)
+
+        pool = self.pool()
+        in_transaction = pool.acquire(FakeConnection)
+        in_transaction.status = 2
+        pool.release(in_transaction)
+        self.assertEqual(in_transaction.status, 0)
+        broken = pool.acquire(FakeConnection)
+        broken.closed = 2
+        pool.release(broken)
+        self.assertIsNot(pool.acquire(FakeConnection), broken)
+
+    def test_health_checks_run_outside_the_lock(self):
+        pool = self.pool(check_after=0)
+        slow = pool.acquire(SlowPingConnection)
+        pool.release(slow)
+        checked = []
+        checker = threading.Thread(
+            target=lambda: checked.append(pool.acquire(FakeConnection))
+        )
+        checker.start()
+        slow.pinging.wait(5)
+        try:
+            # The slow connection keeps its slot; the other one is opened
+            # while it is still being pinged.
+            self.assertIsNot(pool.acquire(FakeConnection), slow)
+            self.assertFalse(slow.answer.is_set())
+            with self.assertRaises(PoolTimeout):
+                pool.acquire(FakeConnection)
+        finally:
+            slow.answer.set()
+            checker.join()
+        self.assertEqual(checked, [slow])
+
+
+class SeatingSchedulerTests(SimpleTestCase):
+    def queue(self, *party_sizes):
+        return [
+            SimulatedParty(size, EPOCH + timedelta(minutes=i), 60)
+            for i, size in enumerate(party_sizes)
+        ]
+
+    def seated(self, scheduler, queue, available_seats, now=EPOCH):
+        return [
+            entry.party_size
+            for entry in scheduler.select(iter(queue), available_seats, now)
+        ]
+
+    def test_strategies_pick_different_parties(self):
+        queue = self.queue(6, 2, 3, 1)
+        self.assertEqual(self.seated(FifoScheduler(), queue, 4), [])
+        self.assertEqual(self.seated(SkipAheadScheduler(), queue, 4), [2, 1])
+        self.assertEqual(self.seated(BestFitScheduler(), queue, 4), [3, 1])
+
+    def test_nobody_jumps_a_starving_party(self):
+        queue = self.queue(6, 2, 3, 1)
+        later = EPOCH + timedelta(minutes=30)
+        scheduler = SkipAheadScheduler(max_wait_minutes=30)
+        self.assertEqual(self.seated(scheduler, queue, 4, later), [])
+        scheduler = BestFitScheduler(max_wait_minutes=30)
+        self.assertEqual(self.seated(scheduler, queue, 4, later), [])
+
+    def test_simulate_accounts_for_every_party(self):
+        trace = generate_trace(240, 1.5, 45, seed=1)
+        for scheduler in (FifoScheduler(), SkipAheadScheduler(), BestFitScheduler()):
+            result = simulate("test", scheduler, trace, total_seats=20)
+            self.assertEqual(len(result.waits), len(trace))
+            self.assertTrue(0 < result.utilization <= 1)
+
+
+class UserEventsTests(SimpleTestCase):
+    async def test_requires_a_token(self):
+        request = RequestFactory().get("/users/events/", {"email": "a@example.com"})
+        response = await user_events(request)
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(
+    WAIT_ESTIMATE_MIN_SAMPLES=2,
+    WAIT_ESTIMATE_MAX_PARTY_SIZE=8,
+    WAIT_ESTIMATE_DEFAULT_SECONDS_PER_POSITION=180,
+)
+class WaitTimeEstimatorTests(SimpleTestCase):
+    def setUp(self):
+        self.estimator = WaitTimeEstimator(MemoryStatStore(), alpha=0.5)
+
+    def test_ewma_starts_at_the_first_sample(self):
+        self.assertEqual(ewma(0.0, 100, 0, 0.5), 100)
+        self.assertEqual(ewma(100, 200, 1, 0.5), 150)
+
+    def test_learns_waits_per_position(self):
+        self.estimator.observe_wait(1, 2, position=2, wait_seconds=200)
+        self.estimator.observe_wait(1, 2, position=1, wait_seconds=200)
+        # Samples of 100 then 200 seconds per position.
+        self.assertEqual(self.estimator.estimate(1, 2, 3), 450)
+        # Other sizes fall back to the all-parties row.
+        self.assertEqual(self.estimator.estimate(1, 6, 3), 450)
+
+    def test_falls_back_to_dining_turnover_then_default(self):
+        self.assertEqual(self.estimator.estimate(1, 2, 3, total_seats=10), 540)
+        self.estimator.observe_dining(1, 2, 3000)
+        self.estimator.observe_dining(1, 4, 3000)
+        self.assertEqual(self.estimator.estimate(1, 2, 3, total_seats=10), 900)
+        self.assertEqual(self.estimator.estimate(1, 2, 3), 540)
+
+
+def create_restaurant(place_id, **fields):
+    defaults = {"location": Point(-122.4, 37.7, srid=4326), "verified": True}
+    return Restaurant.objects.create(
+        name=place_id,
+        place_id=place_id,
+        address="1 Test Street",
+        **{**defaults, **fields},
+    )
+
+
+def create_user(email):
+    return User.objects.create(email=email)
+
+
+@override_settings(QUEUE_ENTRY_TIMEOUT_MINUTES=120, SEAT_TIMEOUT_MINUTES=60)
+class SweeperTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.default = create_restaurant("default", available_seats=10)
+        self.strict = create_restaurant(
+            "strict", queue_timeout_minutes=10, seat_timeout_minutes=15
+        )
+
+    def queue(self, restaurant, email, minutes_ago):
+        entry = Queue.objects.create(
+            restaurant=restaurant, user=create_user(email), party_size=2, position=1
+        )
+        joined_at = self.now - timedelta(minutes=minutes_ago)
+        Queue.objects.filter(pk=entry.pk).update(joined_at=joined_at)
+        return entry
+
+    def seat(self, restaurant, email, minutes_ago, party_size=2):
+        user = User.objects.create(email=email, is_seated=True)
+        SeatingEvent.objects.create(
+            restaurant=restaurant,
+            user=user,
+            kind=SeatingEvent.SEATED,
+            party_size=party_size,
+            created_at=self.now - timedelta(minutes=minutes_ago),
+        )
+        return user
+
+    def test_expires_entries_past_their_restaurants_timeout(self):
+        kept = self.queue(self.default, "kept@example.com", 30)
+        self.queue(self.default, "old@example.com", 200)
+        self.queue(self.strict, "strict@example.com", 30)
+
+        result = SweepResult()
+        expire_stale_queue_entries(self.now, result)
+
+        self.assertEqual(result.expired_entries, 2)
+        self.assertEqual(result.restaurants, {self.default.pk, self.strict.pk})
+        self.assertEqual(list(Queue.objects.values_list("pk", flat=True)), [kept.pk])
+        self.assertEqual(SeatingEvent.objects.filter(kind=SeatingEvent.LEFT).count(), 2)
+
+    def test_reclaims_seats_from_parties_that_never_ordered(self):
+        abandoned = self.seat(self.default, "gone@example.com", 90, party_size=4)
+        recent = self.seat(self.default, "recent@example.com", 30)
+        strict = self.seat(self.strict, "strict@example.com", 30)
+        ordered = self.seat(self.default, "ordered@example.com", 90)
+        Order.objects.create(user=ordered, order_id="order-1")
+
+        result = SweepResult()
+        reclaim_abandoned_seats(self.now, result)
+
+        self.assertEqual(result.reclaimed_users, 2)
+        self.assertEqual(result.reclaimed_seats, 6)
+        seated = set(User.objects.filter(is_seated=True).values_list("pk", flat=True))
+        self.assertEqual(seated, {recent.pk, ordered.pk})
+        self.assertNotIn(abandoned.pk, seated)
+        self.assertNotIn(strict.pk, seated)
+        self.default.refresh_from_db()
+        self.strict.refresh_from_db()
+        self.assertEqual(self.default.available_seats, 14)
+        # Never more free seats than the restaurant has.
+        self.assertEqual(self.strict.available_seats, self.strict.total_seats)
+        self.assertEqual(
+            SeatingEvent.objects.filter(kind=SeatingEvent.RELEASED).count(), 2
+        )
+
+
+class SweepQueuesCommandTests(SimpleTestCase):
+    def test_metrics_need_a_running_sweeper(self):
+        with self.assertRaises(CommandError):
+            call_command("sweep_queues", metrics_port=9400)
+
+
+class GetManyCachedTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.computed = []
+
+    def compute(self, ids):
+        self.computed.append(sorted(ids))
+        return {id_: f"value-{id_}" for id_ in ids}
+
+    def test_computes_only_misses_in_one_batch(self):
+        self.assertEqual(
+            get_many_cached("test", ["a"], self.compute, ttl=60), {"a": "value-a"}
+        )
+        values = get_many_cached("test", ["a", "b", "c"], self.compute, ttl=60)
+        self.assertEqual(values, {"a": "value-a", "b": "value-b", "c": "value-c"})
+        self.assertEqual(self.computed, [["a"], ["b", "c"]])
+
+    def test_serves_stale_values_while_another_request_recomputes(self):
+        # Past its soft expiry: (value, compute seconds, expires at).
+        cache.set("test:a", ("stale", 0.1, time.time() - 1), 60)
+        cache.add("test:a:lock", 1)
+        values = get_many_cached("test", ["a"], self.compute, ttl=60)
+        self.assertEqual(values, {"a": "stale"})
+        self.assertEqual(self.computed, [])
+
+        cache.delete("test:a:lock")
+        values = get_many_cached("test", ["a"], self.compute, ttl=60)
+        self.assertEqual(values, {"a": "value-a"})
+
+
+@override_settings(RATE_LIMIT_ENABLED=False, AVAILABILITY_CACHE_SECONDS=60)
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.full = create_restaurant("full", available_seats=0)
+        create_restaurant("free", available_seats=8)
+        Queue.objects.create(
+            restaurant=self.full,
+            user=create_user("queued@example.com"),
+            party_size=3,
+            position=1,
+        )
+
+    def availability(self, **params):
+        view = RestaurantViewSet.as_view({"get": "availability"})
+        request = APIRequestFactory().get("/restaurants/availability/", params)
+        return view(request)
+
+    def test_snapshot(self):
+        response = self.availability(place_ids="full,free,missing")
+        self.assertEqual(response.status_code, 200)
+        rows = {row["place_id"]: row for row in response.data["restaurants"]}
+        self.assertEqual(rows["full"]["queue_size"], 3)
+        self.assertEqual(rows["free"]["available_seats"], 8)
+        self.assertNotIn("estimated_wait_seconds", rows["full"])
+        self.assertEqual(response.data["not_found"], ["missing"])
+
+    def test_estimate_is_a_boolean(self):
+        for value in ("0", "false"):
+            response = self.availability(place_ids="full", estimate=value)
+            restaurant = response.data["restaurants"][0]
+            self.assertNotIn("estimated_wait_seconds", restaurant)
+        response = self.availability(place_ids="full,free", estimate="true")
+        rows = {row["place_id"]: row for row in response.data["restaurants"]}
+        self.assertGreater(rows["full"]["estimated_wait_seconds"], 0)
+        self.assertEqual(rows["free"]["estimated_wait_seconds"], 0)
+        response = self.availability(place_ids="full", estimate="maybe")
+        self.assertEqual(response.status_code, 400)
+
+    def test_served_from_cache(self):
+        self.availability(place_ids="full")
+        Restaurant.objects.filter(pk=self.full.pk).update(available_seats=5)
+        with self.assertNumQueries(0):
+            response = self.availability(place_ids="full")
+        self.assertEqual(response.data["restaurants"][0]["available_seats"], 0)
+
+
+class TokenCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.alice = User(pk=1, email="alice@example.com")
+        self.bob = User(pk=2, email="bob@example.com")
+
+    def test_evicts_least_recently_used(self):
+        tokens = TokenCache(max_size=2, ttl=60)
+        tokens.set("a", self.alice)
+        tokens.set("b", self.bob)
+        self.assertEqual(tokens.get("a"), self.alice)
+        tokens.set("c", self.bob)
+        self.assertIsNone(tokens.get("b"))
+        self.assertEqual(tokens.get("a"), self.alice)
+        self.assertEqual(tokens.get("c"), self.bob)
+
+    def test_entries_expire(self):
+        tokens = TokenCache(max_size=2, ttl=0)
+        tokens.set("a", self.alice)
+        self.assertIsNone(tokens.get("a"))
+
+    def test_revocation(self):
+        tokens = TokenCache(max_size=4, ttl=60)
+        tokens.set("a", self.alice)
+        tokens.set("b", self.alice)
+        tokens.set("c", self.bob)
+        tokens.revoke("c")
+        self.assertIsNone(tokens.get("c"))
+        tokens.revoke_user(self.alice.pk)
+        self.assertIsNone(tokens.get("a"))
+        self.assertIsNone(tokens.get("b"))
+
+
+class HashingPoolTests(SimpleTestCase):
+    async def test_rejects_jobs_beyond_max_pending(self):
+        pool = HashingPool(workers=1, max_pending=1)
+        release = threading.Event()
+        busy = asyncio.ensure_future(pool.run(release.wait))
+        await asyncio.sleep(0)
+        with self.assertRaises(HashingPoolFull):
+            await pool.run(time.sleep, 0)
+        release.set()
+        self.assertTrue(await busy)
+        # The finished job gives its slot back.
+        self.assertIsNone(await pool.run(time.sleep, 0))
+
+    async def test_cancelled_callers_keep_their_slot_until_the_job_ends(self):
+        pool = HashingPool(workers=1, max_pending=1)
+        release = threading.Event()
+        busy = asyncio.ensure_future(pool.run(release.wait, 5))
+        await asyncio.sleep(0.01)
+        busy.cancel()
+        await asyncio.sleep(0)
+        with self.assertRaises(HashingPoolFull):
+            await pool.run(time.sleep, 0)
+        release.set()
+        # Runs after the cancelled job, once its slot is back.
+        await asyncio.wrap_future(pool.executor.submit(time.sleep, 0))
+        self.assertIsNone(await pool.run(time.sleep, 0))
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate("10/min"), (10, 10 / 60))
+        self.assertEqual(parse_rate("5/30s"), (5, 5 / 30))
+
+    def test_buckets_refill_over_time(self):
+        backend = LocalBucketBackend(max_keys=10)
+        buckets = [("test:ip:1", 2, 100.0)]
+        self.assertEqual(backend.consume(buckets), 0)
+        self.assertEqual(backend.consume(buckets), 0)
+        wait = backend.consume(buckets)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.01)
+        time.sleep(wait)
+        self.assertEqual(backend.consume(buckets), 0)
+
+    def test_every_bucket_must_have_a_token(self):
+        backend = LocalBucketBackend(max_keys=10)
+        ip, user = ("test:ip:1", 5, 1.0), ("test:user:a", 1, 0.5)
+        self.assertEqual(backend.consume([ip, user]), 0)
+        self.assertAlmostEqual(backend.consume([ip, user]), 2, places=2)
+        # The rejected request took nothing from the IP's bucket.
+        for _ in range(4):
+            self.assertEqual(backend.consume([ip]), 0)
+
+    @override_settings(RATE_LIMITS={"test_login": {"ip": "1/min"}})
+    def test_throttled_views_send_retry_after(self):
+        view = rate_limit("test_login")(lambda request: HttpResponse())
+        request = RequestFactory().post("/", REMOTE_ADDR="203.0.113.9")
+        self.assertEqual(view(request).status_code, 200)
+        response = view(request)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "60")
+        self.assertEqual(throttled_response(0.2)["Retry-After"], "1")
+
+
+class FakeUpstreamServerTests(SimpleTestCase):
+    def start(self, **options):
+        server = FakeUpstreamServer(("127.0.0.1", 0), **options)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def call(self, server, method, path, body=None):
+        request = urllib.request.Request(
+            server.url + path,
+            data=json.dumps(body).encode() if body is not None else None,
+            method=method,
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            return error.code, json.loads(error.read())
+
+    def test_orders_are_priced_from_the_catalog(self):
+        server = self.start()
+        status, payload = self.call(
+            server,
+            "POST",
+            "/v2/catalog/object",
+            {
+                "object": {
+                    "id": "#item",
+                    "item_data": {
+                        "variations": [
+                            {
+                                "id": "#regular",
+                                "item_variation_data": {
+                                    "price_money": {"amount": 450, "currency": "USD"}
+                                },
+                            }
+                        ]
+                    },
+                }
+            },
+        )
+        self.assertEqual(status, 200)
+        variation_id = payload["id_mappings"][1]["object_id"]
+        status, payload = self.call(
+            server,
+            "POST",
+            "/v2/orders",
+            {
+                "order": {
+                    "line_items": [{"catalog_object_id": variation_id, "quantity": "2"}]
+                }
+            },
+        )
+        self.assertEqual(payload["order"]["total_money"]["amount"], 900)
+        order_id = payload["order"]["id"]
+        status, payload = self.call(server, "GET", f"/v2/orders/{order_id}")
+        self.assertEqual((status, payload["order"]["state"]), (200, "OPEN"))
+        status, _ = self.call(server, "GET", "/v2/orders/missing")
+        self.assertEqual(status, 404)
+
+    def test_injected_failures(self):
+        server = self.start(error_rate=1.0, seed=1)
+        status, payload = self.call(server, "GET", "/v2/locations")
+        self.assertEqual(status, 503)
+        self.assertEqual(payload["errors"][0]["code"], "SERVICE_UNAVAILABLE")
+
+
+class AsyncRequestUserTests(TestCase):
+    def setUp(self):
+        self.user = create_user("diner@example.com")
+        self.token = issue_token(self.user)
+
+    def request(self, **headers):
+        return RequestFactory().post(
+            "/", b"{}", content_type="application/json", **headers
+        )
+
+    async def test_token_or_email(self):
+        request = self.request(HTTP_AUTHORIZATION=f"Token {self.token}")
+        self.assertEqual((await get_request_user(request)).pk, self.user.pk)
+        user = await get_request_user(self.request(), "diner@example.com")
+        self.assertEqual(user.pk, self.user.pk)
+
+    async def test_unresolved_tokens_do_not_fall_back_to_email(self):
+        for header in ("Token revoked", "Bearer " + self.token, "Token"):
+            with self.assertRaises(AuthenticationFailed):
+                await get_request_user(
+                    self.request(HTTP_AUTHORIZATION=header), "diner@example.com"
+                )
+        request = self.request(HTTP_AUTHORIZATION="Token revoked")
+        response = await async_views.place_order(request, "place")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response["WWW-Authenticate"], "Token")
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class MenuDeltaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.restaurant = create_restaurant("menu")
+        self.category = Category.objects.create(
+            name="Mains", category_id="#Mains", restaurant=self.restaurant
+        )
+        self.item = Item.objects.create(
+            name="Noodles", item_id="#Noodles", category=self.category
+        )
+        self.variation = Variation.objects.create(
+            name="Large",
+            reference_id="large__menu",
+            item=self.item,
+            price=Decimal("12.50"),
+        )
+        record_menu_changes(
+            self.restaurant.pk,
+            [
+                (MenuChange.CATEGORY, self.category.pk),
+                (MenuChange.ITEM, self.item.pk),
+                (MenuChange.VARIATION, self.variation.pk),
+            ],
+        )
+        gone = Item.objects.create(name="Gone", item_id="#Gone", category=self.category)
+        record_menu_changes(self.restaurant.pk, [(MenuChange.ITEM, gone.pk)])
+        gone.delete()
+
+    def get_menu(self, since=0, **headers):
+        view = RestaurantViewSet.as_view({"get": "get_menu"})
+        request = APIRequestFactory().get(
+            "/restaurants/menu/get-menu/", {"since": since}, **headers
+        )
+        return view(request, pk="menu")
+
+    def test_json_delta(self):
+        delta = self.get_menu().data
+        self.assertFalse(delta["full"])
+        self.assertEqual([row["id"] for row in delta["items"]], [self.item.pk])
+        self.assertEqual(len(delta["deleted"]["items"]), 1)
+
+    def test_msgpack_delta_uses_the_snapshot_layout(self):
+        response = self.get_menu(HTTP_ACCEPT=MEDIA_TYPE)
+        response.render()
+        delta = msgpack.unpackb(response.content)
+        self.assertFalse(delta["full"])
+        self.assertEqual(delta["menu_version"], 2)
+        self.assertEqual(delta["reference_suffix"], "__menu")
+        self.assertEqual(delta["items"]["category_id"], [self.category.pk])
+        self.assertEqual(
+            delta["variations"],
+            {
+                "id": [self.variation.pk],
+                "item_id": [self.item.pk],
+                "name": ["Large"],
+                "price": [1250],
+                "quantity": [0],
+                "square_id": [None],
+                "reference_id": ["large"],
+            },
+        )
+        self.assertEqual(len(delta["deleted"]["items"]), 1)
+
+    def test_msgpack_clients_out_of_range_get_the_cached_snapshot(self):
+        response = self.get_menu(since=99, HTTP_ACCEPT=MEDIA_TYPE)
+        response.render()
+        self.assertTrue(msgpack.unpackb(response.content)["full"])
+        # Only the restaurant is read; the snapshot is not rebuilt.
+        with self.assertNumQueries(1):
+            response = self.get_menu(since=99, HTTP_ACCEPT=MEDIA_TYPE)
+        response.render()
+        self.assertTrue(msgpack.unpackb(response.content)["full"])
+
+
+@override_settings(WEBHOOK_SETTLE_SECONDS=0, WEBHOOK_MAX_ATTEMPTS=2)
+class WebhookProcessingTests(TestCase):
+    def setUp(self):
+        self.user = create_user("diner@example.com")
+        User.objects.filter(pk=self.user.pk).update(is_seated=True)
+        self.order = Order.objects.create(
+            user=self.user,
+            order_id="ORDER1",
+            square_order={"id": "ORDER1", "state": "OPEN", "version": 2},
+        )
+        self.events = 0
+
+    def deliver(self, event_type, data, event_id=None):
+        self.events += 1
+        store_event(
+            {
+                "event_id": event_id or f"event-{self.events}",
+                "type": event_type,
+                "data": {"object": data},
+            }
+        )
+
+    def test_stale_order_versions_are_ignored(self):
+        change = {"order_id": "ORDER1", "state": "COMPLETED", "version": 3}
+        self.deliver("order.updated", {"order_updated": change})
+        stale = {"order_id": "ORDER1", "state": "OPEN", "version": 2}
+        self.deliver("order.updated", {"order_updated": stale})
+        self.assertEqual(process_events(), 2)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.square_order["state"], "COMPLETED")
+        self.assertEqual(self.order.square_order["version"], 3)
+
+    def test_final_payment_statuses_stick(self):
+        payment = {"order_id": "ORDER1", "status": "COMPLETED"}
+        self.deliver("payment.updated", {"payment": payment})
+        self.deliver("payment.updated", {"payment": {**payment, "status": "APPROVED"}})
+        process_events()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, "COMPLETED")
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_seated)
+
+    def test_older_invoices_do_not_overwrite_newer_ones(self):
+        invoice = {"id": "INV1", "order_id": "ORDER1", "version": 2, "status": "PAID"}
+        self.deliver("invoice.payment_made", {"invoice": invoice})
+        self.deliver(
+            "invoice.updated",
+            {"invoice": {**invoice, "version": 1, "status": "UNPAID"}},
+        )
+        process_events()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.invoice_id, "INV1")
+        self.assertEqual(self.order.square_invoice["status"], "PAID")
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_seated)
+
+    def test_inventory_skips_counts_this_app_set(self):
+        restaurant = create_restaurant("stocked")
+        category = Category.objects.create(
+            name="Mains", category_id="#Mains", restaurant=restaurant
+        )
+        item = Item.objects.create(
+            name="Noodles", item_id="#Noodles", category=category
+        )
+        variation = Variation.objects.create(
+            name="Large", item=item, price=Decimal("12.50"), quantity=5, square_id="SQV"
+        )
+
+        def count(quantity):
+            return {
+                "inventory_counts": [
+                    {
+                        "catalog_object_id": "SQV",
+                        "state": "IN_STOCK",
+                        "quantity": quantity,
+                    }
+                ]
+            }
+
+        self.deliver("inventory.count.updated", count("5"))
+        process_events()
+        self.assertFalse(MenuChange.objects.exists())
+        self.deliver("inventory.count.updated", count("7"))
+        process_events()
+        variation.refresh_from_db()
+        self.assertEqual(variation.quantity, 7)
+        self.assertEqual(
+            list(MenuChange.objects.values_list("kind", "object_id")),
+            [(MenuChange.VARIATION, variation.pk)],
+        )
+        restaurant.refresh_from_db()
+        self.assertEqual(restaurant.menu_version, 1)
+
+    def test_inventory_skips_counts_older_than_local_changes(self):
+        restaurant = create_restaurant("stocked")
+        category = Category.objects.create(
+            name="Mains", category_id="#Mains", restaurant=restaurant
+        )
+        item = Item.objects.create(
+            name="Noodles", item_id="#Noodles", category=category
+        )
+        variation = Variation.objects.create(
+            name="Large",
+            item=item,
+            price=Decimal("12.50"),
+            quantity=5,
+            reference_id="large__noodles",
+            square_id="SQV",
+        )
+        before = timezone.now()
+        adjust_inventory(
+            restaurant, [{"variation_reference_id": "large__noodles", "quantity": 4}]
+        )
+
+        def count(quantity, calculated_at):
+            return {
+                "inventory_counts": [
+                    {
+                        "catalog_object_id": "SQV",
+                        "state": "IN_STOCK",
+                        "quantity": quantity,
+                        "calculated_at": calculated_at.isoformat(),
+                    }
+                ]
+            }
+
+        self.deliver("inventory.count.updated", count("5", before))
+        self.assertEqual(process_events(), 1)
+        variation.refresh_from_db()
+        self.assertEqual(variation.quantity, 4)
+
+        later = timezone.now() + timedelta(seconds=1)
+        self.deliver("inventory.count.updated", count("6", later))
+        self.deliver("inventory.count.updated", count("3", before))
+        self.assertEqual(process_events(), 2)
+        variation.refresh_from_db()
+        self.assertEqual(variation.quantity, 6)
+        self.assertEqual(variation.quantity_changed_at, later)
+
+    def test_redeliveries_are_dropped(self):
+        change = {"order_id": "ORDER1", "state": "COMPLETED", "version": 3}
+        self.deliver("order.updated", {"order_updated": change}, event_id="same")
+        self.deliver("order.updated", {"order_updated": change}, event_id="same")
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.assertEqual(process_events(), 1)
+        self.assertEqual(process_events(), 0)
+
+    def test_failing_events_stop_after_max_attempts(self):
+        broken = {
+            "inventory_counts": [
+                {"catalog_object_id": "SQV", "state": "IN_STOCK", "quantity": "lots"}
+            ]
+        }
+        self.deliver("inventory.count.updated", broken)
+        for _ in range(3):
+            self.assertEqual(process_events(), 0)
+        event = WebhookEvent.objects.get()
+        self.assertEqual(event.attempts, 2)
+        self.assertIsNone(event.processed_at)
+        self.assertIn("ValueError", event.error)
+
+
+def succeed(value):
+    return {"value": value}
+
+
+def fail():
+    raise ValueError("Square said no")
+
+
+def shed():
+    raise Overloaded(30)
+
+
+def refuse():
+    raise requests.ConnectionError("connection refused")
+
+
+def unreachable():
+    get_guard("test").call(refuse)
+
+
+async def afail():
+    raise ValueError("Square said no")
+
+
+@override_settings(
+    TASK_MAX_ATTEMPTS=2,
+    TASK_LEASE_SECONDS=60,
+    TASK_BACKOFF_SECONDS=1,
+    TASK_BACKOFF_MAX_SECONDS=1,
+)
+class TaskRunTests(TestCase):
+    def make_due(self):
+        Task.objects.update(run_at=timezone.now())
+
+    def test_claim_leases_tasks(self):
+        task = enqueue(succeed, value=1)
+        before = timezone.now()
+        [claimed] = claim()
+        self.assertEqual(claimed.attempts, 1)
+        task.refresh_from_db()
+        self.assertEqual(task.attempts, 1)
+        self.assertGreaterEqual(task.run_at, before + timedelta(seconds=60))
+        # Leased tasks are not due again until the lease runs out.
+        self.assertEqual(claim(), [])
+
+    def test_run_records_success(self):
+        enqueue(succeed, value=1)
+        task = run(claim()[0])
+        self.assertEqual(task.status, Task.DONE)
+        task.refresh_from_db()
+        self.assertEqual(task.result, {"value": 1})
+        self.assertIsNotNone(task.finished_at)
+
+    def test_failures_are_retried_then_dead(self):
+        enqueue(fail)
+        task = run(claim()[0])
+        self.assertEqual(task.status, Task.PENDING)
+        self.assertIn("Square said no", task.last_error)
+        self.assertEqual(claim(), [])
+        self.make_due()
+        task = run(claim()[0])
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.DEAD, 2))
+        self.assertIsNotNone(task.finished_at)
+        self.make_due()
+        self.assertEqual(claim(), [])
+
+    def test_shed_load_defers_without_spending_an_attempt(self):
+        enqueue(shed)
+        before = timezone.now()
+        run(claim()[0])
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts), (Task.PENDING, 0))
+        self.assertGreaterEqual(task.run_at, before + timedelta(seconds=30))
+
+    def test_transport_errors_spend_attempts_until_dead(self):
+        self.addCleanup(reset_guards)
+        enqueue(unreachable)
+        task = run(claim()[0])
+        self.assertEqual((task.status, task.attempts), (Task.PENDING, 1))
+        self.assertIn("SquareUnreachable", task.last_error)
+        self.assertEqual(claim(), [])
+        self.make_due()
+        task = run(claim()[0])
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.DEAD, 2))
+        self.make_due()
+        self.assertEqual(claim(), [])
+
+    def test_run_now_skips_leased_tasks(self):
+        task = enqueue(fail)
+        claim()
+        self.assertIs(run_now(task), task)
+        task.refresh_from_db()
+        self.assertEqual((task.attempts, task.last_error), (1, ""))
+
+    async def test_arun_now_records_the_outcome(self):
+        task = await sync_to_async(enqueue)(fail)
+        task = await arun_now(task, afail)
+        self.assertEqual((task.status, task.attempts), (Task.PENDING, 1))
+        self.assertIn("Square said no", task.last_error)
+        self.assertIs(await arun_now(task, afail), task)
+
+
+class TaskClaimTests(TransactionTestCase):
+    def test_skips_tasks_locked_by_another_worker(self):
+        task = enqueue(succeed, value=1)
+        locked = threading.Event()
+        done = threading.Event()
+
+        def hold():
+            try:
+                with transaction.atomic():
+                    Task.objects.select_for_update().get(pk=task.pk)
+                    locked.set()
+                    done.wait(5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        locked.wait(5)
+        try:
+            self.assertEqual(claim(), [])
+        finally:
+            done.set()
+            thread.join()
+        self.assertEqual([claimed.pk for claimed in claim()], [task.pk])
+
+
+class RecordOrderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user("diner@example.com")
+        self.restaurant = create_restaurant("orders")
+        category = Category.objects.create(
+            name="Mains", category_id="#Mains", restaurant=self.restaurant
+        )
+        item = Item.objects.create(
+            name="Noodles", item_id="#Noodles", category=category
+        )
+        self.variation = Variation.objects.create(
+            name="Large", item=item, price=Decimal("12.50"), quantity=5, square_id="SQV"
+        )
+
+    def order(self, *square_ids):
+        return {
+            "id": "ORDER1",
+            "line_items": [
+                {"catalog_object_id": square_id, "quantity": "2"}
+                for square_id in square_ids
+            ],
+        }
+
+    def test_records_order_stock_and_tasks(self):
+        created_order, invoice_task = record_order(
+            self.user, self.restaurant, self.order("SQV"), {"SQV": self.variation}
+        )
+        self.assertEqual(created_order.order_id, "ORDER1")
+        self.variation.refresh_from_db()
+        self.assertEqual(self.variation.quantity, 3)
+        self.assertEqual(
+            sorted(
+                short_name(name) for name in Task.objects.values_list("name", flat=True)
+            ),
+            ["create_order_invoice", "record_inventory_sale"],
+        )
+        self.assertEqual(invoice_task.args["order_id"], "ORDER1")
+        self.restaurant.refresh_from_db()
+        self.assertEqual(self.restaurant.menu_version, 1)
+
+    def test_a_failure_records_nothing(self):
+        with self.assertRaises(KeyError):
+            record_order(
+                self.user,
+                self.restaurant,
+                self.order("SQV", "UNKNOWN"),
+                {"SQV": self.variation},
+            )
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Task.objects.exists())
+        self.variation.refresh_from_db()
+        self.assertEqual(self.variation.quantity, 5)
+
+
+@override_settings(RATE_LIMIT_ENABLED=False, SEATING_STRATEGY="fifo")
+class SeatAccountingTests(TestCase):
+    def setUp(self):
+        self.restaurant = create_restaurant("seats", total_seats=10, available_seats=2)
+
+    def post(self, action, data):
+        view = RestaurantViewSet.as_view({"post": action})
+        request = APIRequestFactory().post("/", data, format="json")
+        return view(request, pk="seats")
+
+    def test_join_takes_seats_or_queues(self):
+        create_user("first@example.com")
+        create_user("second@example.com")
+        response = self.post(
+            "join_queue", {"email": "first@example.com", "party_size": 2}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("position", response.data)
+        response = self.post(
+            "join_queue", {"email": "second@example.com", "party_size": 2}
+        )
+        self.assertEqual(response.data["position"], 1)
+        self.restaurant.refresh_from_db()
+        self.assertEqual(self.restaurant.available_seats, 0)
+
+    def test_released_seats_are_capped_and_seat_the_queue(self):
+        Queue.objects.create(
+            restaurant=self.restaurant,
+            user=create_user("waiting@example.com"),
+            party_size=4,
+            position=1,
+        )
+        response = self.post("release_seats", {"seats_released": 20})
+        self.assertEqual(response.data["seated_users"], ["waiting@example.com"])
+        self.restaurant.refresh_from_db()
+        self.assertEqual(self.restaurant.available_seats, 6)
+        self.assertFalse(Queue.objects.exists())
+
+
+class MenuDeletionTests(TestCase):
+    def setUp(self):
+        self.restaurant = create_restaurant("deleting")
+        self.category = Category.objects.create(
+            name="Mains", category_id="#Mains", restaurant=self.restaurant
+        )
+        for i in range(3):
+            item = Item.objects.create(
+                name=f"Item {i}", item_id=f"#Item{i}", category=self.category
+            )
+            for size in ("Small", "Large"):
+                Variation.objects.create(name=size, item=item, price=Decimal("5"))
+
+    def tombstones(self):
+        return MenuChange.objects.filter(deleted=True)
+
+    def test_cascades_are_recorded_as_one_version(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.category.delete()
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.tombstones().count(), 1 + 3 + 6)
+        self.assertEqual(set(self.tombstones().values_list("version", flat=True)), {1})
+        self.restaurant.refresh_from_db()
+        self.assertEqual(self.restaurant.menu_version, 1)
+
+    def test_children_resolve_their_restaurant_through_surviving_parents(self):
+        variation = Variation.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            Variation.objects.filter(item=variation.item).delete()
+        self.assertEqual(
+            sorted(self.tombstones().values_list("kind", "restaurant_id")),
+            [(MenuChange.VARIATION, self.restaurant.pk)] * 2,
+        )
+
+    def test_deleting_a_restaurant_records_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.restaurant.delete()
+        self.assertFalse(MenuChange.objects.exists())
+
+
+class MenuSearchDatabaseTests(TestCase):
+    def setUp(self):
+        near = create_restaurant("near")
+        far = create_restaurant("far", location=Point(-73.9, 40.7, srid=4326))
+        hidden = create_restaurant("hidden", verified=False)
+        burgers = self.category(near, "Burgers")
+        self.cheese_burger = self.item(burgers, "Cheese Burger", "Beef patty")
+        self.small = Variation.objects.create(
+            name="Small",
+            item=self.cheese_burger,
+            price=Decimal("8.50"),
+            quantity=3,
+            reference_id="small__near",
+        )
+        self.large = Variation.objects.create(
+            name="Large", item=self.cheese_burger, price=Decimal("11.00")
+        )
+        self.item(burgers, "Veggie Plate", "Roasted vegetables")
+        sides = self.category(near, "Sides")
+        self.item(sides, "Fries", "Great with burgers")
+        self.item(sides, "Garden Salad", "Leafy greens")
+        self.item(self.category(far, "Grill"), "Burger Deluxe", "")
+        self.item(self.category(hidden, "Secret"), "Secret Burger", "")
+
+    def category(self, restaurant, name):
+        return Category.objects.create(
+            name=name, category_id=f"#{name}", restaurant=restaurant
+        )
+
+    def item(self, category, name, description):
+        return Item.objects.create(
+            name=name, description=description, item_id=f"#{name}", category=category
+        )
+
+    def names(self, results):
+        return [row["name"] for row in results]
+
+    def test_ranks_name_description_and_category_matches(self):
+        names = self.names(search_menu("burger"))
+        # Whole-word name matches first, then the partial ones by id.
+        self.assertEqual(set(names[:2]), {"Cheese Burger", "Burger Deluxe"})
+        self.assertEqual(names[2:], ["Veggie Plate", "Fries"])
+
+    def test_finds_misspelled_words(self):
+        results = search_menu("burgr")
+        self.assertEqual(results[0]["name"], "Cheese Burger")
+        self.assertNotIn("Garden Salad", self.names(results))
+        self.assertNotIn("Secret Burger", self.names(results))
+
+    def test_filters_by_radius(self):
+        results = search_menu("burger", Point(-122.4, 37.7, srid=4326), 5000)
+        self.assertNotIn("Burger Deluxe", self.names(results))
+        self.assertEqual({row["distance"] for row in results}, {0})
+        self.assertEqual({row["place_id"] for row in results}, {"near"})
+
+    def test_variations_are_embedded(self):
+        [row] = [row for row in search_menu("cheese") if row["name"] == "Cheese Burger"]
+        self.assertEqual(row["category_name"], "Burgers")
+        self.assertEqual(row["restaurant_name"], "near")
+        self.assertEqual(
+            row["variations"],
+            [
+                {
+                    "id": self.small.pk,
+                    "name": "Small",
+                    "price": 8.5,
+                    "quantity": 3,
+                    "square_id": None,
+                    "reference_id": "small__near",
+                },
+                {
+                    "id": self.large.pk,
+                    "name": "Large",
+                    "price": 11.0,
+                    "quantity": 0,
+                    "square_id": None,
+                    "reference_id": None,
+                },
+            ],
+        )
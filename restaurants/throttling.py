@@ -0,0 +1,263 @@
+import asyncio
+import functools
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from rest_framework import exceptions
+from rest_framework.throttling import BaseThrottle
+
+from . import metrics
+from .rendering import JsonResponse, loads
+
+PERIODS = {"s": 1, "sec": 1, "m": 60, "min": 60, "h": 3600, "hour": 3600, "d": 86400}
+
+throttled_requests = metrics.counter(
+    "dineq_throttled_requests_total",
+    "Requests rejected by the token-bucket rate limiter.",
+    ["endpoint"],
+)
+shed_requests = metrics.counter(
+    "dineq_shed_requests_total",
+    "Requests shed by a concurrency limiter before any work started.",
+    ["limiter"],
+)
+
+
+def parse_rate(rate):
+    """Parses ``"<tokens>/<period>"`` (``"10/min"``, ``"5/30s"``) into a
+    bucket capacity and a refill rate in tokens per second."""
+    tokens, count, unit = re.fullmatch(r"(\d+)/(\d*)([a-z]+)", rate).groups()
+    seconds = int(count or 1) * PERIODS[unit]
+    return int(tokens), int(tokens) / seconds
+
+
+class LocalBucketBackend:
+    """Token buckets in process memory; limits apply per worker process."""
+
+    def __init__(self, max_keys=None):
+        self.max_keys = max_keys or settings.RATE_LIMIT_MAX_KEYS
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, buckets):
+        """Takes one token from every ``(key, capacity, refill_rate)`` bucket
+        if all of them have one. Returns the seconds to wait otherwise."""
+        now = time.monotonic()
+        with self._lock:
+            levels = {}
+            wait = 0.0
+            for key, capacity, refill_rate in buckets:
+                tokens, updated = self._buckets.get(key, (capacity, now))
+                tokens = min(capacity, tokens + (now - updated) * refill_rate)
+                levels[key] = tokens
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / refill_rate)
+            if wait:
+                return wait
+            for key, tokens in levels.items():
+                self._buckets[key] = (tokens - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return 0.0
+
+
+class CacheBucketBackend:
+    """Token buckets in the Django cache, shared by every process using it.
+
+    The read-modify-write is not atomic, so under heavy contention a few
+    extra requests may get through; that is acceptable for admission
+    control and avoids a round trip per token.
+    """
+
+    prefix = "ratelimit"
+
+    def consume(self, buckets):
+        now = time.time()
+        keys = {
+            f"{self.prefix}:{key}": (capacity, rate) for key, capacity, rate in buckets
+        }
+        stored = cache.get_many(keys)
+        levels = {}
+        wait = 0.0
+        for key, (capacity, refill_rate) in keys.items():
+            tokens, updated = stored.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_rate)
+            levels[key] = tokens
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / refill_rate)
+        if wait:
+            return wait
+        cache.set_many(
+            {key: (tokens - 1, now) for key, tokens in levels.items()},
+            settings.RATE_LIMIT_CACHE_SECONDS,
+        )
+        return 0.0
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(settings.RATE_LIMIT_BACKEND)()
+    return _backend
+
+
+def client_ip(request):
+    if settings.RATE_LIMIT_TRUST_FORWARDED_FOR:
+        forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def check_rate(endpoint, ip=None, user=None, restaurant=None):
+    """Returns 0 when the request may proceed, else seconds until it may."""
+    if not settings.RATE_LIMIT_ENABLED:
+        return 0.0
+    budgets = settings.RATE_LIMITS.get(endpoint, {})
+    identities = {"ip": ip, "user": user, "restaurant": restaurant}
+    buckets = [
+        (f"{endpoint}:{kind}:{identities[kind]}", *parse_rate(rate))
+        for kind, rate in budgets.items()
+        if identities.get(kind)
+    ]
+    if not buckets:
+        return 0.0
+    wait = get_backend().consume(buckets)
+    if wait:
+        throttled_requests.inc(endpoint=endpoint)
+    return wait
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Applies RATE_LIMITS to viewset actions listed in the view's
+    ``throttle_scopes`` mapping of action name to endpoint name."""
+
+    def allow_request(self, request, view):
+        endpoint = getattr(view, "throttle_scopes", {}).get(view.action)
+        if endpoint is None:
+            return True
+
+        if getattr(request.user, "is_authenticated", False):
+            email = request.user.email
+        else:
+            email = getattr(request.data, "get", lambda key: None)("email")
+        self.delay = check_rate(
+            endpoint,
+            ip=client_ip(request),
+            user=email,
+            restaurant=view.kwargs.get("pk") or view.kwargs.get("place_id"),
+        )
+        return not self.delay
+
+    def wait(self):
+        return self.delay
+
+
+def throttled_response(wait):
+    response = JsonResponse(
+        {"error": "Too many requests, please retry later"}, status=429
+    )
+    response["Retry-After"] = str(max(int(wait + 0.999), 1))
+    return response
+
+
+def rate_limit(endpoint):
+    """RATE_LIMITS for plain Django views such as register and login, keyed
+    by client IP and the email in the JSON body."""
+
+    def identities(request):
+        try:
+            email = loads(request.body).get("email")
+        except (ValueError, AttributeError):
+            email = None
+        return {"ip": client_ip(request), "user": email}
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                wait = check_rate(endpoint, **identities(request))
+                if wait:
+                    return throttled_response(wait)
+                return await view(request, *args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            wait = check_rate(endpoint, **identities(request))
+            if wait:
+                return throttled_response(wait)
+            return view(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class Overloaded(exceptions.APIException):
+    status_code = 503
+    default_detail = "Server is busy, please retry shortly."
+    default_code = "overloaded"
+
+    def __init__(self, wait=1, detail=None):
+        super().__init__(detail)
+        # DRF's exception handler turns this into a Retry-After header.
+        self.wait = wait
+
+
+class ConcurrencyLimiter:
+    """Caps in-flight calls and sheds the rest immediately instead of letting
+    them queue for a worker."""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.slots = threading.BoundedSemaphore(limit)
+
+    def __enter__(self):
+        if not self.slots.acquire(blocking=False):
+            shed_requests.inc(limiter=self.name)
+            raise Overloaded(settings.LOAD_SHED_RETRY_AFTER_SECONDS)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.slots.release()
+
+    def __call__(self, func):
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with self:
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+square_bound = ConcurrencyLimiter("square", settings.SQUARE_MAX_CONCURRENCY)
+
+# Coroutines waiting on Square hold no worker thread, so the async views get
+# a separate, larger cap.
+square_async_bound = ConcurrencyLimiter(
+    "square_async", settings.SQUARE_ASYNC_MAX_CONCURRENCY
+)
@@ -1,18 +1,73 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import NearbyRestaurantsAPIView, RestaurantViewSet, login, register
+from . import async_views
+from .streams import restaurant_events, user_events
+from .views import (
+    NearbyRestaurantsAPIView,
+    RestaurantViewSet,
+    login,
+    logout,
+    prometheus_metrics,
+    register,
+    square_webhook,
+)
 
 router = DefaultRouter()
 router.register(r"restaurants", RestaurantViewSet, basename="restaurant")
 
-urlpatterns = [
+# Under ASGI the views that wait on Square or Google are served by their
+# async counterparts, routed ahead of the viewset actions they replace.
+async_urlpatterns = [
+    path(
+        "restaurants/<str:place_id>/place-order/",
+        async_views.place_order,
+        name="restaurant-place-order",
+    ),
+    path(
+        "restaurants/<str:place_id>/retrieve-order/",
+        async_views.retrieve_order,
+        name="restaurant-retrieve-order",
+    ),
+    path(
+        "restaurants/<str:place_id>/get-invoice/",
+        async_views.get_invoice,
+        name="restaurant-get-invoice",
+    ),
+    path(
+        "restaurants/<str:place_id>/checkout/",
+        async_views.create_terminal_checkout,
+        name="restaurant-checkout",
+    ),
+]
+
+urlpatterns = (async_urlpatterns if settings.ASYNC_VIEWS else []) + [
     path("", include(router.urls)),
     path(
         "nearby-restaurants/",
-        NearbyRestaurantsAPIView.as_view(),
+        async_views.nearby_restaurants
+        if settings.ASYNC_VIEWS
+        else NearbyRestaurantsAPIView.as_view(),
         name="nearby-restaurants",
     ),
-    path("register/", register, name="register"),
-    path("login/", login, name="login"),
+    path(
+        "register/",
+        async_views.register if settings.ASYNC_VIEWS else register,
+        name="register",
+    ),
+    path(
+        "login/",
+        async_views.login if settings.ASYNC_VIEWS else login,
+        name="login",
+    ),
+    path("logout/", logout, name="logout"),
+    path("metrics/", prometheus_metrics, name="metrics"),
+    path("webhooks/square/", square_webhook, name="square-webhook"),
+    path(
+        "restaurants/<str:place_id>/events/",
+        restaurant_events,
+        name="restaurant-events",
+    ),
+    path("users/events/", user_events, name="user-events"),
 ]
@@ -1,9 +1,7 @@
 import contextlib
-import json
 import os
 import uuid
 from collections import defaultdict
-from datetime import datetime, timedelta, timezone
 
 import requests
 from django.conf import settings
@@ -11,29 +9,84 @@ from django.contrib.auth.models import User
 from django.contrib.gis.db.models.functions import Distance, GeometryDistance
 from django.contrib.gis.geos import Point
 from django.db import transaction
-from django.db.models import Sum
-from django.http import JsonResponse
+from django.db.models import F, Sum
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import viewsets
+from rest_framework.authentication import get_authorization_header
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import BooleanField
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
-from square.client import Client
 
-from .models import Category, Item, Queue, Restaurant, User, Variation, Order
+from .authentication import issue_token, revoke_token
+from .availability import availability_snapshot
+from .estimation import (
+    WaitTimeEstimator,
+    log_joined,
+    log_seated_directly,
+)
+from .events import (
+    notify_availability,
+    notify_position,
+    notify_queue_changed,
+    notify_seated,
+)
+from .instrumentation import timed
+from .menu_changes import menu_delta, packed_menu_delta, record_menu_changes
+from .menu_snapshot import (
+    MenuSnapshotRenderer,
+    cached_snapshot,
+    invalidate_snapshot,
+    refresh_snapshot,
+)
+from .metrics import render_prometheus
+from .models import (
+    Category,
+    Item,
+    MenuChange,
+    Queue,
+    Restaurant,
+    User,
+    Variation,
+    Order,
+    Task,
+)
+from .pagination import RestaurantCursorPagination
+from .rendering import JsonResponse, loads
+from .routing import reads_from_replica, replica_reads
+from .search import search_menu
+from .seating import seat_waiting_parties
 from .serializers import (
     CategorySerializer,
     ItemSerializer,
     RestaurantSerializer,
     VariationSerializer,
 )
+from .square_client import get_square_client
+from .square_tasks import (
+    LOCATION_ID,
+    create_checkout,
+    create_order_invoice,
+    record_inventory_sale,
+    set_inventory_count,
+    sync_menu_category,
+)
+from .tasks import enqueue, run_now
+from .throttling import TokenBucketThrottle, rate_limit, square_bound
+from .webhooks import is_valid_signature, store_event
 
 
 @csrf_exempt
+@rate_limit("register")
 def register(request):
     if request.method == "POST":
-        data = json.loads(request.body)
+        data = loads(request.body)
         email = data.get("email", None)
         password = data.get("password", None)
 
@@ -57,9 +110,10 @@ def register(request):
 
 
 @csrf_exempt
+@rate_limit("login")
 def login(request):
     if request.method == "POST":
-        data = json.loads(request.body)
+        data = loads(request.body)
         email = data.get("email", None)
         password = data.get("password", None)
 
@@ -72,13 +126,71 @@ def login(request):
             return JsonResponse({"error": "Invalid email or password"}, status=400)
 
         if user.check_password(password):
-            return JsonResponse({"success": "User logged in successfully"}, status=200)
+            return JsonResponse(
+                {"success": "User logged in successfully", "token": issue_token(user)},
+                status=200,
+            )
         else:
             return JsonResponse({"error": "Invalid email or password"}, status=400)
     else:
         return JsonResponse({"error": "Invalid request method"}, status=400)
 
 
+@csrf_exempt
+def logout(request):
+    if request.method == "POST":
+        auth = get_authorization_header(request).split()
+        if len(auth) != 2 or auth[0].lower() != b"token":
+            return JsonResponse({"error": "Token required"}, status=401)
+
+        revoke_token(auth[1].decode())
+        return JsonResponse({"success": "User logged out successfully"}, status=200)
+    else:
+        return JsonResponse({"error": "Invalid request method"}, status=400)
+
+
+def prometheus_metrics(request):
+    if settings.METRICS_TOKEN:
+        auth = get_authorization_header(request).split()
+        if auth != [b"Bearer", settings.METRICS_TOKEN.encode()]:
+            return JsonResponse({"error": "Invalid metrics token"}, status=401)
+
+    return HttpResponse(
+        render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@csrf_exempt
+def square_webhook(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    url = settings.SQUARE_WEBHOOK_URL or request.build_absolute_uri()
+    if not is_valid_signature(
+        request.headers.get("x-square-hmacsha256-signature"),
+        url,
+        request.body,
+        settings.SQUARE_WEBHOOK_SIGNATURE_KEY,
+    ):
+        return JsonResponse({"error": "Invalid signature"}, status=403)
+
+    # Applied later by process_webhooks; Square only needs to know it landed.
+    try:
+        store_event(loads(request.body))
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": "Malformed event"}, status=400)
+    return JsonResponse({"success": "Event received"}, status=200)
+
+
+def get_request_user(request, email=None):
+    # Token-authenticated requests already carry the user; older clients
+    # still identify themselves with an email field.
+    if isinstance(request.user, User):
+        return request.user
+    return get_object_or_404(User, email=email)
+
+
+@method_decorator(replica_reads, name="dispatch")
 class NearbyRestaurantsAPIView(APIView):
     def get(self, request):
         lat = request.query_params.get("lat")
@@ -86,8 +198,9 @@ class NearbyRestaurantsAPIView(APIView):
         radius = 5000  # radius in meters
         user_location = Point(float(long), float(lat), srid=4326)
         # Make a request to the Google Places API
-        url = f"https://maps.googleapis.com/maps/api/place/nearbysearch/json?location={lat},{long}&radius={radius}&type=restaurant&key={settings.GOOGLE_MAPS_API_KEY}"
-        response = requests.get(url)
+        url = f"{settings.GOOGLE_PLACES_BASE_URL}/nearbysearch/json?location={lat},{long}&radius={radius}&type=restaurant&key={settings.GOOGLE_MAPS_API_KEY}"
+        with timed("google.places"):
+            response = requests.get(url)
         data = response.json()
 
         # Extract relevant restaurant data
@@ -127,205 +240,45 @@ class NearbyRestaurantsAPIView(APIView):
         return Response(nearby_restaurants)
 
 
-def get_square_client():
-    return Client(
-        access_token=settings.SQUARE_SANDBOX_ACCESS_TOKEN,
-        environment="sandbox",  # Use 'production' for the production environment
-    )
-
-
-def upsert_catalog_object(client, object_body):
-    response = client.catalog.upsert_catalog_object(object_body)
-    if response.is_success():
-        return {"success": response.body["catalog_object"]}
-    elif response.is_error():
-        return {"error": response.errors}
-
-
-def upsert_category(client, category, restaurant_id):
-    idempotency_key = str(uuid.uuid4())
-    id_value = f"#{category['name'].replace(' ', '_')}__{restaurant_id}"
-    category_body = {
-        "idempotency_key": idempotency_key,
-        "object": {
-            "type": "CATEGORY",
-            "id": id_value,
-            "category_data": {"name": category["name"]},
-        },
+def adjust_inventory(restaurant, inventory_data):
+    """Sets local stock and queues the same counts for Square."""
+    quantities = {
+        inventory_item["variation_reference_id"]: int(inventory_item["quantity"])
+        for inventory_item in inventory_data
     }
-    return upsert_catalog_object(client, category_body)
-
-
-def upsert_item(client, item, restaurant_id):
-    idempotency_key = str(uuid.uuid4())
-    id_value = f"#{item['name'].replace(' ', '_')}__{restaurant_id}"
-
-    variations = [
-        {
-            "type": "ITEM_VARIATION",
-            "id": f"{id_value}_{v['name']}",
-            "item_variation_data": {
-                "item_id": id_value,
-                "name": v["name"],
-                "pricing_type": "FIXED_PRICING",
-                "price_money": {"amount": v["price"], "currency": "USD"},
-            },
-        }
-        for v in item.get("variations", [])
-    ]
-    item_body = {
-        "idempotency_key": idempotency_key,
-        "object": {
-            "type": "ITEM",
-            "id": id_value,
-            "item_data": {
-                "name": item["name"],
-                "description": item.get("description"),
-                "category_id": item["category_id"],
-                "variations": variations,
-            },
-        },
+    variations = {
+        variation.reference_id: variation
+        for variation in Variation.objects.filter(reference_id__in=quantities)
     }
-
-    response = upsert_catalog_object(client, item_body)
-
-    if "success" in response:
-        variation_ids = [
-            v["id"] for v in response["success"]["item_data"]["variations"]
-        ]
-        return {
-            "success": {
-                "item_id": response["success"]["id"],
-                "variation_ids": variation_ids,
-            }
-        }
-
-    return response
-
-
-def set_inventory_count(client, catalog_object_id, quantity):
-    responses = []
-    for variation_id in catalog_object_id:
-        body = {
-            "idempotency_key": str(uuid.uuid4()),
-            "changes": [
-                {
-                    "type": "ADJUSTMENT",
-                    "adjustment": {
-                        "location_id": "LS3AWJK2V4HW5",
-                        "catalog_object_id": str(variation_id),
-                        "from_state": "NONE",
-                        "to_state": "IN_STOCK",
-                        "quantity": str(quantity),
-                        "occurred_at": datetime.now(timezone.utc).isoformat(),
-                    },
-                }
-            ],
-        }
-        response = client.inventory.batch_change_inventory(body)
-        if response.is_success():
-            print(f"Inventory set to {quantity} for variation id {variation_id}")
-            responses.append({"success": response.body})
-        elif response.is_error():
-            print(
-                f"Error setting inventory for variation id {variation_id}: {response.errors}"
-            )
-            responses.append({"error": response.errors})
-    return responses
-
-
-def adjust_inventory(client, restaurant, inventory_data, order_placed=False):
-    for inventory_item in inventory_data:
-        variation_reference_id = inventory_item["variation_reference_id"]
-        set_quantity = int(inventory_item["quantity"])
-
-        try:
-            variation = Variation.objects.get(reference_id=variation_reference_id)
-        except Variation.DoesNotExist:
+    for variation_reference_id in quantities:
+        if variation_reference_id not in variations:
             return {
                 "error": f"Variation with reference_id: {variation_reference_id} does not exist",
                 "status": 404,
             }
 
-        square_id = variation.square_id
-
-        result = client.inventory.batch_retrieve_inventory_counts(
-            body={
-                "catalog_object_ids": [str(square_id)],
-                "location_ids": ["LS3AWJK2V4HW5"],
-            }
+    changed_at = timezone.now()
+    occurred_at = changed_at.isoformat()
+    with transaction.atomic():
+        for variation_reference_id, quantity in quantities.items():
+            variation = variations[variation_reference_id]
+            variation.quantity = quantity
+            variation.quantity_changed_at = changed_at
+            enqueue(
+                set_inventory_count,
+                variation_id=variation.pk,
+                quantity=quantity,
+                occurred_at=occurred_at,
+                idempotency_key=str(uuid.uuid4()),
+            )
+        Variation.objects.bulk_update(
+            variations.values(), ["quantity", "quantity_changed_at"]
         )
-
-        if result.is_error():
-            return {
-                "error": f"Failed to retrieve current inventory for variation: {variation_reference_id}. Error: {result.errors}",
-                "status": 500,
-            }
-
-        current_quantity = int(result.body["counts"][0]["quantity"])
-        adjustment = set_quantity - current_quantity
-        body = {}
-        if order_placed:
-            body = {
-                "idempotency_key": str(uuid.uuid4()),
-                "changes": [
-                    {
-                        "type": "ADJUSTMENT",
-                        "adjustment": {
-                            "location_id": "LS3AWJK2V4HW5",
-                            "catalog_object_id": str(square_id),
-                            "from_state": "IN_STOCK",
-                            "to_state": "SOLD",
-                            "quantity": str(set_quantity),
-                            "occurred_at": datetime.now(timezone.utc).isoformat(),
-                        },
-                    }
-                ],
-            }
-        elif adjustment <= 0:
-            body = {
-                "idempotency_key": str(uuid.uuid4()),
-                "changes": [
-                    {
-                        "type": "ADJUSTMENT",
-                        "adjustment": {
-                            "location_id": "LS3AWJK2V4HW5",
-                            "catalog_object_id": str(square_id),
-                            "from_state": "IN_STOCK",
-                            "to_state": "WASTE",
-                            "quantity": str(abs(adjustment)),
-                            "occurred_at": datetime.now(timezone.utc).isoformat(),
-                        },
-                    }
-                ],
-            }
-        else:
-            body = {
-                "idempotency_key": str(uuid.uuid4()),
-                "changes": [
-                    {
-                        "type": "ADJUSTMENT",
-                        "adjustment": {
-                            "location_id": "LS3AWJK2V4HW5",
-                            "catalog_object_id": str(square_id),
-                            "from_state": "NONE",
-                            "to_state": "IN_STOCK",
-                            "quantity": str(adjustment),
-                            "occurred_at": datetime.now(timezone.utc).isoformat(),
-                        },
-                    }
-                ],
-            }
-        response = client.inventory.batch_change_inventory(body)
-
-        if response.is_error():
-            return {
-                "error": f"Failed to update inventory for variation: {variation_reference_id}. Error: {response.errors}",
-                "status": 500,
-            }
-
-        variation.quantity = set_quantity
-        variation.save()
+        record_menu_changes(
+            restaurant.pk,
+            [(MenuChange.VARIATION, variation.pk) for variation in variations.values()],
+        )
+    invalidate_snapshot(restaurant.place_id)
 
     return {"message": "Inventory updated successfully", "status": 200}
 
@@ -353,24 +306,91 @@ def retrieve_order(client, order_id):
         return {"error": response.errors}
 
 
-def create_invoice(client, location_id, order_id):
-    due_date = (datetime.now() + timedelta(days=5)).date()
-    body = {
-        "invoice": {
-            "location_id": location_id,
-            "order_id": order_id,
-            "payment_requests": [{"request_type": "BALANCE", "due_date": due_date}],
-            "delivery_method": "EMAIL",
-            "accepted_payment_methods": {"card": True},
-        },
-        "idempotency_key": str(uuid.uuid4()),
-    }
-    return client.invoices.create_invoice(body=body)
+def record_order(user, restaurant, order, variations):
+    """Saves a new Square order, takes its line items out of local stock and
+    queues the matching sales and the invoice, all in one transaction.
+    ``variations`` maps square ids to the ordered variations."""
+    sold = defaultdict(int)
+    for line_item in order["line_items"]:
+        sold[line_item["catalog_object_id"]] += int(line_item["quantity"])
+
+    changed_at = timezone.now()
+    occurred_at = changed_at.isoformat()
+    with transaction.atomic():
+        created_order = Order.objects.create(
+            user=user, order_id=order["id"], square_order=order
+        )
+        for square_id, quantity in sold.items():
+            Variation.objects.filter(pk=variations[square_id].pk).update(
+                quantity=F("quantity") - quantity, quantity_changed_at=changed_at
+            )
+            enqueue(
+                record_inventory_sale,
+                square_id=square_id,
+                quantity=quantity,
+                occurred_at=occurred_at,
+                idempotency_key=str(uuid.uuid4()),
+            )
+        record_menu_changes(
+            restaurant.pk,
+            [(MenuChange.VARIATION, variations[square_id].pk) for square_id in sold],
+        )
+        invoice_task = enqueue(
+            create_order_invoice,
+            order_id=order["id"],
+            idempotency_key=str(uuid.uuid4()),
+        )
+    invalidate_snapshot(restaurant.place_id)
+    return created_order, invoice_task
 
 
 class RestaurantViewSet(viewsets.ModelViewSet):
     queryset = Restaurant.objects.all()
     serializer_class = RestaurantSerializer
+    pagination_class = RestaurantCursorPagination
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scopes = {
+        "join_queue": "join-queue",
+        "place_order": "place-order",
+        "upsert_menu": "upsert-menu",
+    }
+    # Pure reads, served from a replica when one is configured.
+    replica_actions = {
+        "list",
+        "retrieve",
+        "get_menu",
+        "available_seats",
+        "availability",
+        "search",
+        "get_queue_size",
+    }
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.action_map.get(request.method.lower()) not in self.replica_actions:
+            return super().dispatch(request, *args, **kwargs)
+        with reads_from_replica(request):
+            return super().dispatch(request, *args, **kwargs)
+
+    def expand(self):
+        expand = self.request.query_params.get("expand")
+        if expand is None:
+            # Only the listing leaves out the nested menu by default.
+            return set() if self.action == "list" else {"categories"}
+        return {name for name in expand.split(",") if name}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if "categories" in self.expand():
+            queryset = queryset.prefetch_related("categories__items__variations")
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["expand"] = self.expand()
+        fields = self.request.query_params.get("fields")
+        if fields:
+            context["fields"] = {name for name in fields.split(",") if name}
+        return context
 
     @action(detail=False, methods=["post"], url_path="(?P<place_id>[^/.]+)/upsert-menu")
     def upsert_menu(self, request, place_id=None):
@@ -383,71 +403,39 @@ class RestaurantViewSet(viewsets.ModelViewSet):
             )
 
         menu_data = request.data.get("menu_data")
-        client = get_square_client()
-        for category in menu_data:
-            category_response = upsert_category(client, category, place_id)
-            if "error" in category_response:
-                return Response(
-                    {
-                        "error": f'Failed to upsert category: {category["name"]}. Error: {category_response["error"]}'
-                    },
-                    status=500,
-                )
-
-            category_id = category_response["success"]["id"]
-
-            try:
-                with transaction.atomic():
+        # Saved locally first; a task per category then upserts it to the
+        # Square catalog and stores the ids Square assigns.
+        sync_tasks = []
+        try:
+            with transaction.atomic():
+                for category in menu_data:
                     category_obj, created = Category.objects.get_or_create(
-                        name=category["name"], restaurant=restaurant
-                    )
-                    category_obj.category_id = category_id
-                    category_obj.square_id = category_response["success"]["id"]
-                    category_obj.save()
-            except Exception as e:
-                return Response(
-                    {
-                        "error": f'Failed to upsert category: {category["name"]} in DB. Error: {str(e)}'
-                    },
-                    status=500,
-                )
-
-            for item in category.get("items", []):
-                item["category_id"] = category_id
-                item_response = upsert_item(client, item, place_id)
-                if "error" in item_response:
-                    return Response(
-                        {
-                            "error": f'Failed to upsert item: {item["name"]}. Error: {item_response["error"]}'
+                        name=category["name"],
+                        restaurant=restaurant,
+                        defaults={
+                            "category_id": f"#{category['name'].replace(' ', '_')}__{place_id}"
                         },
-                        status=500,
                     )
+                    changes = [(MenuChange.CATEGORY, category_obj.pk)]
 
-                item_id = item_response["success"]["item_id"]
-                variation_ids = item_response["success"]["variation_ids"]
-
-                inventory_response = set_inventory_count(client, variation_ids, 100)
-                if "error" in inventory_response:
-                    return Response(
-                        {
-                            "error": f'Failed to set default inventory for item: {item["name"]}. Error: {inventory_response["error"]}'
-                        },
-                        status=500,
-                    )
-
-                try:
-                    with transaction.atomic():
+                    for item in category.get("items", []):
+                        item_reference_id = (
+                            f"#{item['name'].replace(' ', '_')}__{place_id}"
+                        )
                         item_obj, created = Item.objects.update_or_create(
                             name=item["name"],
                             category=category_obj,
                             defaults={
-                                "item_id": item_id,
                                 "description": item.get("description", None),
-                                "reference_id": f"#{item['name'].replace(' ', '_')}__{place_id}",
-                                "square_id": item_response["success"]["item_id"],
+                                "reference_id": item_reference_id,
                             },
                         )
-                        for i, variation in enumerate(item.get("variations", [])):
+                        if created:
+                            # Replaced by the catalog id once synced.
+                            item_obj.item_id = item_reference_id
+                            item_obj.save(update_fields=["item_id"])
+                        changes.append((MenuChange.ITEM, item_obj.pk))
+                        for variation in item.get("variations", []):
                             variation_obj, created = Variation.objects.update_or_create(
                                 name=variation["name"],
                                 item=item_obj,
@@ -456,21 +444,53 @@ class RestaurantViewSet(viewsets.ModelViewSet):
                                     "quantity": variation.get("quantity", 100),
                                     "variation_id": f"#{variation['name'].replace(' ', '_')}__{place_id}",
                                     "reference_id": f"#{item['name'].replace(' ', '_')}__{variation['name'].replace(' ', '_')}__{place_id}",
-                                    "square_id": variation_ids[i],
                                 },
                             )
-                except Exception as e:
-                    return Response(
-                        {
-                            "error": f'Failed to upsert item: {item["name"]} in DB. Error: {str(e)}'
-                        },
-                        status=500,
+                            changes.append((MenuChange.VARIATION, variation_obj.pk))
+
+                    record_menu_changes(restaurant.pk, changes)
+                    sync_tasks.append(
+                        enqueue(
+                            sync_menu_category,
+                            category_id=category_obj.pk,
+                            idempotency_key=str(uuid.uuid4()),
+                        )
                     )
+        except Exception as e:
+            return Response(
+                {"error": f"Failed to upsert menu in DB. Error: {str(e)}"},
+                status=500,
+            )
 
-        return Response({"success": "Menu upserted successfully."}, status=200)
+        refresh_snapshot(restaurant)
+        return Response(
+            {
+                "success": "Menu upserted successfully.",
+                "task_ids": [task.pk for task in sync_tasks],
+            },
+            status=200,
+        )
 
-    @action(detail=True, methods=["get"], url_path="get-menu")
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path="get-menu",
+        renderer_classes=[*api_settings.DEFAULT_RENDERER_CLASSES, MenuSnapshotRenderer],
+    )
     def get_menu(self, request, pk=None):
+        since = request.query_params.get("since")
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return Response({"error": "since must be an integer"}, status=400)
+
+        wants_snapshot = request.accepted_renderer.format == MenuSnapshotRenderer.format
+        if wants_snapshot and since is None:
+            snapshot = cached_snapshot(pk)
+            if snapshot is not None:
+                return Response(snapshot, status=200)
+
         try:
             restaurant = Restaurant.objects.get(place_id=pk)
         except Restaurant.DoesNotExist:
@@ -478,10 +498,33 @@ class RestaurantViewSet(viewsets.ModelViewSet):
                 {"error": f"Restaurant with place_id: {pk} does not exist"}, status=404
             )
 
+        if since is not None:
+            if wants_snapshot:
+                delta = packed_menu_delta(restaurant, since)
+            else:
+                delta = menu_delta(restaurant, since)
+            if delta is not None:
+                return Response(delta, status=200)
+
+        # Clients too far behind for the change log get the whole menu.
+        if wants_snapshot:
+            snapshot = cached_snapshot(pk) or refresh_snapshot(restaurant)
+            return Response(snapshot, status=200)
+
         categories = restaurant.categories.all()
         serialized_categories = CategorySerializer(categories, many=True).data
+        if since is not None:
+            serialized_categories = {
+                "version": restaurant.menu_version,
+                "full": True,
+                "categories": serialized_categories,
+            }
 
-        return Response(serialized_categories, status=200)
+        return Response(
+            serialized_categories,
+            status=200,
+            headers={"X-Menu-Version": str(restaurant.menu_version)},
+        )
 
     @action(detail=True, methods=["get"], url_path="available-seats")
     def available_seats(self, request, pk=None):
@@ -494,6 +537,91 @@ class RestaurantViewSet(viewsets.ModelViewSet):
 
         return Response({"available_seats": restaurant.available_seats}, status=200)
 
+    @action(detail=False, methods=["get"], url_path="availability")
+    def availability(self, request):
+        place_ids = [
+            place_id
+            for value in request.query_params.getlist("place_ids")
+            for place_id in value.split(",")
+            if place_id
+        ]
+        place_ids = list(dict.fromkeys(place_ids))
+        if not place_ids:
+            return Response({"error": "place_ids parameter is required"}, status=400)
+        if len(place_ids) > settings.AVAILABILITY_MAX_PLACE_IDS:
+            return Response(
+                {
+                    "error": f"At most {settings.AVAILABILITY_MAX_PLACE_IDS} place_ids can be requested at once"
+                },
+                status=400,
+            )
+
+        try:
+            estimate = BooleanField().to_internal_value(
+                request.query_params.get("estimate", False)
+            )
+        except ValidationError:
+            return Response({"error": "estimate must be true or false"}, status=400)
+
+        party_size = None
+        if estimate:
+            try:
+                party_size = int(request.query_params.get("party_size", 1))
+            except ValueError:
+                party_size = 0
+            if party_size <= 0:
+                return Response(
+                    {"error": "Party size must be a positive integer"}, status=400
+                )
+
+        snapshot = availability_snapshot(place_ids, party_size)
+        return Response(
+            {
+                "restaurants": [snapshot[p] for p in place_ids if snapshot.get(p)],
+                "not_found": [p for p in place_ids if not snapshot.get(p)],
+            },
+            status=200,
+        )
+
+    @action(detail=False, methods=["get"], url_path="search")
+    def search(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response({"error": "q parameter is required"}, status=400)
+
+        try:
+            limit = int(
+                request.query_params.get("limit", settings.MENU_SEARCH_MAX_RESULTS)
+            )
+            radius = int(
+                request.query_params.get("radius", settings.MENU_SEARCH_RADIUS_METERS)
+            )
+        except ValueError:
+            return Response(
+                {"error": "limit and radius must be positive integers"}, status=400
+            )
+        if limit <= 0 or radius <= 0:
+            return Response(
+                {"error": "limit and radius must be positive integers"}, status=400
+            )
+
+        location = None
+        lat = request.query_params.get("lat")
+        lng = request.query_params.get("lng")
+        if lat is not None or lng is not None:
+            try:
+                location = Point(float(lng), float(lat), srid=4326)
+            except (TypeError, ValueError):
+                return Response({"error": "lat and lng must be numbers"}, status=400)
+
+        results = search_menu(
+            query,
+            location,
+            min(radius, settings.MENU_SEARCH_MAX_RADIUS_METERS),
+            min(limit, settings.MENU_SEARCH_MAX_RESULTS),
+        )
+        return Response({"results": results}, status=200)
+
     @action(detail=True, methods=["post"], url_path="update-inventory")
     def update_inventory(self, request, pk=None):
         try:
@@ -503,10 +631,9 @@ class RestaurantViewSet(viewsets.ModelViewSet):
                 {"error": f"Restaurant with place_id: {pk} does not exist"}, status=404
             )
 
-        client = get_square_client()
         inventory_data = request.data.get("inventory_data", [])
 
-        response = adjust_inventory(client, restaurant, inventory_data)
+        response = adjust_inventory(restaurant, inventory_data)
 
         if "error" in response:
             return Response(
@@ -516,6 +643,7 @@ class RestaurantViewSet(viewsets.ModelViewSet):
         return Response(response, status=response.get("status", 200))
 
     @action(detail=True, methods=["post"], url_path="place-order")
+    @square_bound
     def place_order(self, request, pk=None):
         try:
             restaurant = Restaurant.objects.get(place_id=pk)
@@ -524,10 +652,9 @@ class RestaurantViewSet(viewsets.ModelViewSet):
                 {"error": f"Restaurant with place_id: {pk} does not exist"}, status=404
             )
 
-        email = request.data.get("email")
-        user = get_object_or_404(User, email=email)
+        user = get_request_user(request, request.data.get("email"))
 
-        catalog_to_variation_id = {}
+        variations_by_square_id = {}
         order_data = request.data.get("order_data", [])
         line_items = []
         for item in order_data:
@@ -552,59 +679,41 @@ class RestaurantViewSet(viewsets.ModelViewSet):
                     "catalog_object_id": variation_obj.square_id,
                 }
             )
-            catalog_to_variation_id[variation_obj.square_id] = variation_reference_id
+            variations_by_square_id[variation_obj.square_id] = variation_obj
 
         client = get_square_client()
-        response = create_order(client, "LS3AWJK2V4HW5", line_items)
+        response = create_order(client, LOCATION_ID, line_items)
         if "error" in response:
             return Response(
                 {"error": f'Failed to place order. Error: {response["error"]}'},
                 status=500,
             )
 
-        order = retrieve_order(client, response["success"]["order"]["id"])["order"]
-        order_id = response["success"]["order"]["id"]
-
-        created_order = Order.objects.create(user=user, order_id=order_id)
-
-        line_item_counts = defaultdict(int)
-
-        for item in order["line_items"]:
-            line_item_counts[catalog_to_variation_id[item["catalog_object_id"]]] += int(
-                item["quantity"]
-            )
-
-        inventory_data = [
-            {"variation_reference_id": variation_id, "quantity": str(quantity)}
-            for variation_id, quantity in line_item_counts.items()
-        ]
-
-        inventory_response = adjust_inventory(client, restaurant, inventory_data, True)
-
-        if "error" in inventory_response:
-            return Response(
-                {"error": inventory_response["error"]},
-                status=inventory_response.get("status", 500),
-            )
-
-        invoice_result = create_invoice(client, "LS3AWJK2V4HW5", order_id)
-        if invoice_result.is_error():
-            return Response(
-                {"error": f"Failed to create invoice. Error: {invoice_result.errors}"},
-                status=500,
-            )
+        order = response["success"]["order"]
+        created_order, invoice_task = record_order(
+            user, restaurant, order, variations_by_square_id
+        )
+        # Tried inline so the reply usually carries the invoice; if Square
+        # is slow to accept it, a worker retries and get-invoice finds it.
+        invoice_task = run_now(invoice_task)
+        invoice_id = (
+            invoice_task.result["invoice_id"]
+            if invoice_task.status == Task.DONE
+            else None
+        )
 
         return Response(
             {
                 "message": "Order placed and inventory updated successfully",
-                "order_id": response["success"]["order"]["id"],
-                "invoice_id": invoice_result.body["invoice"]["id"],
+                "order_id": order["id"],
+                "invoice_id": invoice_id,
                 "uoi": created_order.unique_order_identifier,
             },
             status=200,
         )
 
     @action(detail=True, methods=["get"], url_path="retrieve-order")
+    @square_bound
     def retrieve_order(self, request, pk=None):
         client = get_square_client()
         order_id = request.query_params.get("order_id")
@@ -612,28 +721,52 @@ class RestaurantViewSet(viewsets.ModelViewSet):
         if not order_id:
             return Response({"error": "order_id parameter is required"}, status=400)
 
+        # Kept current by Square's webhooks.
+        if uoiObject.square_order is not None:
+            return Response(
+                {
+                    "order": uoiObject.square_order,
+                    "uoi": uoiObject.unique_order_identifier,
+                    "invoice_id": uoiObject.invoice_id,
+                },
+                status=200,
+            )
+
         result = retrieve_order(client, order_id)
         result["uoi"] = uoiObject.unique_order_identifier
+        result["invoice_id"] = uoiObject.invoice_id
         if "error" in result:
             return Response(result, status=400)
         else:
+            uoiObject.square_order = result["order"]
+            uoiObject.save(update_fields=["square_order"])
             return Response(result, status=200)
 
     @action(detail=True, methods=["get"], url_path="get-invoice")
+    @square_bound
     def get_invoice(self, request, pk=None):
         client = get_square_client()
         invoice_id = request.query_params.get("invoice_id")
         if not invoice_id:
             return Response({"error": "invoice_id parameter is required"}, status=400)
 
+        order = Order.objects.filter(invoice_id=invoice_id).first()
+        if order is not None and order.square_invoice is not None:
+            return Response({"invoice": order.square_invoice}, status=200)
+
         result = client.invoices.get_invoice(invoice_id)
 
         if result.is_success():
+            invoice = result.body["invoice"]
+            Order.objects.filter(order_id=invoice.get("order_id")).update(
+                invoice_id=invoice_id, square_invoice=invoice
+            )
             return Response(result.body, status=200)
         elif result.is_error():
             return Response({"error": result.errors}, status=500)
 
     @action(detail=True, methods=["post"], url_path="checkout")
+    @square_bound
     def create_terminal_checkout(self, request, pk=None):
         try:
             restaurant = Restaurant.objects.get(place_id=pk)
@@ -655,12 +788,14 @@ class RestaurantViewSet(viewsets.ModelViewSet):
 
         order_id = order_obj.order_id
 
-        client = get_square_client()
-        response = retrieve_order(client, order_id)
-        if "error" in response:
-            return Response(response, status=400)
-
-        order = response["order"]
+        # Kept current by Square's webhooks.
+        order = order_obj.square_order
+        if order is None:
+            client = get_square_client()
+            response = retrieve_order(client, order_id)
+            if "error" in response:
+                return Response(response, status=400)
+            order = response["order"]
 
         if order["state"] != "OPEN":
             return Response(
@@ -668,34 +803,31 @@ class RestaurantViewSet(viewsets.ModelViewSet):
             )
 
         total_money = order["total_money"]
-        amount = total_money["amount"]
-        currency = total_money["currency"]
-
-        checkout_request_body = {
-            "idempotency_key": str(uuid.uuid4()),
-            "checkout": {
-                "amount_money": {"amount": amount, "currency": currency},
-                "order_id": order_id,
-                "device_options": {"device_id": "9fa747a2-25ff-48ee-b078-04381f7c828f"},
-                "payment_type": "CARD_PRESENT",
+        user = get_request_user(request, request.data.get("email"))
+        checkout_task = enqueue(
+            create_checkout,
+            order_id=order_id,
+            user_id=user.pk,
+            amount_money={
+                "amount": total_money["amount"],
+                "currency": total_money["currency"],
             },
-        }
-
-        result = client.terminal.create_terminal_checkout(body=checkout_request_body)
-
-        if result.is_success():
-            email = request.data.get("email")
-            user = User.objects.get(email=email)
-            user.is_seated = False
-            user.save()
-            return Response(result.body, status=200)
-        elif result.is_error():
-            return Response({"error": result.errors}, status=500)
+            idempotency_key=str(uuid.uuid4()),
+        )
+        checkout_task = run_now(checkout_task)
+        if checkout_task.status == Task.DONE:
+            return Response(checkout_task.result, status=200)
+        return Response(
+            {
+                "message": "Checkout queued; it is retried until Square accepts it.",
+                "task_id": checkout_task.pk,
+            },
+            status=202,
+        )
 
     @action(detail=True, methods=["post"], url_path="join-queue")
     def join_queue(self, request, pk=None):
-        email = request.data.get("email")
-        user = get_object_or_404(User, email=email)
+        user = get_request_user(request, request.data.get("email"))
 
         try:
             restaurant = Restaurant.objects.get(place_id=pk)
@@ -717,41 +849,114 @@ class RestaurantViewSet(viewsets.ModelViewSet):
                 status=400,
             )
 
+        if request.auth is not None:
+            # Cached token users may carry a seating flag changed elsewhere.
+            user.refresh_from_db(fields=["is_seated"])
+
         if user.is_seated:
             return Response(
                 {"error": "User is already seated at a restaurant"}, status=400
             )
 
-        if restaurant.available_seats >= party_size:
-            restaurant.available_seats -= party_size
-            restaurant.save()
+        with transaction.atomic():
+            # Locked as in seat_waiting_parties, so concurrent joins and
+            # releases cannot lose seat updates.
+            restaurant = Restaurant.objects.select_for_update().get(pk=restaurant.pk)
+            seated_directly = restaurant.available_seats >= party_size
+            if seated_directly:
+                restaurant.available_seats -= party_size
+                # A full save would write back a stale menu_version.
+                restaurant.save(update_fields=["available_seats"])
 
-            user.is_seated = True
-            user.save()
+                user.is_seated = True
+                user.save(update_fields=["is_seated"])
+
+                log_seated_directly(restaurant, user, party_size)
+            else:
+                position = (
+                    Queue.objects.filter(restaurant=restaurant).aggregate(
+                        sum=Sum("party_size")
+                    )["sum"]
+                    or 0
+                )
+                position += 1
+                Queue.objects.create(
+                    restaurant=restaurant,
+                    user=user,
+                    party_size=party_size,
+                    position=position,
+                )
+                log_joined(restaurant, user, party_size, position)
+
+        if seated_directly:
+            notify_seated(restaurant, [user.pk])
+            notify_availability(
+                restaurant,
+                Queue.objects.filter(restaurant=restaurant).aggregate(
+                    total=Sum("party_size")
+                )["total"]
+                or 0,
+            )
 
             return Response(
                 {"success": f"You can directly go and sit at {restaurant.name}"},
                 status=200,
             )
         else:
-            queue_entry = Queue.objects.create(
-                restaurant=restaurant, user=user, party_size=party_size
-            )
-            position = (
-                Queue.objects.filter(
-                    restaurant=restaurant, joined_at__lt=queue_entry.joined_at
-                ).aggregate(sum=Sum("party_size"))["sum"]
-                or 0
-            )
-            position += 1
+            notify_position(restaurant, user.pk, position)
+            notify_availability(restaurant, position + party_size - 1)
+
             return Response(
                 {
                     "success": f"You have joined the queue.",
                     "position": position,
+                    "estimated_wait_seconds": WaitTimeEstimator().estimate(
+                        restaurant.pk, party_size, position, restaurant.total_seats
+                    ),
                 },
                 status=200,
             )
 
+    @action(detail=True, methods=["get"], url_path="queue-position")
+    def queue_position(self, request, pk=None):
+        user = get_request_user(request, request.query_params.get("email"))
+
+        try:
+            restaurant = Restaurant.objects.get(place_id=pk)
+        except Restaurant.DoesNotExist:
+            return Response(
+                {"error": f"Restaurant with place_id: {pk} does not exist"}, status=404
+            )
+
+        try:
+            queue_entry = Queue.objects.get(restaurant=restaurant, user=user)
+        except Queue.DoesNotExist:
+            return Response(
+                {"error": f"User is not in the queue for {restaurant.name}"},
+                status=404,
+            )
+
+        position = (
+            Queue.objects.filter(
+                restaurant=restaurant, joined_at__lt=queue_entry.joined_at
+            ).aggregate(sum=Sum("party_size"))["sum"]
+            or 0
+        )
+        position += 1
+
+        return Response(
+            {
+                "position": position,
+                "estimated_wait_seconds": WaitTimeEstimator().estimate(
+                    restaurant.pk,
+                    queue_entry.party_size,
+                    position,
+                    restaurant.total_seats,
+                ),
+            },
+            status=200,
+        )
+
     @action(detail=True, methods=["get"], url_path="queue-size")
     def get_queue_size(self, request, pk=None):
         try:
@@ -787,28 +992,11 @@ class RestaurantViewSet(viewsets.ModelViewSet):
                 status=400,
             )
 
-        restaurant.available_seats = min(
-            restaurant.available_seats + seats_released, restaurant.total_seats
-        )
-        restaurant.save()
-
-        queues = Queue.objects.filter(restaurant=restaurant).order_by("joined_at")
-
-        seated_users = []
-        for queue in queues:
-            if queue.party_size <= restaurant.available_seats:
-                restaurant.available_seats -= queue.party_size
-                restaurant.save()
-
-                user = get_object_or_404(User, email=queue.user.email)
-                seated_users.append(user.email)
+        seated = seat_waiting_parties(restaurant, released_seats=seats_released)
+        seated_users = [queue.user.email for queue in seated]
 
-                user.is_seated = True
-                user.save()
-
-                queue.delete()
-            else:
-                break
+        notify_seated(restaurant, [queue.user_id for queue in seated])
+        notify_queue_changed(restaurant)
 
         return Response(
             {
@@ -0,0 +1,226 @@
+import base64
+import hashlib
+import hmac
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import metrics
+from .estimation import log_released
+from .menu_changes import record_menu_changes
+from .menu_snapshot import invalidate_snapshot
+from .models import MenuChange, Order, User, Variation, WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+webhook_events = metrics.counter(
+    "dineq_square_webhook_events_total",
+    "Square webhook events processed, by event type and outcome.",
+    ["type", "outcome"],
+)
+
+# Payment and checkout statuses that later events may not overwrite.
+FINAL_STATUSES = {"COMPLETED", "CANCELED", "FAILED"}
+
+
+def signature_for(url, body, key):
+    digest = hmac.new(key.encode(), url.encode() + body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def is_valid_signature(signature, url, body, key):
+    """Square signs the notification URL followed by the raw body with
+    HMAC-SHA256 and sends it base64-encoded."""
+    if not key or not signature:
+        return False
+    return hmac.compare_digest(signature, signature_for(url, body, key))
+
+
+def store_event(event):
+    WebhookEvent.objects.bulk_create(
+        [
+            WebhookEvent(
+                event_id=event["event_id"],
+                event_type=event["type"],
+                payload=event,
+            )
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def release_diner(user_id):
+    if User.objects.filter(pk=user_id, is_seated=True).update(is_seated=False):
+        log_released(User(pk=user_id))
+
+
+def locked_order(order_id):
+    if not order_id:
+        return None
+    return Order.objects.select_for_update().filter(order_id=order_id).first()
+
+
+def apply_order(data):
+    # Order events only carry the new state and version.
+    change = data.get("order_updated") or data.get("order_created") or {}
+    order = locked_order(change.get("order_id"))
+    if order is None or order.square_order is None:
+        return
+    if change.get("version", 0) > order.square_order.get("version", 0):
+        order.square_order.update(
+            state=change.get("state"),
+            version=change.get("version"),
+            updated_at=change.get("updated_at"),
+        )
+        order.save(update_fields=["square_order"])
+
+
+def apply_payment(data):
+    payment = data.get("payment", {})
+    order = locked_order(payment.get("order_id"))
+    if order is None or order.payment_status in FINAL_STATUSES:
+        return
+    order.payment_status = payment.get("status", "")
+    order.save(update_fields=["payment_status"])
+    if order.payment_status == "COMPLETED":
+        release_diner(order.user_id)
+
+
+def apply_invoice(data):
+    invoice = data.get("invoice", {})
+    order = locked_order(invoice.get("order_id"))
+    if order is None:
+        return
+    if invoice.get("version", 0) < (order.square_invoice or {}).get("version", 0):
+        return
+    order.invoice_id = invoice.get("id")
+    order.square_invoice = invoice
+    order.save(update_fields=["invoice_id", "square_invoice"])
+    if invoice.get("status") == "PAID":
+        release_diner(order.user_id)
+
+
+def apply_checkout(data):
+    checkout = data.get("checkout", {})
+    if checkout.get("status") != "COMPLETED":
+        return
+    order = locked_order(checkout.get("order_id"))
+    if order is not None:
+        release_diner(order.user_id)
+
+
+def apply_inventory(data):
+    counts = {
+        count["catalog_object_id"]: (
+            int(count["quantity"]),
+            parse_datetime(count.get("calculated_at") or ""),
+        )
+        for count in data.get("inventory_counts", [])
+        if count.get("state") == "IN_STOCK"
+    }
+    rows = (
+        Variation.objects.select_for_update(of=("self",))
+        .filter(square_id__in=counts)
+        .values_list(
+            "pk",
+            "square_id",
+            "quantity",
+            "quantity_changed_at",
+            "item__category__restaurant_id",
+            "item__category__restaurant__place_id",
+        )
+    )
+    changed = []
+    changes = defaultdict(list)
+    place_ids = {}
+    for pk, square_id, quantity, changed_at, restaurant_id, place_id in rows:
+        count, calculated_at = counts[square_id]
+        # Square echoes back the counts this app set itself, and may deliver
+        # counts calculated before a newer local change.
+        if quantity == count or (
+            changed_at and calculated_at and calculated_at < changed_at
+        ):
+            continue
+        changed.append(
+            Variation(
+                pk=pk,
+                quantity=count,
+                quantity_changed_at=calculated_at or timezone.now(),
+            )
+        )
+        changes[restaurant_id].append((MenuChange.VARIATION, pk))
+        place_ids[restaurant_id] = place_id
+    Variation.objects.bulk_update(changed, ["quantity", "quantity_changed_at"])
+    for restaurant_id, restaurant_changes in changes.items():
+        record_menu_changes(restaurant_id, restaurant_changes)
+        transaction.on_commit(
+            lambda place_id=place_ids[restaurant_id]: invalidate_snapshot(place_id)
+        )
+
+
+HANDLERS = {
+    "order.created": apply_order,
+    "order.updated": apply_order,
+    "payment.created": apply_payment,
+    "payment.updated": apply_payment,
+    "invoice.created": apply_invoice,
+    "invoice.published": apply_invoice,
+    "invoice.updated": apply_invoice,
+    "invoice.payment_made": apply_invoice,
+    "invoice.canceled": apply_invoice,
+    "terminal.checkout.updated": apply_checkout,
+    "inventory.count.updated": apply_inventory,
+}
+
+
+def apply_event(event):
+    handler = HANDLERS.get(event.event_type)
+    if handler is not None:
+        handler(event.payload.get("data", {}).get("object", {}))
+
+
+def process_events(now=None):
+    """Applies the pending events in the order they arrived, trying each one
+    at most once per call. Returns how many were applied."""
+    now = now or timezone.now()
+    pending = WebhookEvent.objects.filter(
+        processed_at__isnull=True,
+        attempts__lt=settings.WEBHOOK_MAX_ATTEMPTS,
+        received_at__lte=now - timedelta(seconds=settings.WEBHOOK_SETTLE_SECONDS),
+    ).order_by("id")
+
+    applied = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                pending.filter(id__gt=last_id).select_for_update(skip_locked=True)[
+                    : settings.WEBHOOK_BATCH_SIZE
+                ]
+            )
+            if not batch:
+                return applied
+            last_id = batch[-1].id
+            for event in batch:
+                event.attempts += 1
+                try:
+                    with transaction.atomic():
+                        apply_event(event)
+                except Exception as e:
+                    logger.exception("webhook event %s failed", event.event_id)
+                    event.error = repr(e)
+                    outcome = "error"
+                else:
+                    event.processed_at = timezone.now()
+                    event.error = ""
+                    outcome = "applied"
+                    applied += 1
+                webhook_events.inc(type=event.event_type, outcome=outcome)
+            WebhookEvent.objects.bulk_update(
+                batch, ["attempts", "processed_at", "error"]
+            )